@@ -11,6 +11,9 @@ if TYPE_CHECKING:
 from requests_toolbelt import MultipartEncoder
 from bs4 import BeautifulSoup
 from datetime import datetime, timedelta
+from http import cookiejar
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import requests
 import logging
 import random
@@ -20,12 +23,22 @@ import time
 import re
 
 from . import types
-from .common import exceptions, utils, enums
+from .common import exceptions, utils, enums, html_parser
 
 logger = logging.getLogger("FunPayAPI.account")
 PRIVATE_CHAT_ID_RE = re.compile(r"users-\d+-\d+$")
 
 
+class _BlockAllCookies(cookiejar.CookiePolicy):
+    """
+    Политика, запрещающая сессии запоминать куки: они передаются в заголовках каждого запроса явно,
+    поэтому одну сессию могут безопасно делить несколько аккаунтов.
+    """
+    return_ok = set_ok = domain_return_ok = path_return_ok = lambda self, *args, **kwargs: False
+    netscape = True
+    rfc2965 = hide_cookie2 = False
+
+
 class Account:
     """
     Класс для управления аккаунтом FunPay.
@@ -44,11 +57,28 @@ class Account:
 
     :param locale: текущий язык аккаунта, опционально.
     :type locale: :obj:`Literal["ru", "en", "uk"]` or :obj:`None`
+
+    :param session: HTTP-сессия (пул соединений), которую нужно использовать. Если не передана, создается новая
+        через :meth:`FunPayAPI.account.Account.make_session`.
+    :type session: :class:`requests.Session` or :obj:`None`
+
+    :param pool_connections: кол-во пулов соединений (хостов), которые хранит сессия.
+    :type pool_connections: :obj:`int`
+
+    :param pool_maxsize: максимальное кол-во keep-alive соединений с одним хостом.
+    :type pool_maxsize: :obj:`int`
+
+    :param max_retries: кол-во повторных попыток при ошибках соединения.
+    :type max_retries: :obj:`int`
+
+    :param keep_html: сохранять ли HTML-код в виджетах чатов, сообщениях, заказах и лотах (атрибут html).
+    :type keep_html: :obj:`bool`
     """
 
     def __init__(self, golden_key: str, user_agent: str | None = None,
                  requests_timeout: int | float = 10, proxy: Optional[dict] = None,
-                 locale: Literal["ru", "en", "uk"] | None = None):
+                 locale: Literal["ru", "en", "uk"] | None = None, session: requests.Session | None = None,
+                 pool_connections: int = 4, pool_maxsize: int = 10, max_retries: int = 2, keep_html: bool = False):
         self.golden_key: str = golden_key
         """Токен (golden_key) аккаунта."""
         self.user_agent: str | None = user_agent
@@ -57,8 +87,12 @@ class Account:
         """Тайм-аут ожидания ответа на запросы."""
         self.proxy = proxy
         """Прокси"""
+        self.session: requests.Session = session or self.make_session(pool_connections, pool_maxsize, max_retries)
+        """HTTP-сессия с пулом keep-alive соединений. Может быть передана в другой экземпляр Account."""
         self.html: str | None = None
         """HTML основной страницы FunPay."""
+        self.keep_html: bool = keep_html
+        """Сохранять ли HTML-код в ChatShortcut, Message, OrderShortcut, LotShortcut и MyLotShortcut."""
         self.app_data: dict | None = None
         """Appdata."""
         self.id: int | None = None
@@ -128,6 +162,34 @@ class Account:
         self.__old_bot_character = "⁤"
         """Старое значение self.__bot_character, для корректной маркировки отправки ботом старых сообщений"""
 
+    @staticmethod
+    def make_session(pool_connections: int = 4, pool_maxsize: int = 10, max_retries: int = 2) -> requests.Session:
+        """
+        Создает HTTP-сессию с пулом keep-alive соединений и повторными попытками при ошибках соединения.
+        Повторяются только ошибки установки соединения и чтения идемпотентных (GET) запросов,
+        POST-запросы, дошедшие до сервера, повторно не отправляются.
+
+        :param pool_connections: кол-во пулов соединений (хостов), которые хранит сессия.
+        :type pool_connections: :obj:`int`
+
+        :param pool_maxsize: максимальное кол-во keep-alive соединений с одним хостом.
+        :type pool_maxsize: :obj:`int`
+
+        :param max_retries: кол-во повторных попыток.
+        :type max_retries: :obj:`int`
+
+        :return: HTTP-сессия.
+        :rtype: :class:`requests.Session`
+        """
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=0, redirect=0,
+                      backoff_factor=0.3, raise_on_status=False, respect_retry_after_header=False)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        session = requests.Session()
+        session.cookies.set_policy(_BlockAllCookies())
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
     def method(self, request_method: Literal["post", "get"], api_method: str, headers: dict, payload: Any,
                exclude_phpsessid: bool = False, raise_not_200: bool = False,
                locale: Literal["ru", "en", "uk"] | None = None) -> requests.Response:
@@ -155,50 +217,64 @@ class Account:
         :return: объект ответа.
         :rtype: :class:`requests.Response`
         """
-
-        def normalize_url(api_method: str, locale: Literal["ru", "en", "uk"] | None = None) -> str:
-            api_method = "https://funpay.com/" if api_method == "https://funpay.com" else api_method
-            url = api_method if api_method.startswith("https://funpay.com/") else "https://funpay.com/" + api_method
-            locales = ("en", "uk")
-            for loc in locales:
-                url = url.replace(f"https://funpay.com/{loc}/", "https://funpay.com/", 1)
-            if not locale:
-                locale = self.locale
-            if locale in locales:
-                return url.replace(f"https://funpay.com/", f"https://funpay.com/{locale}/", 1)
-            return url
-
-        def update_locale(redirect_url: str):
-            for locale in ("en", "uk"):
-                if redirect_url.startswith(f"https://funpay.com/{locale}/"):
-                    self.__locale = locale
-                    return
-            if redirect_url.startswith(f"https://funpay.com"):
-                self.__locale = "ru"
-
+        link = self._prepare_request(request_method, api_method, headers, exclude_phpsessid, locale)
+        for i in range(10):
+            response = self.session.request(request_method, link, headers=headers, data=payload,
+                                            timeout=self.requests_timeout,
+                                            proxies=self.proxy or {}, allow_redirects=False)
+            if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
+                break
+            link = response.headers['Location']
+            self._update_locale_from_url(link)
+        else:
+            response = self.session.request(request_method, link, headers=headers, data=payload,
+                                            timeout=self.requests_timeout,
+                                            proxies=self.proxy or {})
+        return self._check_response(response, raise_not_200)
+
+    def _normalize_url(self, api_method: str, locale: Literal["ru", "en", "uk"] | None = None) -> str:
+        api_method = "https://funpay.com/" if api_method == "https://funpay.com" else api_method
+        url = api_method if api_method.startswith("https://funpay.com/") else "https://funpay.com/" + api_method
+        locales = ("en", "uk")
+        for loc in locales:
+            url = url.replace(f"https://funpay.com/{loc}/", "https://funpay.com/", 1)
+        if not locale:
+            locale = self.locale
+        if locale in locales:
+            return url.replace(f"https://funpay.com/", f"https://funpay.com/{locale}/", 1)
+        return url
+
+    def _update_locale_from_url(self, redirect_url: str):
+        for locale in ("en", "uk"):
+            if redirect_url.startswith(f"https://funpay.com/{locale}/"):
+                self.__locale = locale
+                return
+        if redirect_url.startswith(f"https://funpay.com"):
+            self.__locale = "ru"
+
+    def _prepare_request(self, request_method: Literal["post", "get"], api_method: str, headers: dict,
+                         exclude_phpsessid: bool = False, locale: Literal["ru", "en", "uk"] | None = None) -> str:
+        """
+        Добавляет в заголовки запроса user_agent и куки и формирует ссылку с учетом языка.
+        Общая часть :meth:`FunPayAPI.account.Account.method` и асинхронного клиента.
+
+        :return: ссылка, по которой нужно отправить запрос.
+        :rtype: :obj:`str`
+        """
         headers["cookie"] = f"golden_key={self.golden_key}; cookie_prefs=1"
         headers["cookie"] += f"; PHPSESSID={self.phpsessid}" if self.phpsessid and not exclude_phpsessid else ""
         if self.user_agent:
             headers["user-agent"] = self.user_agent
         if request_method == "post" and locale:
-            link = normalize_url(api_method, locale)
+            link = self._normalize_url(api_method, locale)
         else:
-            link = normalize_url(api_method)
+            link = self._normalize_url(api_method)
         locale = locale or self.__set_locale
         if request_method == "get" and locale and locale != self.locale:
             link += f'{"&" if "?" in link else "?"}setlocale={locale}'
-        for i in range(10):
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {}, allow_redirects=False)
-            if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
-                break
-            link = response.headers['Location']
-            update_locale(link)
-        else:
-            response = getattr(requests, request_method)(link, headers=headers, data=payload,
-                                                         timeout=self.requests_timeout,
-                                                         proxies=self.proxy or {})
+        return link
+
+    def _check_response(self, response: requests.Response, raise_not_200: bool = False) -> requests.Response:
         if response.status_code == 429:
             self.last_429_err_time = time.time()
 
@@ -219,13 +295,19 @@ class Account:
         :return: объект аккаунта с обновленными данными.
         :rtype: :class:`FunPayAPI.account.Account`
         """
+        self._before_get()
+        response = self.method("get", "https://funpay.com/", {}, {}, update_phpsessid, raise_not_200=True)
+        return self._parse_account_page(response, update_phpsessid)
+
+    def _before_get(self):
         if not self.is_initiated:
             self.locale = self.__subcategories_parse_locale
-        response = self.method("get", "https://funpay.com/", {}, {}, update_phpsessid, raise_not_200=True)
+
+    def _parse_account_page(self, response: requests.Response, update_phpsessid: bool = True) -> Account:
         if not self.is_initiated:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
             raise exceptions.UnauthorizedError(response)
@@ -282,7 +364,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -348,7 +430,7 @@ class Account:
 
             lot_obj = types.LotShortcut(offer_id, server, side, description, amount, price, currency, subcategory_obj,
                                         seller,
-                                        auto, promo, attributes, str(offer))
+                                        auto, promo, attributes, self._keep_html(offer))
             result.append(lot_obj)
         return result
 
@@ -370,7 +452,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -404,7 +486,7 @@ class Account:
             amount = int(amount) if amount and amount.isdigit() else None
             active = "warning" not in offer.get("class", [])
             lot_obj = types.MyLotShortcut(offer_id, server, side, description, amount, price, currency, subcategory_obj,
-                                          auto, active, str(offer))
+                                          auto, active, self._keep_html(offer))
             result.append(lot_obj)
         return result
 
@@ -427,7 +509,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
             raise exceptions.UnauthorizedError(response)
@@ -479,7 +561,7 @@ class Account:
             raise exceptions.AccountNotInitiatedError()
         response = self.method("get", f"lots/offer?id={lot_id}", {"accept": "*/*"}, {}, raise_not_200=True)
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -555,6 +637,12 @@ class Account:
         :return: словарь с историями чатов в формате {ID чата: [список сообщений]}
         :rtype: :obj:`dict` {:obj:`int`: :obj:`list` of :class:`FunPayAPI.types.Message`}
         """
+        headers, payload = self._chats_histories_payload(chats_data, interlocutor_ids)
+        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return self._parse_chats_histories(response, chats_data)
+
+    def _chats_histories_payload(self, chats_data: dict[int | str, str | None],
+                                 interlocutor_ids: list[int] | None = None) -> tuple[dict, dict]:
         headers = {
             "accept": "*/*",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -571,7 +659,10 @@ class Account:
             "request": False,
             "csrf_token": self.csrf_token
         }
-        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return headers, payload
+
+    def _parse_chats_histories(self, response: requests.Response,
+                               chats_data: dict[int | str, str | None]) -> dict[int, list[types.Message]]:
         json_response = response.json()
 
         result = {}
@@ -687,6 +778,13 @@ class Account:
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
 
+        headers, payload = self._send_message_payload(chat_id, text, image_id, leave_as_unread)
+        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+        return self._parse_sent_message(response, chat_id, text, chat_name, interlocutor_id, add_to_ignore_list,
+                                        update_last_saved_message, leave_as_unread)
+
+    def _send_message_payload(self, chat_id: int | str, text: Optional[str] = None, image_id: Optional[int] = None,
+                              leave_as_unread: bool = False) -> tuple[dict, dict]:
         headers = {
             "accept": "*/*",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -716,8 +814,12 @@ class Account:
             "request": json.dumps(request),
             "csrf_token": self.csrf_token
         }
+        return headers, payload
 
-        response = self.method("post", "runner/", headers, payload, raise_not_200=True)
+    def _parse_sent_message(self, response: requests.Response, chat_id: int | str, text: Optional[str] = None,
+                            chat_name: Optional[str] = None, interlocutor_id: Optional[int] = None,
+                            add_to_ignore_list: bool = True, update_last_saved_message: bool = False,
+                            leave_as_unread: bool = False) -> types.Message:
         json_response = response.json()
         if not (resp := json_response.get("response")):
             raise exceptions.MessageNotDeliveredError(response, None, chat_id)
@@ -744,11 +846,11 @@ class Account:
             </div>
             """
             message_obj = types.Message(0, message_text, chat_id, chat_name, interlocutor_id, self.username, self.id,
-                                        fake_html, None,
+                                        self._keep_html(fake_html), None,
                                         None)
         else:
             mes = json_response["objects"][0]["data"]["messages"][-1]
-            parser = BeautifulSoup(mes["html"].replace("<br>", "\n"), "lxml")
+            parser = html_parser.parse(mes["html"].replace("<br>", "\n"))
             image_name = None
             image_link = None
             message_text = None
@@ -766,7 +868,7 @@ class Account:
                 raise e
             message_obj = types.Message(int(mes["id"]), message_text, chat_id, chat_name, interlocutor_id,
                                         self.username, self.id,
-                                        mes["html"], image_link, image_name)
+                                        self._keep_html(mes["html"]), image_link, image_name)
         if self.runner and isinstance(chat_id, int):
             if add_to_ignore_list and message_obj.id:
                 self.runner.mark_as_by_bot(chat_id, message_obj.id)
@@ -903,6 +1005,11 @@ class Account:
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
 
+        headers, payload = self._refund_payload(order_id)
+        response = self.method("post", "orders/refund", headers, payload, raise_not_200=True)
+        self._check_refund_response(response, order_id)
+
+    def _refund_payload(self, order_id) -> tuple[dict, dict]:
         headers = {
             "accept": "*/*",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -913,9 +1020,10 @@ class Account:
             "id": order_id,
             "csrf_token": self.csrf_token
         }
+        return headers, payload
 
-        response = self.method("post", "orders/refund", headers, payload, raise_not_200=True)
-
+    @staticmethod
+    def _check_refund_response(response: requests.Response, order_id):
         if response.json().get("error"):
             raise exceptions.RefundError(response, response.json().get("msg"), order_id)
 
@@ -1018,6 +1126,12 @@ class Account:
         """
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
+        category, headers, payload = self._raise_lots_payload(category_id, subcategories, exclude)
+        response = self.method("post", "lots/raise", headers, payload, raise_not_200=True)
+        return self._parse_raise_response(response, category)
+
+    def _raise_lots_payload(self, category_id: int, subcategories: Optional[list[int | types.SubCategory]] = None,
+                            exclude: list[int] | None = None) -> tuple[types.Category, dict, dict]:
         if not (category := self.get_category(category_id)):
             raise Exception("Not Found")  # todo
 
@@ -1046,8 +1160,10 @@ class Account:
             "node_id": subcats[0].id,
             "node_ids[]": [i.id for i in subcats]
         }
+        return category, headers, payload
 
-        response = self.method("post", "lots/raise", headers, payload, raise_not_200=True)
+    @staticmethod
+    def _parse_raise_response(response: requests.Response, category: types.Category) -> bool:
         json_response = response.json()
         logger.debug(f"Ответ FunPay (поднятие категорий): {json_response}.")  # locale
         if not json_response.get("error") and not json_response.get("url"):
@@ -1079,7 +1195,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
 
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
@@ -1136,7 +1252,7 @@ class Account:
                 lot_obj = types.LotShortcut(offer_id, server, side, description, amount, price, currency,
                                             subcategory_obj,
                                             None, auto,
-                                            None, None, str(j))
+                                            None, None, self._keep_html(j))
                 user_obj.add_lot(lot_obj)
         return user_obj
 
@@ -1163,7 +1279,7 @@ class Account:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
         if (name := parser.find("div", {"class": "chat-header"}).find("div", {"class": "media-user-name"}).find(
                 "a").text) in ("Чат", "Chat"):
             raise Exception("chat not found")  # todo
@@ -1209,13 +1325,19 @@ class Account:
         headers = {
             "accept": "*/*"
         }
-        if not locale:
-            locale = self.__order_parse_locale
+        locale = self._order_locale(locale)
         response = self.method("get", f"orders/{order_id}/", headers, {}, raise_not_200=True, locale=locale)
+        return self._parse_order(response, order_id, locale)
+
+    def _order_locale(self, locale: Literal["ru", "en", "uk"] | None = None) -> Literal["ru", "en", "uk"] | None:
+        return locale or self.__order_parse_locale
+
+    def _parse_order(self, response: requests.Response, order_id: str,
+                     locale: Literal["ru", "en", "uk"] | None = None) -> types.Order:
         if locale:
             self.locale = self.__default_locale
         html_response = response.content.decode()
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
         username = parser.find("div", {"class": "user-link-name"})
         if not username:
             raise exceptions.UnauthorizedError(response)
@@ -1335,7 +1457,9 @@ class Account:
                   state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
                   section: Optional[str] = None, server: Optional[int] = None,
                   side: Optional[int] = None, locale: Literal["ru", "en", "uk"] | None = None,
-                  subcategories: dict[str, tuple[types.SubCategoryTypes, int]] | None = None, **more_filters) -> \
+                  subcategories: dict[str, tuple[types.SubCategoryTypes, int]] | None = None,
+                  known_orders: dict[str, types.OrderStatuses] | None = None, wait_for: set[str] | None = None,
+                  **more_filters) -> \
             tuple[str | None, list[types.OrderShortcut], Literal["ru", "en", "uk"],
             dict[str, types.SubCategory]]:
         """
@@ -1380,6 +1504,16 @@ class Account:
         :param side: ID стороны (платформы).
         :type side: :obj:`int`, опционально.
 
+        :param known_orders: уже известные заказы ({ID заказа: статус}). Строки известных заказов, статус которых
+            не изменился, не парсятся и не попадают в список. Первая страница (`start_from` не передан) разбирается
+            целиком, на следующих разбор прекращается на первой такой строке. Если такая строка встретилась после того,
+            как встретились все заказы из `wait_for`, вместо ID след. заказа возвращается `None`.
+        :type known_orders: :obj:`dict` {:obj:`str`: :class:`FunPayAPI.common.enums.OrderStatuses`}, опционально
+
+        :param wait_for: ID заказов, до которых нужно дочитать страницу, даже если выше встретились известные заказы.
+            Встреченные ID удаляются из множества, поэтому его можно передавать в запросы следующих страниц.
+        :type wait_for: :obj:`set` of :obj:`str`, опционально
+
         :param more_filters: доп. фильтры.
 
         :return: (ID след. заказа (для start_from), список заказов)
@@ -1388,9 +1522,19 @@ class Account:
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
 
-        exclude_ids = exclude_ids or []
         _subcategories = more_filters.pop("sudcategories", None)
         subcategories = subcategories or _subcategories
+        link, filters, locale = self._sales_request(start_from, id, buyer, state, game, section, server, side,
+                                                    locale, **more_filters)
+        response = self.method("post" if start_from else "get", link, {}, filters, raise_not_200=True, locale=locale)
+        return self._parse_sales(response, start_from, include_paid, include_closed, include_refunded, exclude_ids,
+                                 locale, subcategories, known_orders, wait_for)
+
+    def _sales_request(self, start_from: str | None = None, id: Optional[str] = None, buyer: Optional[str] = None,
+                       state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
+                       section: Optional[str] = None, server: Optional[int] = None, side: Optional[int] = None,
+                       locale: Literal["ru", "en", "uk"] | None = None, **more_filters) -> \
+            tuple[str, dict, Literal["ru", "en", "uk"] | None]:
         filters = {"id": id, "buyer": buyer, "state": state, "game": game, "section": section, "server": server,
                    "side": side}
         filters = {name: filters[name] for name in filters if filters[name]}
@@ -1403,14 +1547,23 @@ class Account:
 
         if start_from:
             filters["continue"] = start_from
-
-        locale = locale or self.__profile_parse_locale
-        response = self.method("post" if start_from else "get", link, {}, filters, raise_not_200=True, locale=locale)
+        return link, filters, locale or self.__profile_parse_locale
+
+    def _parse_sales(self, response: requests.Response, start_from: str | None = None, include_paid: bool = True,
+                     include_closed: bool = True, include_refunded: bool = True,
+                     exclude_ids: list[str] | None = None, locale: Literal["ru", "en", "uk"] | None = None,
+                     subcategories: dict[str, tuple[types.SubCategoryTypes, int]] | None = None,
+                     known_orders: dict[str, types.OrderStatuses] | None = None,
+                     wait_for: set[str] | None = None) -> \
+            tuple[str | None, list[types.OrderShortcut], Literal["ru", "en", "uk"],
+            dict[str, types.SubCategory]]:
+        exclude_ids = exclude_ids or []
+        wait_for = wait_for if wait_for is not None else set()
         if not start_from:
             self.locale = self.__default_locale
         html_response = response.content.decode()
 
-        parser = BeautifulSoup(html_response, "lxml")
+        parser = html_parser.parse(html_response)
 
         if not start_from:
             username = parser.find("div", {"class": "user-link-name"})
@@ -1461,6 +1614,14 @@ class Account:
             order_id = div.find("div", {"class": "tc-order"}).text[1:]
             if order_id in exclude_ids:
                 continue
+            if known_orders is not None and order_id in known_orders:
+                wait_for.discard(order_id)
+                if known_orders[order_id] == order_status:
+                    if not wait_for:
+                        next_order_id = None
+                        if start_from:
+                            break
+                    continue
 
             description = div.find("div", {"class": "order-desc"}).find("div").text
             tc_price = div.find("div", {"class": "tc-price"}).text
@@ -1500,7 +1661,8 @@ class Account:
             id1, id2 = sorted([buyer_id, self.id])
             chat_id = f"users-{id1}-{id2}"
             order_obj = types.OrderShortcut(order_id, description, price, currency, buyer_username, buyer_id, chat_id,
-                                            order_status, order_date, subcategory_name, subcategory, str(div))
+                                            order_status, order_date, subcategory_name, subcategory,
+                                            self._keep_html(div))
             sales.append(order_obj)
 
         return next_order_id, sales, locale, subcategories
@@ -1561,7 +1723,7 @@ class Account:
         if not msgs:
             return []
 
-        parser = BeautifulSoup(msgs, "lxml")
+        parser = html_parser.parse(msgs)
         chats = parser.find_all("a", {"class": "contact-item"})
         chats_objs = []
 
@@ -1581,7 +1743,8 @@ class Account:
             elif last_msg_text.startswith(self.old_bot_character):
                 last_msg_text = last_msg_text[1:]
                 by_vertex = True
-            chat_obj = types.ChatShortcut(chat_id, chat_with, last_msg_text, node_msg_id, user_msg_id, unread, str(msg))
+            chat_obj = types.ChatShortcut(chat_id, chat_with, last_msg_text, node_msg_id, user_msg_id, unread,
+                                          self._keep_html(msg))
             if not is_image:
                 chat_obj.last_by_bot = by_bot
                 chat_obj.last_by_vertex = by_vertex
@@ -1708,9 +1871,11 @@ class Account:
             raise exceptions.AccountNotInitiatedError()
         headers = {}
         response = self.method("get", f"lots/offerEdit?offer={lot_id}", headers, {}, raise_not_200=True)
+        return self._parse_lot_fields(response, lot_id)
 
+    def _parse_lot_fields(self, response: requests.Response, lot_id: int) -> types.LotFields:
         html_response = response.content.decode()
-        bs = BeautifulSoup(html_response, "lxml")
+        bs = html_parser.parse(html_response)
         error_message = bs.find("p", class_="lead")
         if error_message:
             raise exceptions.LotParsingError(response, error_message.text, lot_id)
@@ -1746,7 +1911,7 @@ class Account:
         response = self.method("get", f"chips/{subcategory_id}/trade", headers, {}, raise_not_200=True)
 
         html_response = response.content.decode()
-        bs = BeautifulSoup(html_response, "lxml")
+        bs = html_parser.parse(html_response)
         result = {field["name"]: field.get("value") or "" for field in bs.find_all("input") if field["name"] != "query"}
         result.update({field["name"]: "on" for field in bs.find_all("input", {"type": "checkbox"}, checked=True)})
         return types.ChipFields(self.id, subcategory_id, result)
@@ -1760,6 +1925,11 @@ class Account:
         """
         if not self.is_initiated:
             raise exceptions.AccountNotInitiatedError()
+        id_, api_method, headers, fields = self._save_offer_payload(offer_fields)
+        response = self.method("post", api_method, headers, fields, raise_not_200=True)
+        self._check_save_offer_response(response, id_)
+
+    def _save_offer_payload(self, offer_fields: types.LotFields | types.ChipFields) -> tuple[int, str, dict, dict]:
         headers = {
             "accept": "*/*",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
@@ -1776,7 +1946,10 @@ class Account:
             id_ = offer_fields.subcategory_id
             fields = offer_fields.renew_fields().fields
             api_method = "chips/saveOffers"
-        response = self.method("post", api_method, headers, fields, raise_not_200=True)
+        return id_, api_method, headers, fields
+
+    @staticmethod
+    def _check_save_offer_response(response: requests.Response, id_: int):
         json_response = response.json()
         errors_dict = {}
         if (errors := json_response.get("errors")) or json_response.get("error"):
@@ -1822,7 +1995,7 @@ class Account:
             self.currency = currency
             return 1, currency
         else:
-            s = BeautifulSoup(b["modal"], "lxml").find("p", class_="lead").text.replace("\xa0", " ")
+            s = html_parser.parse(b["modal"]).find("p", class_="lead").text.replace("\xa0", " ")
             match = RegularExpressions().EXCHANGE_RATE.fullmatch(s)
             assert match is not None
             swipe_to = match.group(2)
@@ -1930,7 +2103,7 @@ class Account:
 
         :param html: HTML страница.
         """
-        parser = BeautifulSoup(html, "lxml")
+        parser = html_parser.parse(html)
         games_table = parser.find_all("div", {"class": "promo-game-list"})
         if not games_table:
             return
@@ -1978,6 +2151,9 @@ class Account:
                          interlocutor_id: Optional[int] = None, interlocutor_username: Optional[str] = None,
                          from_id: int = 0) -> list[types.Message]:
         messages = []
+        # данные, извлеченные из HTML сообщения при первом (и единственном) разборе:
+        # (текст метки автора "label-default", ссылки на пользователей в системном сообщении)
+        extracted = []
         ids = {self.id: self.username, 0: "FunPay"}
         badges = {}
         if interlocutor_id is not None:
@@ -1987,11 +2163,11 @@ class Account:
             if i["id"] < from_id:
                 continue
             author_id = i["author"]
-            parser = BeautifulSoup(i["html"].replace("<br>", "\n"), "lxml")
+            parser = html_parser.parse(i["html"].replace("<br>", "\n"))
+            author_div = parser.find("div", {"class": "media-user-name"})
 
             # Если ник или бейдж написавшего неизвестен, но есть блок с данными об авторе сообщения
-            if None in [ids.get(author_id), badges.get(author_id)] and (
-                    author_div := parser.find("div", {"class": "media-user-name"})):
+            if None in [ids.get(author_id), badges.get(author_id)] and author_div:
                 if badges.get(author_id) is None:
                     badge = author_div.find("span", {"class": "chat-msg-author-label label label-success"})
                     badges[author_id] = badge.text if badge else 0
@@ -2031,18 +2207,23 @@ class Account:
                 #     by_vertex = True
 
             message_obj = types.Message(i["id"], message_text, chat_id, interlocutor_username, interlocutor_id,
-                                        None, author_id, i["html"], image_link, image_name, determine_msg_type=False)
+                                        None, author_id, self._keep_html(i["html"]), image_link, image_name,
+                                        determine_msg_type=False)
             message_obj.by_bot = by_bot
             message_obj.by_vertex = by_vertex
             message_obj.type = types.MessageTypes.NON_SYSTEM if author_id != 0 else message_obj.get_message_type()
 
+            default_label = author_div.find("span", {
+                "class": "chat-msg-author-label label label-default"}) if author_div else None
+            users = parser.find_all('a', href=lambda href: href and '/users/' in href) \
+                if message_obj.type != types.MessageTypes.NON_SYSTEM else []
             messages.append(message_obj)
+            extracted.append((default_label.text if default_label else None, users))
 
-        for i in messages:
+        for i, (default_label, users) in zip(messages, extracted):
             i.author = ids.get(i.author_id)
             i.chat_name = interlocutor_username
             i.badge = badges.get(i.author_id) if badges.get(i.author_id) != 0 else None
-            parser = BeautifulSoup(i.html, "lxml")
             if i.badge:
                 i.is_employee = True
                 if i.badge in ("поддержка", "підтримка", "support"):
@@ -2051,15 +2232,11 @@ class Account:
                     i.is_moderation = True
                 elif i.badge in ("арбитраж", "арбітраж", "arbitration"):
                     i.is_arbitration = True
-            default_label = parser.find("div", {"class": "media-user-name"})
-            default_label = default_label.find("span", {
-                "class": "chat-msg-author-label label label-default"}) if default_label else None
             if default_label:
-                if default_label.text in ("автовідповідь", "автоответ", "auto-reply"):
+                if default_label in ("автовідповідь", "автоответ", "auto-reply"):
                     i.is_autoreply = True
-            i.badge = default_label.text if (i.badge is None and default_label is not None) else i.badge
+            i.badge = default_label if (i.badge is None and default_label is not None) else i.badge
             if i.type != types.MessageTypes.NON_SYSTEM:
-                users = parser.find_all('a', href=lambda href: href and '/users/' in href)
                 if users:
                     i.initiator_username = users[0].text
                     i.initiator_id = int(users[0]["href"].split("/")[-2])
@@ -2100,7 +2277,10 @@ class Account:
 
         return messages
 
-    def __update_csrf_token(self, parser: BeautifulSoup):
+    def _keep_html(self, html: Any) -> str | None:
+        return str(html) if self.keep_html else None
+
+    def __update_csrf_token(self, parser: html_parser.Node | BeautifulSoup):
         try:
             app_data = json.loads(parser.find("body").get("data-app-data"))
             self.csrf_token = app_data.get("csrf-token") or self.csrf_token
@@ -2118,7 +2298,7 @@ class Account:
         html = json_responce["data"]["html"]
         if html:
             html = html["desktop"]
-            element = BeautifulSoup(html, "lxml").find("a")
+            element = html_parser.parse(html).find("a")
             link, text = element.get("href"), element.text
         else:
             html, link, text = None, None, None
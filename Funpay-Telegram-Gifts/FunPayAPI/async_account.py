@@ -0,0 +1,304 @@
+from __future__ import annotations
+from typing import Literal, Any, Optional, IO
+
+import asyncio
+import logging
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.models import RequestEncodingMixin
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+from .account import Account
+from . import types
+from .common import exceptions
+
+logger = logging.getLogger("FunPayAPI.async_account")
+
+
+class AsyncAccount(Account):
+    """
+    Асинхронный клиент FunPay на aiohttp. Добавляет к методам :class:`FunPayAPI.account.Account` корутины
+    с префиксом `a` (:meth:`aget`, :meth:`aget_order`, :meth:`aget_sales`, :meth:`asend_message`, :meth:`arefund`,
+    :meth:`aget_lot_fields`, :meth:`asave_lot`, :meth:`araise_lots`, :meth:`aget_chats_histories` и др.),
+    которые могут выполняться одновременно в одном event loop'е.
+
+    Парсинг ответов общий с :class:`FunPayAPI.account.Account`, поэтому результаты методов совпадают.
+    Методы без префикса не переопределяются: они остаются синхронными и работают через
+    :py:obj:`.Account.session`, поэтому AsyncAccount можно передавать и в синхронный код.
+
+    Для получения событий используйте :meth:`FunPayAPI.updater.runner.Runner.alisten`.
+
+    :param golden_key: токен (golden_key) аккаунта.
+    :type golden_key: :obj:`str`
+
+    :param user_agent: user-agent браузера, с которого был произведен вход в аккаунт.
+    :type user_agent: :obj:`str`
+
+    :param requests_timeout: тайм-аут ожидания ответа на запросы.
+    :type requests_timeout: :obj:`int` or :obj:`float`
+
+    :param proxy: прокси для запросов.
+    :type proxy: :obj:`dict` {:obj:`str`: :obj:`str` or :obj:`None`
+
+    :param locale: текущий язык аккаунта, опционально.
+    :type locale: :obj:`Literal["ru", "en", "uk"]` or :obj:`None`
+
+    :param client_session: aiohttp-сессия, которую нужно использовать. Если не передана, создается при первом
+        запросе и закрывается в :meth:`close`.
+    :type client_session: :class:`aiohttp.ClientSession` or :obj:`None`
+
+    :param pool_maxsize: максимальное кол-во одновременных соединений.
+    :type pool_maxsize: :obj:`int`
+
+    :param pool_per_host: максимальное кол-во одновременных соединений с одним хостом.
+    :type pool_per_host: :obj:`int`
+    """
+
+    def __init__(self, golden_key: str, user_agent: str | None = None,
+                 requests_timeout: int | float = 10, proxy: Optional[dict] = None,
+                 locale: Literal["ru", "en", "uk"] | None = None,
+                 client_session: aiohttp.ClientSession | None = None, pool_maxsize: int = 20,
+                 pool_per_host: int = 10, **kwargs):
+        if aiohttp is None:
+            raise ImportError("Для AsyncAccount необходим пакет aiohttp (pip install aiohttp).")
+        super().__init__(golden_key, user_agent, requests_timeout, proxy, locale, **kwargs)
+        self.client_session: aiohttp.ClientSession | None = client_session
+        """aiohttp-сессия с пулом keep-alive соединений."""
+        self.__own_session: bool = client_session is None
+        self.__pool_maxsize: int = pool_maxsize
+        self.__pool_per_host: int = pool_per_host
+
+    async def __aenter__(self) -> AsyncAccount:
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def _get_client_session(self) -> aiohttp.ClientSession:
+        if self.client_session is None or self.client_session.closed:
+            connector = aiohttp.TCPConnector(limit=self.__pool_maxsize, limit_per_host=self.__pool_per_host)
+            self.client_session = aiohttp.ClientSession(connector=connector, cookie_jar=aiohttp.DummyCookieJar(),
+                                                        timeout=aiohttp.ClientTimeout(total=self.requests_timeout))
+            self.__own_session = True
+        return self.client_session
+
+    async def close(self):
+        """
+        Закрывает aiohttp-сессию, если она была создана этим объектом.
+        """
+        if self.__own_session and self.client_session is not None and not self.client_session.closed:
+            await self.client_session.close()
+
+    async def amethod(self, request_method: Literal["post", "get"], api_method: str, headers: dict, payload: Any,
+                      exclude_phpsessid: bool = False, raise_not_200: bool = False,
+                      locale: Literal["ru", "en", "uk"] | None = None) -> requests.Response:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.method`.
+
+        Ответ aiohttp преобразуется в :class:`requests.Response`, поэтому парсеры и исключения
+        работают с ним так же, как и с ответами синхронного клиента.
+
+        :return: объект ответа.
+        :rtype: :class:`requests.Response`
+        """
+        link = self._prepare_request(request_method, api_method, headers, exclude_phpsessid, locale)
+        body = RequestEncodingMixin._encode_params(payload) if payload else None
+        if body and isinstance(payload, dict) and "content-type" not in {k.lower() for k in headers}:
+            headers["content-type"] = "application/x-www-form-urlencoded"
+        proxy = (self.proxy or {}).get("https") or (self.proxy or {}).get("http")
+        session = self._get_client_session()
+        for i in range(10):
+            response = await self.__request(session, request_method, link, headers, body, proxy, False)
+            if not (300 <= response.status_code < 400) or 'Location' not in response.headers:
+                break
+            link = response.headers['Location']
+            self._update_locale_from_url(link)
+        else:
+            response = await self.__request(session, request_method, link, headers, body, proxy, True)
+        return self._check_response(response, raise_not_200)
+
+    @staticmethod
+    async def __request(session: aiohttp.ClientSession, request_method: str, link: str, headers: dict,
+                        body: str | bytes | None, proxy: str | None, allow_redirects: bool) -> requests.Response:
+        async with session.request(request_method.upper(), link, headers=headers, data=body, proxy=proxy,
+                                   allow_redirects=allow_redirects) as resp:
+            content = await resp.read()
+            response = requests.Response()
+            response._content = content
+            response.status_code = resp.status
+            response.reason = resp.reason
+            response.url = str(resp.url)
+            response.headers = CaseInsensitiveDict(resp.headers)
+            response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+            for name, morsel in resp.cookies.items():
+                response.cookies.set(name, morsel.value)
+        response.request = requests.Request(request_method.upper(), link, headers=headers, data=body).prepare()
+        return response
+
+    async def aget(self, update_phpsessid: bool = True) -> AsyncAccount:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.get`.
+        """
+        self._before_get()
+        response = await self.amethod("get", "https://funpay.com/", {}, {}, update_phpsessid, raise_not_200=True)
+        return self._parse_account_page(response, update_phpsessid)
+
+    async def aget_chats_histories(self, chats_data: dict[int | str, str | None],
+                                   interlocutor_ids: list[int] | None = None) -> dict[int, list[types.Message]]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.get_chats_histories`.
+        """
+        headers, payload = self._chats_histories_payload(chats_data, interlocutor_ids)
+        response = await self.amethod("post", "runner/", headers, payload, raise_not_200=True)
+        return self._parse_chats_histories(response, chats_data)
+
+    async def asend_message(self, chat_id: int | str, text: Optional[str] = None, chat_name: Optional[str] = None,
+                            interlocutor_id: Optional[int] = None,
+                            image_id: Optional[int] = None, add_to_ignore_list: bool = True,
+                            update_last_saved_message: bool = False, leave_as_unread: bool = False) -> types.Message:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.send_message`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+
+        headers, payload = self._send_message_payload(chat_id, text, image_id, leave_as_unread)
+        response = await self.amethod("post", "runner/", headers, payload, raise_not_200=True)
+        return self._parse_sent_message(response, chat_id, text, chat_name, interlocutor_id, add_to_ignore_list,
+                                        update_last_saved_message, leave_as_unread)
+
+    async def asend_image(self, chat_id: int, image: int | str | IO[bytes], chat_name: Optional[str] = None,
+                          interlocutor_id: Optional[int] = None,
+                          add_to_ignore_list: bool = True, update_last_saved_message: bool = False,
+                          leave_as_unread: bool = False) -> types.Message:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.send_image`.
+        Выгрузка изображения выполняется синхронным клиентом в отдельном потоке.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+
+        if not isinstance(image, int):
+            image = await asyncio.to_thread(self.upload_image, image, "chat")
+        return await self.asend_message(chat_id, None, chat_name, interlocutor_id,
+                                        image, add_to_ignore_list, update_last_saved_message,
+                                        leave_as_unread)
+
+    async def arefund(self, order_id):
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.refund`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+
+        headers, payload = self._refund_payload(order_id)
+        response = await self.amethod("post", "orders/refund", headers, payload, raise_not_200=True)
+        self._check_refund_response(response, order_id)
+
+    async def araise_lots(self, category_id: int, subcategories: Optional[list[int | types.SubCategory]] = None,
+                          exclude: list[int] | None = None) -> bool:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.raise_lots`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+        category, headers, payload = self._raise_lots_payload(category_id, subcategories, exclude)
+        response = await self.amethod("post", "lots/raise", headers, payload, raise_not_200=True)
+        return self._parse_raise_response(response, category)
+
+    async def aget_order_shortcut(self, order_id: str) -> types.OrderShortcut:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.get_order_shortcut`.
+        """
+        if order := self.runner.saved_orders.get(order_id):
+            return order
+        return (await self.aget_sales(id=order_id))[1][0]
+
+    async def aget_order(self, order_id: str, locale: Literal["ru", "en", "uk"] | None = None) -> types.Order:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.get_order`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+        headers = {
+            "accept": "*/*"
+        }
+        locale = self._order_locale(locale)
+        response = await self.amethod("get", f"orders/{order_id}/", headers, {}, raise_not_200=True, locale=locale)
+        return self._parse_order(response, order_id, locale)
+
+    async def aget_sales(self, start_from: str | None = None, include_paid: bool = True, include_closed: bool = True,
+                         include_refunded: bool = True, exclude_ids: list[str] | None = None,
+                         id: Optional[str] = None, buyer: Optional[str] = None,
+                         state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
+                         section: Optional[str] = None, server: Optional[int] = None,
+                         side: Optional[int] = None, locale: Literal["ru", "en", "uk"] | None = None,
+                         subcategories: dict[str, tuple[types.SubCategoryTypes, int]] | None = None,
+                         known_orders: dict[str, types.OrderStatuses] | None = None, wait_for: set[str] | None = None,
+                         **more_filters) -> \
+            tuple[str | None, list[types.OrderShortcut], Literal["ru", "en", "uk"],
+            dict[str, types.SubCategory]]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.get_sales`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+
+        _subcategories = more_filters.pop("sudcategories", None)
+        subcategories = subcategories or _subcategories
+        link, filters, locale = self._sales_request(start_from, id, buyer, state, game, section, server, side,
+                                                    locale, **more_filters)
+        response = await self.amethod("post" if start_from else "get", link, {}, filters, raise_not_200=True,
+                                      locale=locale)
+        return self._parse_sales(response, start_from, include_paid, include_closed, include_refunded, exclude_ids,
+                                 locale, subcategories, known_orders, wait_for)
+
+    async def aget_sells(self, start_from: str | None = None, include_paid: bool = True, include_closed: bool = True,
+                         include_refunded: bool = True, exclude_ids: list[str] | None = None,
+                         id: Optional[str] = None, buyer: Optional[str] = None,
+                         state: Optional[Literal["closed", "paid", "refunded"]] = None, game: Optional[int] = None,
+                         section: Optional[str] = None, server: Optional[int] = None,
+                         side: Optional[int] = None, **more_filters) -> tuple[str | None, list[types.OrderShortcut]]:
+        """Эта функция вскоре будет удалена. Используйте AsyncAccount.aget_sales()."""
+        start_from, orders, loc, subcs = await self.aget_sales(start_from, include_paid, include_closed,
+                                                               include_refunded, exclude_ids, id, buyer, state, game,
+                                                               section, server, side, None, None, **more_filters)
+        return start_from, orders
+
+    async def aget_lot_fields(self, lot_id: int) -> types.LotFields:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.get_lot_fields`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+        headers = {}
+        response = await self.amethod("get", f"lots/offerEdit?offer={lot_id}", headers, {}, raise_not_200=True)
+        return self._parse_lot_fields(response, lot_id)
+
+    async def asave_offer(self, offer_fields: types.LotFields | types.ChipFields):
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.save_offer`.
+        """
+        if not self.is_initiated:
+            raise exceptions.AccountNotInitiatedError()
+        id_, api_method, headers, fields = self._save_offer_payload(offer_fields)
+        response = await self.amethod("post", api_method, headers, fields, raise_not_200=True)
+        self._check_save_offer_response(response, id_)
+
+    async def asave_chip(self, chip_fields: types.ChipFields):
+        await self.asave_offer(chip_fields)
+
+    async def asave_lot(self, lot_fields: types.LotFields):
+        await self.asave_offer(lot_fields)
+
+    async def adelete_lot(self, lot_id: int) -> None:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.account.Account.delete_lot`.
+        """
+        await self.asave_lot(types.LotFields(lot_id, {"csrf_token": self.csrf_token, "offer_id": lot_id,
+                                                      "deleted": "1"}))
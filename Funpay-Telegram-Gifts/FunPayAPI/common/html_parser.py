@@ -0,0 +1,399 @@
+"""
+В данном модуле написан бэкенд для извлечения данных из HTML-страниц FunPay.
+
+По умолчанию страницы разбираются напрямую через lxml, а результат оборачивается в :class:`Node`, который повторяет
+используемую в FunPayAPI часть API BeautifulSoup (find / find_all / text / get / attrs / str и т.д.).
+BeautifulSoup остается запасным вариантом: он используется, если lxml недоступен, если lxml не смог разобрать
+страницу, или если он выбран явно через :func:`set_backend`.
+"""
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator, Literal
+import threading
+import logging
+import re
+
+from bs4 import BeautifulSoup
+
+try:
+    from lxml import etree
+except ImportError:  # pragma: no cover
+    etree = None
+
+logger = logging.getLogger("FunPayAPI.html_parser")
+
+BOOLEAN_ATTRIBUTES = frozenset({
+    "allowfullscreen", "async", "autofocus", "autoplay", "checked", "compact", "controls", "declare", "default",
+    "defer", "disabled", "formnovalidate", "hidden", "inert", "ismap", "itemscope", "loop", "multiple", "muted",
+    "nohref", "nomodule", "noresize", "noshade", "novalidate", "nowrap", "open", "playsinline", "readonly",
+    "required", "reversed", "selected"
+})
+"""Булевые атрибуты. lxml подставляет в значение атрибута без значения его имя, BeautifulSoup - пустую строку."""
+
+MULTI_VALUED_ATTRIBUTES = frozenset({"class", "rel", "rev", "accept-charset", "headers", "accesskey", "dropzone"})
+"""Атрибуты, значения которых BeautifulSoup разбивает на списки."""
+
+VOID_ELEMENTS = frozenset({
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta", "param",
+    "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex", "nextid", "spacer"
+})
+"""Пустые элементы (сериализуются как <tag/>)."""
+
+STRING_CONTAINERS = frozenset({"script", "style", "template", "rp", "rt"})
+"""Элементы, текст которых BeautifulSoup не включает в .text родительских элементов."""
+
+RAW_TEXT_ELEMENTS = frozenset({"script", "style"})
+"""Элементы, текст которых сериализуется без экранирования."""
+
+PRESERVE_WHITESPACE_ELEMENTS = frozenset({"pre", "textarea"})
+"""Элементы, внутри которых BeautifulSoup не схлопывает строки из одних пробельных символов."""
+
+ASCII_SPACES = "\x20\x0a\x09\x0c\x0d"
+"""Пробельные символы в понимании BeautifulSoup."""
+
+_backend: Literal["lxml", "bs4"] = "lxml" if etree is not None else "bs4"
+_local = threading.local()
+
+
+def set_backend(backend: Literal["lxml", "bs4"]) -> None:
+    """
+    Устанавливает бэкенд для разбора HTML.
+
+    :param backend: "lxml" - разбор напрямую через lxml (по умолчанию), "bs4" - через BeautifulSoup.
+    :type backend: :obj:`str`
+    """
+    global _backend
+    if backend not in ("lxml", "bs4"):
+        raise ValueError(f"Unknown HTML backend: {backend}.")
+    if backend == "lxml" and etree is None:
+        raise ImportError("lxml is not installed.")
+    _backend = backend
+
+
+def get_backend() -> Literal["lxml", "bs4"]:
+    """
+    :return: текущий бэкенд для разбора HTML.
+    """
+    return _backend
+
+
+def parse(html: str) -> Node | BeautifulSoup:
+    """
+    Разбирает HTML текущим бэкендом.
+
+    :param html: HTML-код.
+    :type html: :obj:`str`
+
+    :return: корень дерева (:class:`Node` или :class:`bs4.BeautifulSoup`, в зависимости от бэкенда).
+    """
+    if _backend == "lxml":
+        try:
+            return Node(etree.fromstring(html, _get_parser()) if html.strip() else None, is_document=True)
+        except (ValueError, etree.LxmlError) as e:
+            logger.debug(f"lxml не смог разобрать HTML ({e}), используется BeautifulSoup.")
+    return BeautifulSoup(html, "lxml")
+
+
+def _get_parser():
+    # парсеры lxml нельзя использовать из нескольких потоков одновременно
+    if (parser := getattr(_local, "parser", None)) is None:
+        parser = _local.parser = etree.HTMLParser()
+    return parser
+
+
+def _string(text: str, preserve: bool) -> str:
+    # BeautifulSoup заменяет строки из одних пробельных символов на "\n" (или " ", если переноса строки нет)
+    if preserve or text.strip(ASCII_SPACES):
+        return text
+    return "\n" if "\n" in text else " "
+
+
+def _preserves_whitespace(element) -> bool:
+    return element.tag in PRESERVE_WHITESPACE_ELEMENTS or \
+        any(i.tag in PRESERVE_WHITESPACE_ELEMENTS for i in element.iterancestors())
+
+
+def _escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _quote(value: str) -> str:
+    if '"' in value:
+        if "'" in value:
+            return '"' + value.replace('"', "&quot;") + '"'
+        return "'" + value + "'"
+    return '"' + value + '"'
+
+
+def _attribute(element, key: str, default: Any = None) -> Any:
+    value = element.get(key)
+    if value is None:
+        return default
+    if key in MULTI_VALUED_ATTRIBUTES:
+        return value.split()
+    if key in BOOLEAN_ATTRIBUTES and value == key:
+        return ""
+    return value
+
+
+def _match_one(value: str | None, expected: Any) -> bool:
+    if callable(expected):
+        return bool(expected(value))
+    if value is None:
+        return False
+    if isinstance(expected, re.Pattern):
+        return expected.search(value) is not None
+    if isinstance(expected, (list, tuple, set, frozenset)):
+        return value in expected
+    return value == expected
+
+
+def _match_attribute(element, key: str, expected: Any) -> bool:
+    value = element.get(key)
+    if expected is True:
+        return value is not None
+    if expected is None or expected is False:
+        return value is None
+    if value is not None and key in MULTI_VALUED_ATTRIBUTES:
+        parts = value.split()
+        return any(_match_one(i, expected) for i in parts) or _match_one(" ".join(parts), expected)
+    if value is not None and key in BOOLEAN_ATTRIBUTES and value == key:
+        value = ""
+    return _match_one(value, expected)
+
+
+class Node:
+    """
+    Элемент (или корень) дерева lxml с API, совместимым с используемой частью API :class:`bs4.element.Tag`.
+
+    :param element: элемент lxml (None для пустого документа).
+
+    :param is_document: является ли узел корнем документа (аналог объекта :class:`bs4.BeautifulSoup`).
+    :type is_document: :obj:`bool`
+    """
+    __slots__ = ("element", "is_document")
+
+    def __init__(self, element, is_document: bool = False):
+        self.element = element
+        """Элемент lxml."""
+        self.is_document: bool = is_document
+        """Является ли узел корнем документа."""
+
+    @property
+    def name(self) -> str:
+        """Название тега."""
+        return "[document]" if self.is_document else self.element.tag
+
+    @property
+    def attrs(self) -> dict[str, str | list[str]]:
+        """Атрибуты тега."""
+        if self.is_document:
+            return {}
+        return {key: _attribute(self.element, key) for key in self.element.keys()}
+
+    @property
+    def text(self) -> str:
+        """Текст тега (со всеми вложенными тегами)."""
+        if self.element is None:
+            return ""
+        parts = []
+        if self.is_document:
+            self.__collect_text(self.element, parts, False)
+        elif self.element.tag in STRING_CONTAINERS:
+            parts.extend(_string(i, False) for i in self.element.itertext())
+        else:
+            self.__collect_text_inner(self.element, parts, _preserves_whitespace(self.element))
+        return "".join(parts)
+
+    def get_text(self) -> str:
+        return self.text
+
+    @property
+    def parent(self) -> Node | None:
+        """Родительский тег."""
+        if self.is_document or self.element is None:
+            return None
+        if (parent := self.element.getparent()) is None:
+            return Node(self.element, is_document=True)
+        return Node(parent)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """
+        Возвращает значение атрибута.
+
+        :param key: название атрибута.
+        :type key: :obj:`str`
+
+        :param default: значение, если атрибута нет.
+
+        :return: значение атрибута (список для class и других многозначных атрибутов).
+        """
+        if self.is_document:
+            return default
+        return _attribute(self.element, key, default)
+
+    def has_attr(self, key: str) -> bool:
+        return not self.is_document and self.element.get(key) is not None
+
+    def __getitem__(self, key: str) -> Any:
+        if (value := self.get(key)) is None:
+            raise KeyError(key)
+        return value
+
+    def __bool__(self) -> bool:
+        return True
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Node) and self.element is other.element and self.is_document == other.is_document
+
+    def __hash__(self) -> int:
+        return hash((id(self.element), self.is_document))
+
+    def __iter(self, name: Any, recursive: bool) -> Iterator:
+        tag = name if isinstance(name, str) else None
+        if self.element is None:
+            return iter(())
+        if self.is_document:
+            return self.element.iter(tag) if recursive else iter((self.element,))
+        if recursive:
+            return self.element.iterdescendants(tag)
+        return self.element.iterchildren(tag)
+
+    @staticmethod
+    def __criteria(name: Any, attrs: dict | str | None, kwargs: dict) -> tuple[Any, dict]:
+        if isinstance(attrs, str):
+            attrs = {"class": attrs}
+        attrs = dict(attrs or {})
+        if "class_" in kwargs:
+            kwargs["class"] = kwargs.pop("class_")
+        attrs.update(kwargs)
+        return name, attrs
+
+    @staticmethod
+    def __matches(element, name: Any, attrs: dict) -> bool:
+        if not isinstance(element.tag, str):
+            return False
+        if callable(name):
+            if not name(Node(element)):
+                return False
+        elif isinstance(name, (list, tuple, set, frozenset)):
+            if element.tag not in name:
+                return False
+        elif name is not None and element.tag != name:
+            return False
+        return all(_match_attribute(element, key, expected) for key, expected in attrs.items())
+
+    def find_all(self, name: str | Callable | None = None, attrs: dict | str | None = None, recursive: bool = True,
+                 limit: int | None = None, **kwargs) -> list[Node]:
+        """
+        Ищет все подходящие теги (аналог :meth:`bs4.element.Tag.find_all`).
+
+        :return: список найденных тегов.
+        """
+        name, attrs = self.__criteria(name, attrs, kwargs)
+        result = []
+        for element in self.__iter(name, recursive):
+            if self.__matches(element, name, attrs):
+                result.append(Node(element))
+                if limit and len(result) >= limit:
+                    break
+        return result
+
+    def find(self, name: str | Callable | None = None, attrs: dict | str | None = None, recursive: bool = True,
+             **kwargs) -> Node | None:
+        """
+        Ищет первый подходящий тег (аналог :meth:`bs4.element.Tag.find`).
+
+        :return: найденный тег или None.
+        """
+        name, attrs = self.__criteria(name, attrs, kwargs)
+        for element in self.__iter(name, recursive):
+            if self.__matches(element, name, attrs):
+                return Node(element)
+        return None
+
+    def find_parent(self, name: str | Callable | None = None, attrs: dict | str | None = None,
+                    **kwargs) -> Node | None:
+        """
+        Ищет ближайший подходящий родительский тег (аналог :meth:`bs4.element.Tag.find_parent`).
+
+        :return: найденный тег или None.
+        """
+        if self.is_document or self.element is None:
+            return None
+        name, attrs = self.__criteria(name, attrs, kwargs)
+        for element in self.element.iterancestors():
+            if self.__matches(element, name, attrs):
+                return Node(element)
+        return None
+
+    def find_previous(self, name: str | Callable | None = None, attrs: dict | str | None = None,
+                      **kwargs) -> Node | None:
+        """
+        Ищет ближайший подходящий тег, находящийся перед текущим в документе
+        (аналог :meth:`bs4.element.Tag.find_previous`).
+
+        :return: найденный тег или None.
+        """
+        if self.is_document or self.element is None:
+            return None
+        name, attrs = self.__criteria(name, attrs, kwargs)
+        for element in reversed(self.element.xpath("preceding::* | ancestor::*")):
+            if self.__matches(element, name, attrs):
+                return Node(element)
+        return None
+
+    @classmethod
+    def __collect_text(cls, element, parts: list[str], preserve: bool) -> None:
+        if not isinstance(element.tag, str) or element.tag in STRING_CONTAINERS:
+            return
+        cls.__collect_text_inner(element, parts, preserve or element.tag in PRESERVE_WHITESPACE_ELEMENTS)
+
+    @classmethod
+    def __collect_text_inner(cls, element, parts: list[str], preserve: bool) -> None:
+        if element.text:
+            parts.append(_string(element.text, preserve))
+        for child in element:
+            cls.__collect_text(child, parts, preserve)
+            if child.tail:
+                parts.append(_string(child.tail, preserve))
+
+    @classmethod
+    def __serialize(cls, element, parts: list[str], raw: bool = False, preserve: bool = False) -> None:
+        if not isinstance(element.tag, str):
+            if isinstance(element, etree._Comment):
+                parts.append(f"<!--{element.text or ''}-->")
+            elif isinstance(element, etree._ProcessingInstruction):
+                parts.append(f"<?{element.target} {element.text or ''}>")
+            return
+        parts.append("<" + element.tag)
+        for key in sorted(element.keys()):
+            value = _attribute(element, key)
+            if isinstance(value, list):
+                value = " ".join(value)
+            parts.append(f" {key}={_quote(_escape(value))}")
+        if element.tag in VOID_ELEMENTS and not element.text and not len(element):
+            parts.append("/>")
+            return
+        parts.append(">")
+        raw = raw or element.tag in RAW_TEXT_ELEMENTS
+        preserve = preserve or element.tag in PRESERVE_WHITESPACE_ELEMENTS
+        if element.text:
+            text = _string(element.text, preserve)
+            parts.append(text if raw else _escape(text))
+        for child in element:
+            cls.__serialize(child, parts, raw, preserve)
+            if child.tail:
+                tail = _string(child.tail, preserve)
+                parts.append(tail if raw else _escape(tail))
+        parts.append(f"</{element.tag}>")
+
+    def __str__(self) -> str:
+        if self.element is None:
+            return ""
+        parts = []
+        self.__serialize(self.element, parts, preserve=not self.is_document and _preserves_whitespace(self.element))
+        return "".join(parts)
+
+    def __repr__(self) -> str:
+        return str(self)
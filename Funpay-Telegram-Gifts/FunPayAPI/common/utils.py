@@ -5,7 +5,7 @@
 import string
 import random
 import re
-from .enums import Currency
+from .enums import Currency, MessageTypes
 
 MONTHS = {
     "января": 1,
@@ -95,6 +95,8 @@ class RegularExpressions(object):
         return getattr(cls, "instance")
 
     def __init__(self):
+        if hasattr(self, "EXCHANGE_RATE"):
+            return
         self.ORDER_PURCHASED = \
             re.compile(r"(Покупатель|The buyer) [a-zA-Z0-9]+ (оплатил заказ|has paid for order) #[A-Z0-9]{8}\.")
         """
@@ -211,6 +213,37 @@ class RegularExpressions(object):
         Скомпилированное регулярное выражение первого сообщения FunPay.
         """
 
+        self.SYSTEM_MESSAGE_TYPES: tuple[MessageTypes, ...] = (
+            MessageTypes.DISCORD, MessageTypes.DEAR_VENDORS, MessageTypes.ORDER_PURCHASED,
+            # далее - в порядке от самых часто-используемых к самым редко-используемым
+            MessageTypes.ORDER_CONFIRMED, MessageTypes.NEW_FEEDBACK, MessageTypes.NEW_FEEDBACK_ANSWER,
+            MessageTypes.FEEDBACK_CHANGED, MessageTypes.FEEDBACK_DELETED, MessageTypes.REFUND,
+            MessageTypes.FEEDBACK_ANSWER_CHANGED, MessageTypes.FEEDBACK_ANSWER_DELETED,
+            MessageTypes.ORDER_CONFIRMED_BY_ADMIN, MessageTypes.PARTIAL_REFUND, MessageTypes.ORDER_REOPENED,
+            MessageTypes.REFUND_BY_ADMIN
+        )
+        """
+        Типы системных сообщений в порядке приоритета (если текст подходит под несколько выражений).
+        """
+
+        self.SYSTEM_MESSAGE = re.compile("|".join(f"(?P<{i.name}>{getattr(self, i.name).pattern})"
+                                                  for i in self.SYSTEM_MESSAGE_TYPES))
+        """
+        Скомпилированное регулярное выражение, объединяющее выражения всех типов системных сообщений
+        (именованная группа = название типа).
+        """
+        self.__priorities: dict[MessageTypes, int] = {t: i for i, t in enumerate(self.SYSTEM_MESSAGE_TYPES)}
+
+        # каждое выражение начинается с группы вариантов первых слов: "(Покупатель|The buyer) ..."
+        start_words = dict.fromkeys(word for i in self.SYSTEM_MESSAGE_TYPES
+                                    for word in getattr(self, i.name).pattern[1:].split(")", 1)[0].split("|"))
+        self.SYSTEM_MESSAGE_START = re.compile("|".join(re.escape(i) for i in start_words))
+        """
+        Скомпилированное регулярное выражение, описывающее начало системного сообщения (первые слова всех выражений).
+        Состоит только из строк, поэтому re пропускает неподходящие позиции быстрым поиском по первому символу,
+        а SYSTEM_MESSAGE проверяется только с найденных позиций.
+        """
+
         self.PRODUCTS_AMOUNT = re.compile(r",\s(\d{1,3}(?:\s?\d{3})*)\s(шт|pcs)\.")
         """
         Скомпилированное регулярное выражение, описывающее запись кол-ва товаров в заказе со страницы заказОВ.
@@ -226,3 +259,36 @@ class RegularExpressions(object):
         """
         Скомпилированное регулярное выражение, описывающее фразу о смене валюты.
         """
+
+    def get_message_type(self, text: str | None) -> MessageTypes:
+        """
+        Определяет тип сообщения по его тексту одним проходом объединенного регулярного выражения.
+
+        Внимание! Результат основан на сравнении с регулярными выражениями и не является правильным в 100% случаев.
+
+        :param text: текст сообщения.
+        :type text: :obj:`str` or :obj:`None`
+
+        :return: тип сообщения.
+        :rtype: :class:`FunPayAPI.common.enums.MessageTypes`
+        """
+        # все выражения системных сообщений содержат ID заказа (#), кроме DISCORD и DEAR_VENDORS
+        if not text or ("#" not in text and "Discord" not in text and "vendors" not in text
+                        and "продавцы" not in text):
+            return MessageTypes.NON_SYSTEM
+
+        result, priority = MessageTypes.NON_SYSTEM, len(self.SYSTEM_MESSAGE_TYPES)
+        end = 0
+        for start in self.SYSTEM_MESSAGE_START.finditer(text):
+            if start.start() < end or not (match := self.SYSTEM_MESSAGE.match(text, start.start())):
+                continue
+            end = match.end()
+            msg_type = MessageTypes[match.lastgroup]
+            if self.__priorities[msg_type] >= priority:
+                continue
+            if msg_type is MessageTypes.ORDER_PURCHASED and not self.ORDER_PURCHASED2.search(text):
+                continue
+            result, priority = msg_type, self.__priorities[msg_type]
+            if not priority:
+                break
+        return result
@@ -11,11 +11,14 @@ from .common.utils import RegularExpressions
 from .common.enums import MessageTypes, OrderStatuses, SubCategoryTypes, Currency
 import datetime
 
+_NOT_DETERMINED = object()
+
 
 class BaseOrderInfo:
     """
     Класс, представляющий информацию о заказе.
     """
+    __slots__ = ("_order", "_order_attempt_made", "_order_attempt_error")
 
     def __init__(self):
         self._order: Order | None = None
@@ -42,15 +45,17 @@ class ChatShortcut(BaseOrderInfo):
     :param unread: флаг "непрочитанности" (`True`, если чат не прочитан (оранжевый). `False`, если чат прочитан).
     :type unread: :obj:`bool`
 
-    :param html: HTML код виджета чата.
-    :type html: :obj:`str`
+    :param html: HTML код виджета чата (None, если не сохраняется).
+    :type html: :obj:`str` or :obj:`None`
 
-    :param determine_msg_type: определять ли тип последнего сообщения?
+    :param determine_msg_type: определять ли тип последнего сообщения (при первом обращении к last_message_type)?
     :type determine_msg_type: :obj:`bool`, опционально
     """
+    __slots__ = ("id", "name", "last_message_text", "last_by_bot", "last_by_vertex", "unread", "node_msg_id",
+                 "user_msg_id", "_last_message_type", "html")
 
     def __init__(self, id_: int, name: str, last_message_text: str, node_msg_id: int, user_msg_id: int,
-                 unread: bool, html: str, determine_msg_type: bool = True):
+                 unread: bool, html: str | None, determine_msg_type: bool = True):
         self.id: int = id_
         """ID чата."""
         self.name: str | None = name if name else None
@@ -67,12 +72,22 @@ class ChatShortcut(BaseOrderInfo):
         """ID последнего сообщения в чате."""
         self.user_msg_id: int = user_msg_id
         """ID последнего прочитанного сообщения."""
-        self.last_message_type: MessageTypes | None = None if not determine_msg_type else self.get_last_message_type()
-        """Тип последнего сообщения."""
-        self.html: str = html
-        """HTML код виджета чата."""
+        self._last_message_type: MessageTypes | None | object = _NOT_DETERMINED if determine_msg_type else None
+        self.html: str | None = html
+        """HTML код виджета чата (None, если не сохраняется)."""
         BaseOrderInfo.__init__(self)
 
+    @property
+    def last_message_type(self) -> MessageTypes | None:
+        """Тип последнего сообщения (определяется при первом обращении)."""
+        if self._last_message_type is _NOT_DETERMINED:
+            self._last_message_type = self.get_last_message_type()
+        return self._last_message_type
+
+    @last_message_type.setter
+    def last_message_type(self, value: MessageTypes | None):
+        self._last_message_type = value
+
     def get_last_message_type(self) -> MessageTypes:
         """
         Определяет тип последнего сообщения в чате на основе регулярных выражений из MessageTypesRes.
@@ -85,40 +100,7 @@ class ChatShortcut(BaseOrderInfo):
         :return: тип последнего сообщения.
         :rtype: :class:`FunPayAPI.common.enums.MessageTypes`
         """
-        res = RegularExpressions()
-        if res.DISCORD.search(self.last_message_text):
-            return MessageTypes.DISCORD
-
-        if res.DEAR_VENDORS.search(self.last_message_text):
-            return MessageTypes.DEAR_VENDORS
-
-        if res.ORDER_PURCHASED.findall(self.last_message_text) and res.ORDER_PURCHASED2.findall(self.last_message_text):
-            return MessageTypes.ORDER_PURCHASED
-
-        if res.ORDER_ID.search(self.last_message_text) is None:
-            return MessageTypes.NON_SYSTEM
-
-        # Регулярные выражения выставлены в порядке от самых часто-используемых к самым редко-используемым
-        sys_msg_types = {
-            MessageTypes.ORDER_CONFIRMED: res.ORDER_CONFIRMED,
-            MessageTypes.NEW_FEEDBACK: res.NEW_FEEDBACK,
-            MessageTypes.NEW_FEEDBACK_ANSWER: res.NEW_FEEDBACK_ANSWER,
-            MessageTypes.FEEDBACK_CHANGED: res.FEEDBACK_CHANGED,
-            MessageTypes.FEEDBACK_DELETED: res.FEEDBACK_DELETED,
-            MessageTypes.REFUND: res.REFUND,
-            MessageTypes.FEEDBACK_ANSWER_CHANGED: res.FEEDBACK_ANSWER_CHANGED,
-            MessageTypes.FEEDBACK_ANSWER_DELETED: res.FEEDBACK_ANSWER_DELETED,
-            MessageTypes.ORDER_CONFIRMED_BY_ADMIN: res.ORDER_CONFIRMED_BY_ADMIN,
-            MessageTypes.PARTIAL_REFUND: res.PARTIAL_REFUND,
-            MessageTypes.ORDER_REOPENED: res.ORDER_REOPENED,
-            MessageTypes.REFUND_BY_ADMIN: res.REFUND_BY_ADMIN
-        }
-
-        for i in sys_msg_types:
-            if sys_msg_types[i].search(self.last_message_text):
-                return i
-        else:
-            return MessageTypes.NON_SYSTEM
+        return RegularExpressions().get_message_type(self.last_message_text)
 
     def __str__(self):
         return self.last_message_text
@@ -205,8 +187,8 @@ class Message(BaseOrderInfo):
     :param author_id: ID автора сообщения.
     :type author_id: :obj:`int`
 
-    :param html: HTML код сообщения.
-    :type html: :obj:`str`
+    :param html: HTML код сообщения (None, если не сохраняется).
+    :type html: :obj:`str` or :obj:`None`
 
     :param image_link: ссылка на изображение из сообщения (если есть).
     :type image_link: :obj:`str` or :obj:`None`, опционально
@@ -214,10 +196,14 @@ class Message(BaseOrderInfo):
     :param determine_msg_type: определять ли тип сообщения.
     :type determine_msg_type: :obj:`bool`, опционально
     """
+    __slots__ = ("id", "text", "chat_id", "chat_name", "interlocutor_id", "buyer_viewing", "type", "author",
+                 "author_id", "html", "image_link", "image_name", "by_bot", "by_vertex", "badge", "is_employee",
+                 "is_support", "is_moderation", "is_arbitration", "is_autoreply", "initiator_username", "initiator_id",
+                 "i_am_seller", "i_am_buyer")
 
     def __init__(self, id_: int, text: str | None, chat_id: int | str, chat_name: str | None,
                  interlocutor_id: int | None,
-                 author: str | None, author_id: int, html: str,
+                 author: str | None, author_id: int, html: str | None,
                  image_link: str | None = None, image_name: str | None = None,
                  determine_msg_type: bool = True, badge_text: Optional[str] = None):
         self.id: int = id_
@@ -238,8 +224,8 @@ class Message(BaseOrderInfo):
         """Автор сообщения."""
         self.author_id: int = author_id
         """ID автора сообщения."""
-        self.html: str = html
-        """HTML-код сообщения."""
+        self.html: str | None = html
+        """HTML-код сообщения (None, если не сохраняется)."""
         self.image_link: str | None = image_link
         """Ссылка на изображение в сообщении (если оно есть)."""
         self.image_name: str | None = image_name
@@ -283,42 +269,7 @@ class Message(BaseOrderInfo):
         :return: тип последнего сообщения в чате.
         :rtype: :class:`FunPayAPI.common.enums.MessageTypes`
         """
-        if not self.text:
-            return MessageTypes.NON_SYSTEM
-
-        res = RegularExpressions()
-        if res.DISCORD.search(self.text):
-            return MessageTypes.DISCORD
-        if res.DEAR_VENDORS.search(self.text):
-            return MessageTypes.DEAR_VENDORS
-
-        if res.ORDER_PURCHASED.findall(self.text) and res.ORDER_PURCHASED2.findall(self.text):
-            return MessageTypes.ORDER_PURCHASED
-
-        if res.ORDER_ID.search(self.text) is None:
-            return MessageTypes.NON_SYSTEM
-
-        # Регулярные выражения выставлены в порядке от самых часто-используемых к самым редко-используемым
-        sys_msg_types = {
-            MessageTypes.ORDER_CONFIRMED: res.ORDER_CONFIRMED,
-            MessageTypes.NEW_FEEDBACK: res.NEW_FEEDBACK,
-            MessageTypes.NEW_FEEDBACK_ANSWER: res.NEW_FEEDBACK_ANSWER,
-            MessageTypes.FEEDBACK_CHANGED: res.FEEDBACK_CHANGED,
-            MessageTypes.FEEDBACK_DELETED: res.FEEDBACK_DELETED,
-            MessageTypes.REFUND: res.REFUND,
-            MessageTypes.FEEDBACK_ANSWER_CHANGED: res.FEEDBACK_ANSWER_CHANGED,
-            MessageTypes.FEEDBACK_ANSWER_DELETED: res.FEEDBACK_ANSWER_DELETED,
-            MessageTypes.ORDER_CONFIRMED_BY_ADMIN: res.ORDER_CONFIRMED_BY_ADMIN,
-            MessageTypes.PARTIAL_REFUND: res.PARTIAL_REFUND,
-            MessageTypes.ORDER_REOPENED: res.ORDER_REOPENED,
-            MessageTypes.REFUND_BY_ADMIN: res.REFUND_BY_ADMIN
-        }
-
-        for i in sys_msg_types:
-            if sys_msg_types[i].search(self.text):
-                return i
-        else:
-            return MessageTypes.NON_SYSTEM
+        return RegularExpressions().get_message_type(self.text)
 
     def __str__(self):
         return self.text if self.text is not None else self.image_link if self.image_link is not None else ""
@@ -361,17 +312,19 @@ class OrderShortcut(BaseOrderInfo):
     :param subcategory: подкатегория, к которой относится заказ.
     :type subcategory: :class:`FunPayAPI.types.SubCategory` or :obj:`None`
 
-    :param html: HTML код виджета заказа.
-    :type html: :obj:`str`
+    :param html: HTML код виджета заказа (None, если не сохраняется).
+    :type html: :obj:`str` or :obj:`None`
 
     :param dont_search_amount: не искать кол-во товара.
     :type dont_search_amount: :obj:`bool`, опционально
     """
+    __slots__ = ("id", "description", "price", "currency", "amount", "buyer_username", "buyer_id", "chat_id",
+                 "status", "date", "subcategory_name", "subcategory", "html")
 
     def __init__(self, id_: str, description: str, price: float, currency: Currency,
                  buyer_username: str, buyer_id: int, chat_id: int | str, status: OrderStatuses,
                  date: datetime.datetime, subcategory_name: str, subcategory: SubCategory | None,
-                 html: str, dont_search_amount: bool = False):
+                 html: str | None, dont_search_amount: bool = False):
         self.id: str = id_ if not id_.startswith("#") else id_[1:]
         """ID заказа."""
         self.description: str = description
@@ -396,8 +349,8 @@ class OrderShortcut(BaseOrderInfo):
         """Название подкатегории, к которой относится заказ."""
         self.subcategory: SubCategory | None = subcategory
         """Подкатегория, к которой относится заказ."""
-        self.html: str = html
-        """HTML код виджета заказа."""
+        self.html: str | None = html
+        """HTML код виджета заказа (None, если не сохраняется)."""
         BaseOrderInfo.__init__(self)
 
     def parse_amount(self) -> int:
@@ -968,15 +921,17 @@ class LotShortcut:
     :param subcategory: подкатегория лота.
     :type subcategory: :class:`FunPayAPI.types.SubCategory`
 
-    :param html: HTML код виджета лота.
-    :type html: :obj:`str`
+    :param html: HTML код виджета лота (None, если не сохраняется).
+    :type html: :obj:`str` or :obj:`None`
     """
+    __slots__ = ("id", "server", "side", "description", "title", "amount", "price", "currency", "seller", "auto",
+                 "promo", "attributes", "subcategory", "html", "public_link")
 
     def __init__(self, id_: int | str, server: str | None, side: str | None,
                  description: str | None, amount: int | None, price: float, currency: Currency,
                  subcategory: SubCategory | None,
                  seller: SellerShortcut | None, auto: bool, promo: bool | None, attributes: dict[str, int | str] | None,
-                 html: str):
+                 html: str | None):
         self.id: int | str = id_
         if isinstance(self.id, str) and self.id.isnumeric():
             self.id = int(self.id)
@@ -1005,8 +960,8 @@ class LotShortcut:
         """Атрибуты лота (только для лотов из таблицы)"""
         self.subcategory: SubCategory = subcategory
         """Подкатегория лота."""
-        self.html: str = html
-        """HTML-код виджета лота."""
+        self.html: str | None = html
+        """HTML-код виджета лота (None, если не сохраняется)."""
         self.public_link: str = f"https://funpay.com/chips/offer?id={self.id}" \
             if self.subcategory.type is SubCategoryTypes.CURRENCY else f"https://funpay.com/lots/offer?id={self.id}"
         """Публичная ссылка на лот."""
@@ -1037,14 +992,16 @@ class MyLotShortcut:
     :param subcategory: подкатегория лота.
     :type subcategory: :class:`FunPayAPI.types.SubCategory`
 
-    :param html: HTML код виджета лота.
-    :type html: :obj:`str`
+    :param html: HTML код виджета лота (None, если не сохраняется).
+    :type html: :obj:`str` or :obj:`None`
     """
+    __slots__ = ("id", "server", "side", "description", "title", "amount", "price", "currency", "auto",
+                 "subcategory", "active", "html", "public_link")
 
     def __init__(self, id_: int | str, server: str | None, side: str | None,
                  description: str | None, amount: int | None, price: float, currency: Currency,
                  subcategory: SubCategory | None, auto: bool, active: bool,
-                 html: str):
+                 html: str | None):
         self.id: int | str = id_
         if isinstance(self.id, str) and self.id.isnumeric():
             self.id = int(self.id)
@@ -1069,8 +1026,8 @@ class MyLotShortcut:
         """Подкатегория лота."""
         self.active: bool = active
         """Активен ли лот?"""
-        self.html: str = html
-        """HTML-код виджета лота."""
+        self.html: str | None = html
+        """HTML-код виджета лота (None, если не сохраняется)."""
         self.public_link: str = f"https://funpay.com/chips/offer?id={self.id}" \
             if self.subcategory.type is SubCategoryTypes.CURRENCY else f"https://funpay.com/lots/offer?id={self.id}"
         """Публичная ссылка на лот."""
@@ -1,16 +1,18 @@
 from __future__ import annotations
 
 import re
-from typing import TYPE_CHECKING, Generator
+from typing import TYPE_CHECKING, Generator, AsyncGenerator, Any
 
 if TYPE_CHECKING:
     from ..account import Account
 
+import asyncio
+import functools
 import json
 import logging
-from bs4 import BeautifulSoup
+import threading
 
-from ..common import exceptions
+from ..common import exceptions, html_parser
 from .events import *
 
 logger = logging.getLogger("FunPayAPI.runner")
@@ -62,7 +64,16 @@ class Runner:
         self.__last_order_event_tag = utils.random_tag()
 
         self.saved_orders: dict[str, types.OrderShortcut] = {}
-        """Сохраненные состояния заказов ({ID заказа: экземпляр types.OrderShortcut})."""
+        """Сохраненные состояния заказов ({ID заказа: экземпляр types.OrderShortcut}), от старых к новым."""
+
+        self.saved_orders_limit: int = 1000
+        """Максимальное кол-во сохраненных заказов (самые старые удаляются)."""
+
+        self.sales_pages_limit: int = 5
+        """Максимальное кол-во страниц списка продаж, запрашиваемых за одно обновление."""
+
+        self.__tracked_paid: set[str] = set()
+        """ID оплаченных заказов, до которых дочитывается список продаж, чтобы заметить изменение их статуса."""
 
         self.runner_last_messages: dict[int, list[int, int, str | None]] = {}
         """ID последний сообщений {ID чата: [ID последего сообщения чата, ID последнего прочитанного сообщения чата, 
@@ -74,6 +85,9 @@ class Runner:
         self.last_messages_ids: dict[int, int] = {}
         """ID последних сообщений в чатах ({ID чата: ID последнего сообщения})."""
 
+        self.__state_lock = threading.Lock()
+        """Блокировка by_bot_ids / runner_last_messages: send_message может вызываться из других потоков."""
+
         self.buyers_viewing: dict[int, types.BuyerViewing] = {}
         """Что смотрит покупатель? ({ID покупателя: что смотрит}"""
 
@@ -93,6 +107,29 @@ class Runner:
         :return: ответ FunPay.
         :rtype: :obj:`dict`
         """
+        headers, payload = self._updates_payload()
+        response = self.account.method("post", "runner/", headers, payload, raise_not_200=True)
+        json_response = response.json()
+        logger.debug(f"Получены данные о событиях: {json_response}")
+        return json_response
+
+    async def aget_updates(self) -> dict:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.updater.runner.Runner.get_updates`.
+        Если аккаунт синхронный, запрос выполняется в отдельном потоке.
+
+        :return: ответ FunPay.
+        :rtype: :obj:`dict`
+        """
+        if not hasattr(self.account, "amethod"):
+            return await asyncio.to_thread(self.get_updates)
+        headers, payload = self._updates_payload()
+        response = await self.account.amethod("post", "runner/", headers, payload, raise_not_200=True)
+        json_response = response.json()
+        logger.debug(f"Получены данные о событиях: {json_response}")
+        return json_response
+
+    def _updates_payload(self) -> tuple[dict, dict]:
         orders = {
             "type": "orders_counters",
             "id": self.account.id,
@@ -119,11 +156,7 @@ class Runner:
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
             "x-requested-with": "XMLHttpRequest"
         }
-
-        response = self.account.method("post", "runner/", headers, payload, raise_not_200=True)
-        json_response = response.json()
-        logger.debug(f"Получены данные о событиях: {json_response}")
-        return json_response
+        return headers, payload
 
     def parse_updates(self, updates: dict) -> list[InitialChatEvent | ChatsListChangedEvent |
                                                    LastChatMessageChangedEvent | NewMessageEvent | InitialOrderEvent |
@@ -157,6 +190,42 @@ class Runner:
             self.__first_request = False
         return events
 
+    async def aparse_updates(self, updates: dict) -> list[InitialChatEvent | ChatsListChangedEvent |
+                                                          LastChatMessageChangedEvent | NewMessageEvent |
+                                                          InitialOrderEvent | OrdersListChangedEvent | NewOrderEvent |
+                                                          OrderStatusChangedEvent]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.updater.runner.Runner.parse_updates`.
+        С :class:`FunPayAPI.async_account.AsyncAccount` истории чатов и список продаж запрашиваются одновременно,
+        с синхронным :class:`FunPayAPI.account.Account` - по очереди (его сессия и состояние не рассчитаны на
+        вызовы из нескольких потоков). Порядок событий сохраняется (сначала события заказов, затем события чатов).
+
+        :param updates: результат выполнения :meth:`FunPayAPI.updater.runner.Runner.aget_updates`
+        :type updates: :obj:`dict`
+
+        :return: список событий.
+        :rtype: :obj:`list` of :class:`FunPayAPI.updater.events.BaseEvent`
+        """
+        tasks = []
+        for obj in sorted(updates["objects"], key=lambda x: x.get("type") == "orders_counters", reverse=True):
+            if obj.get("type") == "chat_bookmarks":
+                tasks.append(functools.partial(self.aparse_chat_updates, obj))
+            elif obj.get("type") == "orders_counters":
+                tasks.append(functools.partial(self.aparse_order_updates, obj))
+            elif obj.get("type") == "c-p-u":
+                bv = self.account.parse_buyer_viewing(obj)
+                self.buyers_viewing[bv.buyer_id] = bv
+        if hasattr(self.account, "amethod"):
+            results = await asyncio.gather(*(task() for task in tasks))
+        else:
+            results = [await task() for task in tasks]
+        events = []
+        for result in results:
+            events.extend(result)
+        if self.__first_request:
+            self.__first_request = False
+        return events
+
     def parse_chat_updates(self, obj) -> list[InitialChatEvent | ChatsListChangedEvent | LastChatMessageChangedEvent |
                                               NewMessageEvent]:
         """
@@ -172,9 +241,36 @@ class Runner:
             :class:`FunPayAPI.updater.events.LastChatMessageChangedEvent`,
             :class:`FunPayAPI.updater.events.NewMessageEvent`
         """
+        events, lcmc_events_with_new_mess = self._parse_chats_list(obj)
+        while lcmc_events_with_new_mess or len(self.__interlocutor_ids) >= self.runner_len - 2:
+            chats_pack, bv_pack = self._next_chats_pack(lcmc_events_with_new_mess)
+            chats_data = {i.chat.id: i.chat.name for i in chats_pack}
+            new_msg_events = self.generate_new_message_events(chats_data, bv_pack)
+            events.extend(self._merge_new_message_events(chats_pack, new_msg_events))
+        return events
+
+    async def aparse_chat_updates(self, obj) -> list[InitialChatEvent | ChatsListChangedEvent |
+                                                     LastChatMessageChangedEvent | NewMessageEvent]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.updater.runner.Runner.parse_chat_updates`.
+        """
+        events, lcmc_events_with_new_mess = self._parse_chats_list(obj)
+        while lcmc_events_with_new_mess or len(self.__interlocutor_ids) >= self.runner_len - 2:
+            chats_pack, bv_pack = self._next_chats_pack(lcmc_events_with_new_mess)
+            chats_data = {i.chat.id: i.chat.name for i in chats_pack}
+            new_msg_events = await self.agenerate_new_message_events(chats_data, bv_pack)
+            events.extend(self._merge_new_message_events(chats_pack, new_msg_events))
+        return events
+
+    def _parse_chats_list(self, obj) -> tuple[list, list[LastChatMessageChangedEvent]]:
+        """
+        Парсит список чатов из ответа runner'а.
+
+        :return: (готовые события, события изменения чатов, для которых нужно получить новые сообщения)
+        """
         events, lcmc_events = [], []
         self.__last_msg_event_tag = obj.get("tag")
-        parser = BeautifulSoup(obj["data"]["html"], "lxml")
+        parser = html_parser.parse(obj["data"]["html"])
         chats = parser.find_all("a", {"class": "contact-item"})
 
         # Получаем все изменившиеся чаты
@@ -209,7 +305,7 @@ class Runner:
 
             chat_with = chat.find("div", {"class": "media-user-name"}).text
             chat_obj = types.ChatShortcut(chat_id, chat_with, last_msg_text, node_msg_id,
-                                          user_msg_id, unread, str(chat))
+                                          user_msg_id, unread, self.account._keep_html(chat))
             if last_msg_text_or_none is not None:
                 chat_obj.last_by_bot = by_bot
                 chat_obj.last_by_vertex = by_vertex
@@ -230,7 +326,7 @@ class Runner:
 
         if not self.make_msg_requests:
             events.extend(lcmc_events)
-            return events
+            return events, []
 
         lcmc_events_without_new_mess = []
         lcmc_events_with_new_mess = []
@@ -247,32 +343,36 @@ class Runner:
             self.__interlocutor_ids = self.__interlocutor_ids | set([self.account.interlocutor_ids.get(i.chat.id)
                                                                      for i in lcmc_events_with_new_mess if
                                                                      i.chat.id in self.account.interlocutor_ids])
+        return events, lcmc_events_with_new_mess
+
+    def _next_chats_pack(self, lcmc_events_with_new_mess: list[LastChatMessageChangedEvent]) -> \
+            tuple[list[LastChatMessageChangedEvent], list[int]]:
+        chats_pack = lcmc_events_with_new_mess[:self.runner_len]
+        del lcmc_events_with_new_mess[:self.runner_len]
+        bv_pack = []
+        while self.make_buyer_viewing_requests and \
+                len(chats_pack) + len(bv_pack) < self.runner_len and self.__interlocutor_ids:
+            interlocutor_id = self.__interlocutor_ids.pop()
+            if interlocutor_id not in self.buyers_viewing:
+                bv_pack.append(interlocutor_id)
+        return chats_pack, bv_pack
+
+    def _merge_new_message_events(self, chats_pack: list[LastChatMessageChangedEvent],
+                                  new_msg_events: dict[int, list[NewMessageEvent]]) -> \
+            list[LastChatMessageChangedEvent | NewMessageEvent]:
+        if self.make_buyer_viewing_requests:
+            # Если раньше айди не знали, то добавляем
+            for chat_id, msgs in new_msg_events.items():
+                if chat_id not in self.account.interlocutor_ids and msgs and msgs[0].message.interlocutor_id:
+                    self.account.interlocutor_ids[chat_id] = msgs[0].message.interlocutor_id
+                    self.__interlocutor_ids.add(msgs[0].message.interlocutor_id)
 
-        while lcmc_events_with_new_mess or len(self.__interlocutor_ids) >= self.runner_len - 2:
-            chats_pack = lcmc_events_with_new_mess[:self.runner_len]
-            del lcmc_events_with_new_mess[:self.runner_len]
-            bv_pack = []
-            while self.make_buyer_viewing_requests and \
-                    len(chats_pack) + len(bv_pack) < self.runner_len and self.__interlocutor_ids:
-                interlocutor_id = self.__interlocutor_ids.pop()
-                if interlocutor_id not in self.buyers_viewing:
-                    bv_pack.append(interlocutor_id)
-
-            chats_data = {i.chat.id: i.chat.name for i in chats_pack}
-            new_msg_events = self.generate_new_message_events(chats_data, bv_pack)
-
-            if self.make_buyer_viewing_requests:
-                # Если раньше айди не знали, то добавляем
-                for chat_id, msgs in new_msg_events.items():
-                    if chat_id not in self.account.interlocutor_ids and msgs and msgs[0].message.interlocutor_id:
-                        self.account.interlocutor_ids[chat_id] = msgs[0].message.interlocutor_id
-                        self.__interlocutor_ids.add(msgs[0].message.interlocutor_id)
-
-            # [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...]
-            for i in chats_pack:
-                events.append(i)
-                if new_msg_events.get(i.chat.id):
-                    events.extend(new_msg_events[i.chat.id])
+        # [LastChatMessageChanged, NewMSG, NewMSG ..., LastChatMessageChanged, NewMSG, NewMSG ...]
+        events = []
+        for i in chats_pack:
+            events.append(i)
+            if new_msg_events.get(i.chat.id):
+                events.extend(new_msg_events[i.chat.id])
         return events
 
     def generate_new_message_events(self, chats_data: dict[int, str],
@@ -303,7 +403,36 @@ class Runner:
         else:
             logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}: превышено кол-во попыток.")
             return {}
+        return self._new_message_events(chats)
+
+    async def agenerate_new_message_events(self, chats_data: dict[int, str],
+                                           interlocutor_ids: list[int] | None = None) -> \
+            dict[int, list[NewMessageEvent]]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.updater.runner.Runner.generate_new_message_events`.
+        """
+        attempts = 3
+        while attempts:
+            attempts -= 1
+            try:
+                chats = await self._acall("get_chats_histories", chats_data, interlocutor_ids)
+                break
+            except exceptions.RequestFailedError as e:
+                logger.error(e)
+            except:
+                logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}.")
+                logger.debug("TRACEBACK", exc_info=True)
+            await asyncio.sleep(1)
+        else:
+            logger.error(f"Не удалось получить истории чатов {list(chats_data.keys())}: превышено кол-во попыток.")
+            return {}
+        return self._new_message_events(chats)
 
+    def _new_message_events(self, chats: dict[int, list[types.Message]]) -> dict[int, list[NewMessageEvent]]:
+        with self.__state_lock:
+            return self.__new_message_events(chats)
+
+    def __new_message_events(self, chats: dict[int, list[types.Message]]) -> dict[int, list[NewMessageEvent]]:
         result = {}
 
         for cid in chats:
@@ -354,11 +483,7 @@ class Runner:
             :class:`FunPayAPI.updater.events.NewOrderEvent`,
             :class:`FunPayAPI.updater.events.OrderStatusChangedEvent`
         """
-        events = []
-        self.__last_order_event_tag = obj.get("tag")
-        if not self.__first_request:
-            events.append(OrdersListChangedEvent(self.__last_order_event_tag,
-                                                 obj["data"]["buyer"], obj["data"]["seller"]))
+        events = self._orders_counters_events(obj)
         if not self.make_order_requests:
             return events
 
@@ -366,7 +491,7 @@ class Runner:
         while attempts:
             attempts -= 1
             try:
-                orders_list = self.account.get_sales()  # todo добавить возможность реакции на подтверждение очень старых заказов
+                orders, missed = self._fetch_sales()
                 break
             except exceptions.RequestFailedError as e:
                 logger.error(e)
@@ -377,10 +502,85 @@ class Runner:
         else:
             logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
             return events
+        events.extend(self._order_events(orders, missed))
+        return events
+
+    async def aparse_order_updates(self, obj) -> list[InitialOrderEvent | OrdersListChangedEvent | NewOrderEvent |
+                                                      OrderStatusChangedEvent]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.updater.runner.Runner.parse_order_updates`.
+        """
+        events = self._orders_counters_events(obj)
+        if not self.make_order_requests:
+            return events
+
+        attempts = 3
+        while attempts:
+            attempts -= 1
+            try:
+                orders, missed = await self._afetch_sales()
+                break
+            except exceptions.RequestFailedError as e:
+                logger.error(e)
+            except:
+                logger.error("Не удалось обновить список заказов.")
+                logger.debug("TRACEBACK", exc_info=True)
+            await asyncio.sleep(1)
+        else:
+            logger.error("Не удалось обновить список продаж: превышено кол-во попыток.")
+            return events
+        events.extend(self._order_events(orders, missed))
+        return events
+
+    def _orders_counters_events(self, obj) -> list[OrdersListChangedEvent]:
+        events = []
+        self.__last_order_event_tag = obj.get("tag")
+        if not self.__first_request:
+            events.append(OrdersListChangedEvent(self.__last_order_event_tag,
+                                                 obj["data"]["buyer"], obj["data"]["seller"]))
+        return events
+
+    def _sales_scan_state(self) -> tuple[dict[str, types.OrderStatuses], set[str]]:
+        return {i: order.status for i, order in self.saved_orders.items()}, set(self.__tracked_paid)
 
-        saved_orders = {}
-        for order in orders_list[1]:
-            saved_orders[order.id] = order
+    def _fetch_sales(self) -> tuple[list[types.OrderShortcut], set[str]]:
+        """
+        Получает новые и изменившиеся заказы. Первая страница списка продаж сравнивается целиком, следующие читаются
+        до первого известного заказа с неизменившимся статусом. Пока не встретились все отслеживаемые оплаченные заказы,
+        чтение продолжается (не более :attr:`sales_pages_limit` страниц).
+
+        :return: (новые / изменившиеся заказы от новых к старым, ID отслеживаемых заказов, которые не встретились
+            до конца списка или лимита страниц)
+        """
+        if self.__first_request or not self.saved_orders:
+            return self.account.get_sales()[1], set()
+        known, wait_for = self._sales_scan_state()
+        orders, start_from = [], None
+        for _ in range(max(self.sales_pages_limit, 1)):
+            next_order_id, page, *_ = self.account.get_sales(start_from, known_orders=known, wait_for=wait_for)
+            orders.extend(page)
+            if not next_order_id:
+                break
+            start_from = next_order_id
+        return orders, wait_for
+
+    async def _afetch_sales(self) -> tuple[list[types.OrderShortcut], set[str]]:
+        if self.__first_request or not self.saved_orders:
+            return (await self._acall("get_sales"))[1], set()
+        known, wait_for = self._sales_scan_state()
+        orders, start_from = [], None
+        for _ in range(max(self.sales_pages_limit, 1)):
+            next_order_id, page, *_ = await self._acall("get_sales", start_from, known_orders=known, wait_for=wait_for)
+            orders.extend(page)
+            if not next_order_id:
+                break
+            start_from = next_order_id
+        return orders, wait_for
+
+    def _order_events(self, orders: list[types.OrderShortcut],
+                      missed: set[str]) -> list[InitialOrderEvent | NewOrderEvent | OrderStatusChangedEvent]:
+        events = []
+        for order in orders:
             if order.id not in self.saved_orders:
                 if self.__first_request:
                     events.append(InitialOrderEvent(self.__last_order_event_tag, order))
@@ -391,7 +591,20 @@ class Runner:
 
             elif order.status != self.saved_orders[order.id].status:
                 events.append(OrderStatusChangedEvent(self.__last_order_event_tag, order))
-        self.saved_orders = saved_orders
+
+        # новые заказы добавляются в конец от старых к новым, измененные обновляются на месте
+        for order in reversed(orders):
+            self.saved_orders[order.id] = order
+        for order_id in list(self.saved_orders)[:max(len(self.saved_orders) - self.saved_orders_limit, 0)]:
+            del self.saved_orders[order_id]
+
+        self.__tracked_paid -= missed
+        for order in orders:
+            if order.status == types.OrderStatuses.PAID:
+                self.__tracked_paid.add(order.id)
+            else:
+                self.__tracked_paid.discard(order.id)
+        self.__tracked_paid &= self.saved_orders.keys()
         return events
 
     def update_last_message(self, chat_id: int, message_id: int, message_text: str | None):
@@ -407,7 +620,8 @@ class Runner:
         :param message_text: текст сообщения или None, если это изображение.
         :type message_text: :obj:`str` or :obj:`None`
         """
-        self.runner_last_messages[chat_id] = [message_id, message_id, message_text]
+        with self.__state_lock:
+            self.runner_last_messages[chat_id] = [message_id, message_id, message_text]
 
     def mark_as_by_bot(self, chat_id: int, message_id: int):
         """
@@ -419,10 +633,11 @@ class Runner:
         :param message_id: ID сообщения.
         :type message_id: :obj:`int`
         """
-        if self.by_bot_ids.get(chat_id) is None:
-            self.by_bot_ids[chat_id] = [message_id]
-        else:
-            self.by_bot_ids[chat_id].append(message_id)
+        with self.__state_lock:
+            if self.by_bot_ids.get(chat_id) is None:
+                self.by_bot_ids[chat_id] = [message_id]
+            else:
+                self.by_bot_ids[chat_id].append(message_id)
 
     def listen(self, requests_delay: int | float = 6.0,
                ignore_exceptions: bool = True) -> Generator[InitialChatEvent | ChatsListChangedEvent |
@@ -455,18 +670,9 @@ class Runner:
                                                if event.type == EventTypes.NEW_MESSAGE])
                 updates = self.get_updates()
                 events.extend(self.parse_updates(updates))
-                next_events = []
-                for event in events:
-                    if self.make_msg_requests and self.make_buyer_viewing_requests \
-                            and event.type == EventTypes.NEW_MESSAGE \
-                            and event.message.interlocutor_id is not None:
-                        event.message.buyer_viewing = self.buyers_viewing.get(event.message.interlocutor_id)
-                        if event.message.buyer_viewing is None:
-                            next_events.append(event)
-                            continue
-
+                ready_events, events = self._split_ready_events(events)
+                for event in ready_events:
                     yield event
-                events = next_events
                 self.buyers_viewing = {}
             except Exception as e:
                 if not ignore_exceptions:
@@ -482,3 +688,91 @@ class Runner:
                     time.sleep(rt)
             else:
                 time.sleep(requests_delay)
+
+    async def alisten(self, requests_delay: int | float = 6.0,
+                      ignore_exceptions: bool = True) -> AsyncGenerator[InitialChatEvent | ChatsListChangedEvent |
+                                                                        LastChatMessageChangedEvent |
+                                                                        NewMessageEvent | InitialOrderEvent |
+                                                                        OrdersListChangedEvent | NewOrderEvent |
+                                                                        OrderStatusChangedEvent, None]:
+        """
+        Асинхронный аналог :meth:`FunPayAPI.updater.runner.Runner.listen` (`async for event in runner.alisten()`).
+
+        Следующий запрос к runner'у запускается сразу после разбора текущего ответа и выполняется, пока
+        обрабатываются отданные события. Работает как с :class:`FunPayAPI.async_account.AsyncAccount`
+        (истории чатов и список продаж запрашиваются одновременно), так и с синхронным
+        :class:`FunPayAPI.account.Account` (запросы выполняются по очереди в отдельных потоках).
+
+        :param requests_delay: задержка между запросами (в секундах).
+        :type requests_delay: :obj:`int` or :obj:`float`, опционально
+
+        :param ignore_exceptions: игнорировать ошибки?
+        :type ignore_exceptions: :obj:`bool`, опционально
+
+        :return: асинхронный генератор событий FunPay.
+        :rtype: :obj:`AsyncGenerator` of :class:`FunPayAPI.updater.events.BaseEvent`
+        """
+        events = []
+        start_time = time.time()
+        poll = asyncio.ensure_future(self.aget_updates())
+        try:
+            while True:
+                ready_events = []
+                try:
+                    updates = await poll
+                    events.extend(await self.aparse_updates(updates))
+                    ready_events, events = self._split_ready_events(events)
+                except Exception as e:
+                    if not ignore_exceptions:
+                        raise e
+                    else:
+                        logger.error("Произошла ошибка при получении событий. "
+                                     "(ничего страшного, если это сообщение появляется нечасто).")
+                        logger.debug("TRACEBACK", exc_info=True)
+
+                if time.time() - self.account.last_429_err_time > 60:
+                    delay = max(requests_delay - (time.time() - start_time), 0)
+                else:
+                    delay = requests_delay
+                self.__interlocutor_ids = set([event.message.interlocutor_id for event in events
+                                               if event.type == EventTypes.NEW_MESSAGE])
+                start_time = time.time() + delay
+                poll = asyncio.ensure_future(self.__delayed_updates(delay))
+
+                for event in ready_events:
+                    yield event
+                self.buyers_viewing = {}
+        finally:
+            poll.cancel()
+
+    async def __delayed_updates(self, delay: float) -> dict:
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return await self.aget_updates()
+
+    def _split_ready_events(self, events: list) -> tuple[list, list]:
+        """
+        Делит события на готовые к отдаче и ожидающие поля "Покупатель смотрит".
+
+        :return: (готовые события, отложенные события)
+        """
+        ready_events, next_events = [], []
+        for event in events:
+            if self.make_msg_requests and self.make_buyer_viewing_requests \
+                    and event.type == EventTypes.NEW_MESSAGE \
+                    and event.message.interlocutor_id is not None:
+                event.message.buyer_viewing = self.buyers_viewing.get(event.message.interlocutor_id)
+                if event.message.buyer_viewing is None:
+                    next_events.append(event)
+                    continue
+            ready_events.append(event)
+        return ready_events, next_events
+
+    async def _acall(self, name: str, *args, **kwargs) -> Any:
+        """
+        Вызывает метод аккаунта: корутину `a<name>` у :class:`FunPayAPI.async_account.AsyncAccount`,
+        синхронный `<name>` в отдельном потоке - у :class:`FunPayAPI.account.Account`.
+        """
+        if hasattr(self.account, "amethod"):
+            return await getattr(self.account, f"a{name}")(*args, **kwargs)
+        return await asyncio.to_thread(getattr(self.account, name), *args, **kwargs)
@@ -7,10 +7,13 @@ import asyncio
 import logging
 import base64
 import threading
+import sqlite3
+import hashlib
 import colorlog
 from contextlib import suppress
 from typing import Optional, Tuple, List, Any, Dict
-from collections import deque
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, Future
 import random
 from pathlib import Path
 
@@ -25,6 +28,14 @@ except Exception:
     class PeerFlood(Exception):
         pass
 
+try:
+    from pyrogram.errors import UsernameNotOccupied as TgUsernameNotOccupied, UsernameInvalid as TgUsernameInvalid
+except Exception:
+    class TgUsernameNotOccupied(Exception):
+        pass
+    class TgUsernameInvalid(Exception):
+        pass
+
 from FunPayAPI import Account
 from FunPayAPI.updater.runner import Runner
 from FunPayAPI.updater.events import NewOrderEvent, NewMessageEvent
@@ -43,13 +54,13 @@ except Exception:
     requests = None
 
 try:
-    from settings import resolve_to_gift_ids, get_required_stars, load_sets, get_message, reload_messages
-    GIFT_SETS_AVAILABLE = True
+    from settings import GiftCatalog, get_message, watch_messages
+    GIFT_CATALOG: Optional["GiftCatalog"] = GiftCatalog()
 except Exception:
-    GIFT_SETS_AVAILABLE = False
+    GIFT_CATALOG = None
     def get_message(key: str, **kwargs) -> str:
         return ""
-    def reload_messages() -> None:
+    def watch_messages(poll_interval: Optional[float] = None) -> None:
         return
 
 if not hasattr(Client, "send_gift"):
@@ -68,53 +79,115 @@ API_ID = os.getenv("API_ID")
 API_HASH = os.getenv("API_HASH")
 API_ID = int(API_ID) if API_ID and API_ID.isdigit() else None
 MANUAL_ORDERS_JSON = HERE / "manual_orders.json"
+BOT_DB_PATH = HERE / "bot_data.sqlite3"
+_DB_LOCK = threading.RLock()
+_DB_CONN: Optional[sqlite3.Connection] = None
 MANUAL_NOTICE_COOLDOWN = 30.0
 _MANUAL_LOCK = threading.Lock()
 _MANUAL_ORDERS: Dict[str, dict] = {}
+_MANUAL_BY_CHAT: Dict[int, str] = {}
+_MANUAL_DB_READY = False
 _last_manual_notice_by_chat: Dict[int, float] = {}
+_MANUAL_NOTICE_LOCK = threading.Lock()
 _STOP_CMD_RE = re.compile(r"^\s*!stop(?:\s+(\S+))?(?:\s+(.*))?\s*$", re.IGNORECASE)
 
-def _load_manual_orders() -> None:
-    global _MANUAL_ORDERS
-    try:
-        if MANUAL_ORDERS_JSON.exists():
-            raw = MANUAL_ORDERS_JSON.read_text(encoding="utf-8").strip()
-            data = json.loads(raw) if raw else {}
-            if not isinstance(data, dict):
-                data = {}
-
-            norm: Dict[str, dict] = {}
-            for k, v in data.items():
-                key = str(k).strip()
-                if not key:
-                    continue
-                if not isinstance(v, dict):
-                    v = {}
+def _db() -> sqlite3.Connection:
+    global _DB_CONN
+    with _DB_LOCK:
+        if _DB_CONN is None:
+            conn = sqlite3.connect(str(BOT_DB_PATH), check_same_thread=False, isolation_level=None, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _DB_CONN = conn
+        return _DB_CONN
+
+def _manual_db() -> sqlite3.Connection:
+    global _MANUAL_DB_READY
+    conn = _db()
+    if not _MANUAL_DB_READY:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS manual_orders ("
+            "order_id TEXT PRIMARY KEY, chat_id INTEGER NOT NULL, buyer_id INTEGER, by_id INTEGER, "
+            "ts INTEGER NOT NULL, note TEXT NOT NULL DEFAULT '', notified INTEGER NOT NULL DEFAULT 0)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS manual_orders_chat ON manual_orders(chat_id)")
+        _MANUAL_DB_READY = True
+    return conn
 
-                oid = v.get("order_id", key)
-                v["order_id"] = str(oid).strip() if oid is not None else key
-                try:
-                    v["chat_id"] = int(v.get("chat_id") or 0)
-                except Exception:
-                    pass
+def _index_manual_locked(key: str, rec: dict) -> None:
+    _MANUAL_ORDERS[key] = rec
+    try:
+        _MANUAL_BY_CHAT.setdefault(int(rec.get("chat_id") or 0), key)
+    except Exception:
+        pass
 
-                norm[key] = v
+def _migrate_manual_json(conn: sqlite3.Connection) -> None:
+    if not MANUAL_ORDERS_JSON.exists():
+        return
+    try:
+        raw = MANUAL_ORDERS_JSON.read_text(encoding="utf-8").strip()
+        data = json.loads(raw) if raw else {}
+    except Exception as e:
+        log_warn("manual", f"Не смог прочитать {MANUAL_ORDERS_JSON.name}: {short_text(e)}")
+        return
+    if not isinstance(data, dict):
+        data = {}
+    rows = []
+    for k, v in data.items():
+        key = str(k).strip()
+        if not key:
+            continue
+        if not isinstance(v, dict):
+            v = {}
+        oid = v.get("order_id", key)
+        rows.append((
+            str(oid).strip() if oid is not None else key,
+            _safe_int(v.get("chat_id")) or 0,
+            _safe_int(v.get("buyer_id")),
+            _safe_int(v.get("by")),
+            _safe_int(v.get("ts")) or 0,
+            str(v.get("note") or ""),
+            1 if v.get("notified") else 0,
+        ))
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany("INSERT OR IGNORE INTO manual_orders (order_id, chat_id, buyer_id, by_id, ts, note, notified) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    MANUAL_ORDERS_JSON.replace(MANUAL_ORDERS_JSON.with_name(MANUAL_ORDERS_JSON.name + ".migrated"))
+    log_info("manual", f"Перенесено ручных заказов из {MANUAL_ORDERS_JSON.name}: {len(rows)}")
 
-            _MANUAL_ORDERS = norm
-        else:
-            _MANUAL_ORDERS = {}
-    except Exception:
+def _load_manual_orders() -> None:
+    global _MANUAL_ORDERS, _MANUAL_BY_CHAT
+    try:
+        with _DB_LOCK:
+            conn = _manual_db()
+            _migrate_manual_json(conn)
+            rows = conn.execute("SELECT order_id, chat_id, buyer_id, by_id, ts, note, notified FROM manual_orders ORDER BY rowid").fetchall()
+    except Exception as e:
+        log_error("manual", f"Не смог загрузить ручные заказы: {short_text(e)}")
+        rows = []
+    with _MANUAL_LOCK:
         _MANUAL_ORDERS = {}
-
-def _save_manual_orders() -> None:
+        _MANUAL_BY_CHAT = {}
+        for oid, chat_id, buyer_id, by_id, ts, note, notified in rows:
+            _index_manual_locked(oid, {
+                "order_id": oid,
+                "chat_id": chat_id,
+                "buyer_id": buyer_id,
+                "by": by_id,
+                "ts": ts,
+                "note": note,
+                "notified": bool(notified),
+            })
+
+def _save_manual_order(rec: dict) -> None:
     try:
-        with _MANUAL_LOCK:
-            MANUAL_ORDERS_JSON.write_text(
-                json.dumps(_MANUAL_ORDERS, ensure_ascii=False, indent=2),
-                encoding="utf-8",
+        with _DB_LOCK:
+            _manual_db().execute(
+                "INSERT OR REPLACE INTO manual_orders (order_id, chat_id, buyer_id, by_id, ts, note, notified) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (rec["order_id"], rec["chat_id"], rec.get("buyer_id"), rec.get("by"), rec.get("ts") or 0, rec.get("note") or "", 1 if rec.get("notified") else 0),
             )
-    except Exception:
-        pass
+    except Exception as e:
+        log_error("manual", f"Не смог сохранить ручной заказ {rec.get('order_id')}: {short_text(e)}")
 
 def _oid(order_id: Any) -> str:
     return str(order_id).strip()
@@ -131,14 +204,12 @@ def _is_manual_order(order_id: Any) -> bool:
         return key in _MANUAL_ORDERS
 
 def _manual_order_for_chat(chat_id: int) -> Optional[str]:
+    try:
+        chat = int(chat_id)
+    except Exception:
+        return None
     with _MANUAL_LOCK:
-        for k, v in _MANUAL_ORDERS.items():
-            try:
-                if int(v.get("chat_id") or 0) == int(chat_id):
-                    return str(v.get("order_id") or k)
-            except Exception:
-                continue
-    return None
+        return _MANUAL_BY_CHAT.get(chat)
 
 def _mark_order_manual(order_id: Any, chat_id: int, buyer_id: Optional[Any], actor_id: Optional[Any], note: str = "") -> None:
     key = _oid(order_id)
@@ -146,7 +217,7 @@ def _mark_order_manual(order_id: Any, chat_id: int, buyer_id: Optional[Any], act
     with _MANUAL_LOCK:
         prev = _MANUAL_ORDERS.get(key) if isinstance(_MANUAL_ORDERS.get(key), dict) else {}
         notified = bool(prev.get("notified", False))
-        _MANUAL_ORDERS[key] = {
+        rec = {
             "order_id": key,
             "chat_id": int(chat_id),
             "buyer_id": _safe_int(buyer_id),
@@ -155,25 +226,21 @@ def _mark_order_manual(order_id: Any, chat_id: int, buyer_id: Optional[Any], act
             "note": (note or "").strip(),
             "notified": notified,
         }
-    _save_manual_orders()
+        _index_manual_locked(key, rec)
+    _save_manual_order(rec)
 
 def _set_manual_notified(order_id: Any) -> None:
     key = _oid(order_id)
     with _MANUAL_LOCK:
         v = _MANUAL_ORDERS.get(key)
-        if isinstance(v, dict):
-            v["notified"] = True
-            _MANUAL_ORDERS[key] = v
-    _save_manual_orders()
+        if not isinstance(v, dict):
+            return
+        v["notified"] = True
+        rec = dict(v)
+    _save_manual_order(rec)
 
 def _find_waiting_by_chat(chat_id: int) -> Optional[Tuple[int, dict]]:
-    for bid, st in list(waiting.items()):
-        try:
-            if int(st.get("chat_id") or 0) == int(chat_id):
-                return bid, st
-        except Exception:
-            continue
-    return None
+    return waiting.by_chat(chat_id)
 
 def _env_bool(name: str, default: bool) -> bool:
     v = os.getenv(name)
@@ -189,7 +256,24 @@ PER_RECIPIENT_DELAY = float(os.getenv("PER_RECIPIENT_DELAY", "1.20"))
 BURST_WINDOW_SECONDS = float(os.getenv("BURST_WINDOW_SECONDS", "10"))
 BURST_MAX_SENDS = int(os.getenv("BURST_MAX_SENDS", "20"))
 SEND_JITTER = float(os.getenv("SEND_JITTER", "0.0"))
+TG_GLOBAL_SEND_DELAY = float(os.getenv("TG_GLOBAL_SEND_DELAY", "0"))
+TG_STARTUP_CONCURRENCY = int(os.getenv("TG_STARTUP_CONCURRENCY", "4"))
+TG_STARTUP_TIMEOUT = float(os.getenv("TG_STARTUP_TIMEOUT", "20"))
+TG_HEALTH_INTERVAL = float(os.getenv("TG_HEALTH_INTERVAL", "30"))
+TG_HEALTH_PING_TIMEOUT = float(os.getenv("TG_HEALTH_PING_TIMEOUT", "10"))
+TG_HEALTH_MAX_FAILS = max(1, int(os.getenv("TG_HEALTH_MAX_FAILS", "2")))
+TG_HEALTH_RESTART_BACKOFF = float(os.getenv("TG_HEALTH_RESTART_BACKOFF", "5"))
+TG_HEALTH_MAX_BACKOFF = float(os.getenv("TG_HEALTH_MAX_BACKOFF", "600"))
 USERNAME_CACHE_TTL = float(os.getenv("USERNAME_CACHE_TTL", "86400"))
+USERNAME_NEGATIVE_TTL = float(os.getenv("USERNAME_NEGATIVE_TTL", "900"))
+USERNAME_CACHE_MAX = int(os.getenv("USERNAME_CACHE_MAX", "50000"))
+RECIPIENT_PREWARM = _env_bool("RECIPIENT_PREWARM", True)
+RECIPIENT_PREWARM_WAIT = float(os.getenv("RECIPIENT_PREWARM_WAIT", "1.5"))
+STATE_BACKEND = (os.getenv("STATE_BACKEND", "sqlite") or "sqlite").strip().lower()
+WAITING_TTL = float(os.getenv("WAITING_TTL", "172800"))
+COMPLETED_BUYERS_TTL = float(os.getenv("COMPLETED_BUYERS_TTL", "604800"))
+DELIVERY_JOURNAL_TTL = float(os.getenv("DELIVERY_JOURNAL_TTL", "2592000"))
+DELIVERY_JOURNAL_BATCH = int(os.getenv("DELIVERY_JOURNAL_BATCH", "32"))
 FLOODWAIT_EXTRA_SLEEP = float(os.getenv("FLOODWAIT_EXTRA_SLEEP", "0.30"))
 SPAMBLOCK_PAUSE_SECONDS = float(os.getenv("SPAMBLOCK_PAUSE_SECONDS", "21600"))
 AUTO_DEACTIVATE_ON_FLOODWAIT = _env_bool("AUTO_DEACTIVATE_ON_FLOODWAIT", False)
@@ -204,6 +288,22 @@ TG_AUTO_SWITCH = _env_bool("TG_AUTO_SWITCH", False)
 TG_AUTO_SELECT_FOR_PRECHECK = _env_bool("TG_AUTO_SELECT_FOR_PRECHECK", True)
 TG_BALANCE_CACHE_SECONDS = float(os.getenv("TG_BALANCE_CACHE_SECONDS", "10"))
 TG_FAILOVER_NETWORK_PAUSE = float(os.getenv("TG_FAILOVER_NETWORK_PAUSE", "3"))
+TG_PARALLEL_SEND = _env_bool("TG_PARALLEL_SEND", True)
+TG_BALANCE_PROBE_TIMEOUT = float(os.getenv("TG_BALANCE_PROBE_TIMEOUT", "8"))
+TG_PICK_POLICY = (os.getenv("TG_PICK_POLICY", "best_fit") or "best_fit").strip().lower()
+TG_RESERVATION_TTL = float(os.getenv("TG_RESERVATION_TTL", "1800"))
+TG_LEDGER_RECONCILE_SECONDS = float(os.getenv("TG_LEDGER_RECONCILE_SECONDS", "60"))
+FUNPAY_POOL_MAXSIZE = max(1, int(os.getenv("FUNPAY_POOL_MAXSIZE", "10")))
+FUNPAY_HTTP_RETRIES = max(0, int(os.getenv("FUNPAY_HTTP_RETRIES", "2")))
+LOT_UPDATE_CONCURRENCY = max(1, int(os.getenv("LOT_UPDATE_CONCURRENCY", "6")))
+LOT_UPDATE_MAX_429 = max(0, int(os.getenv("LOT_UPDATE_MAX_429", "8")))
+FUNPAY_429_BACKOFF = float(os.getenv("FUNPAY_429_BACKOFF", "2"))
+FUNPAY_429_MAX_BACKOFF = float(os.getenv("FUNPAY_429_MAX_BACKOFF", "60"))
+LOT_INDEX_REFRESH_SECONDS = float(os.getenv("LOT_INDEX_REFRESH_SECONDS", "600"))
+LOT_INDEX_MAX_AGE = float(os.getenv("LOT_INDEX_MAX_AGE", "86400"))
+EVENT_WORKERS = max(1, int(os.getenv("EVENT_WORKERS", "8")))
+DELIVERY_WORKERS = max(1, int(os.getenv("DELIVERY_WORKERS", "4")))
+MESSAGES_RELOAD_SECONDS = float(os.getenv("MESSAGES_RELOAD_SECONDS", "2.0"))
 _ORIG_GETENV = os.getenv
 _BRANDING_LOCKED = False
 
@@ -386,67 +486,606 @@ def log_error(ctx: str, msg: str):
 with open("gifts.json", "r", encoding="utf-8") as f:
     GIFTS: Dict[str, dict] = json.load(f)
 
+def _gift(key) -> Optional[dict]:
+    if GIFT_CATALOG is not None:
+        return GIFT_CATALOG.gift(key)
+    return GIFTS.get(str(key))
+
 loop = asyncio.new_event_loop()
 _app_started = threading.Event()
-_pyro_gate = threading.Semaphore(1)
 _restarts = 0
-_completed_buyers: set[int] = set()
-waiting: dict[int, dict] = {}
-_last_reply_by_buyer: dict[int, float] = {}
-ACCOUNT_GLOBAL: Optional[Account] = None
 
-class TgSendLimiter:
+class MemoryStateBackend:
+    def load_waiting(self) -> Dict[int, Tuple[dict, float]]:
+        return {}
+
+    def save_waiting(self, buyer_id: int, st: dict, ts: float) -> None:
+        pass
+
+    def delete_waiting(self, buyer_id: int) -> None:
+        pass
+
+    def load_completed(self, since: float) -> Dict[int, float]:
+        return {}
+
+    def save_completed(self, buyer_id: int, ts: float) -> None:
+        pass
+
+    def delete_completed(self, buyer_id: int) -> None:
+        pass
+
+class SqliteStateBackend(MemoryStateBackend):
     def __init__(self):
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = _db()
+        if not self._ready:
+            conn.execute("CREATE TABLE IF NOT EXISTS conv_waiting (buyer_id INTEGER PRIMARY KEY, chat_id INTEGER, state TEXT, data TEXT NOT NULL, updated REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS conv_waiting_chat ON conv_waiting(chat_id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS conv_completed (buyer_id INTEGER PRIMARY KEY, ts REAL NOT NULL)")
+            self._ready = True
+        return conn
+
+    def _run(self, sql: str, args: tuple) -> None:
+        try:
+            with _DB_LOCK:
+                self._conn().execute(sql, args)
+        except sqlite3.Error as e:
+            log_error("state", f"Не смог сохранить состояние: {short_text(e)}")
+
+    def load_waiting(self) -> Dict[int, Tuple[dict, float]]:
+        out: Dict[int, Tuple[dict, float]] = {}
+        with _DB_LOCK:
+            rows = self._conn().execute("SELECT buyer_id, data, updated FROM conv_waiting").fetchall()
+        for bid, data, updated in rows:
+            try:
+                st = json.loads(data)
+            except ValueError:
+                continue
+            if isinstance(st, dict):
+                out[int(bid)] = (st, float(updated))
+        return out
+
+    def save_waiting(self, buyer_id: int, st: dict, ts: float) -> None:
+        try:
+            data = json.dumps(st, ensure_ascii=False, default=str)
+        except (TypeError, ValueError) as e:
+            log_error("state", f"Состояние buyer={buyer_id} не сериализуется: {short_text(e)}")
+            return
+        self._run("INSERT OR REPLACE INTO conv_waiting (buyer_id, chat_id, state, data, updated) VALUES (?, ?, ?, ?, ?)", (int(buyer_id), _safe_int(st.get("chat_id")), st.get("state"), data, ts))
+
+    def delete_waiting(self, buyer_id: int) -> None:
+        self._run("DELETE FROM conv_waiting WHERE buyer_id = ?", (int(buyer_id),))
+
+    def load_completed(self, since: float) -> Dict[int, float]:
+        with _DB_LOCK:
+            conn = self._conn()
+            conn.execute("DELETE FROM conv_completed WHERE ts < ?", (since,))
+            rows = conn.execute("SELECT buyer_id, ts FROM conv_completed").fetchall()
+        return {int(b): float(ts) for b, ts in rows}
+
+    def save_completed(self, buyer_id: int, ts: float) -> None:
+        self._run("INSERT OR REPLACE INTO conv_completed (buyer_id, ts) VALUES (?, ?)", (int(buyer_id), ts))
+
+    def delete_completed(self, buyer_id: int) -> None:
+        self._run("DELETE FROM conv_completed WHERE buyer_id = ?", (int(buyer_id),))
+
+class DeliveryJournal:
+    def __init__(self, ttl: float, batch: int):
+        self.ttl = float(ttl)
+        self.batch = max(1, int(batch))
+        self._lock = threading.Lock()
+        self._begins: List[Tuple[str, float, str, int]] = []
+        self._results: List[Tuple[str, str, float, str, int]] = []
+        self._db_lock = threading.Lock()
+        self._db_conn: Optional[sqlite3.Connection] = None
+
+    def _conn(self) -> sqlite3.Connection:
+        # своё соединение и блокировка, как у UsernameCache: выдача не ждёт _DB_LOCK индекса лотов и состояний
+        if self._db_conn is None:
+            conn = sqlite3.connect(str(BOT_DB_PATH), check_same_thread=False, isolation_level=None, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS delivery_journal ("
+                "order_id TEXT NOT NULL, part INTEGER NOT NULL, unit INTEGER NOT NULL, "
+                "recipient TEXT NOT NULL, gift_id INTEGER NOT NULL, price INTEGER NOT NULL, "
+                "session TEXT, status TEXT NOT NULL, info TEXT, updated REAL NOT NULL, "
+                "PRIMARY KEY (order_id, part))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS delivery_journal_updated ON delivery_journal(updated)")
+            self._db_conn = conn
+        return self._db_conn
+
+    def _flush_locked(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            begins, self._begins = self._begins, []
+            results, self._results = self._results, []
+        if results:
+            conn.executemany("UPDATE delivery_journal SET status = ?, info = ?, updated = ? WHERE order_id = ? AND part = ?", results)
+        if begins:
+            conn.executemany("UPDATE delivery_journal SET status = 'sending', session = ?, updated = ? WHERE order_id = ? AND part = ?", begins)
+
+    def plan(self, order_id: str, units: List[Tuple[int, str, int, int]]) -> List[Tuple[int, str, int, int, str, str]]:
+        now = time.time()
+        rows = [(order_id, part, unit, username, int(gid), int(price), now) for part, (unit, username, gid, price) in enumerate(units)]
+        with self._db_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR IGNORE INTO delivery_journal (order_id, part, unit, recipient, gift_id, price, status, updated) VALUES (?, ?, ?, ?, ?, ?, 'pending', ?)", rows)
+            return conn.execute("SELECT unit, recipient, gift_id, price, status, info FROM delivery_journal WHERE order_id = ? ORDER BY part", (order_id,)).fetchall()
+
+    def remaining(self, order_id: str) -> Optional[int]:
+        # сумма частей, которые ещё будут отправлены; None - журнала по заказу нет
+        with self._db_lock:
+            total, pending = self._conn().execute("SELECT COUNT(*), COALESCE(SUM(CASE WHEN status = 'pending' THEN price END), 0) FROM delivery_journal WHERE order_id = ?", (order_id,)).fetchone()
+        return int(pending) if total else None
+
+    def begin(self, order_id: str, part: int, session: str) -> None:
+        # пишется в базу ближайшим flush(): перед отправкой вызывающий ждёт flush, параллельные begin уходят одной транзакцией
+        with self._lock:
+            self._begins.append((session, time.time(), order_id, part))
+
+    def record(self, order_id: str, part: int, ok: bool, info: str) -> bool:
+        with self._lock:
+            self._results.append(("ok" if ok else "fail", short_text(info, 300), time.time(), order_id, part))
+            return len(self._results) >= self.batch
+
+    def flush(self) -> None:
+        with self._db_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                self._flush_locked(conn)
+
+    def settle(self, order_id: str, results: List[Tuple[int, bool, str]]) -> None:
+        now = time.time()
+        rows = [(short_text(info, 300), now, order_id, part) for part, ok, info in results if not ok]
+        with self._db_lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                self._flush_locked(conn)
+                conn.executemany("UPDATE delivery_journal SET status = 'fail', info = ?, updated = ? WHERE order_id = ? AND part = ? AND status = 'pending'", rows)
+
+    def prune(self) -> int:
+        if self.ttl <= 0:
+            return 0
+        with self._db_lock:
+            return self._conn().execute("DELETE FROM delivery_journal WHERE updated < ?", (time.time() - self.ttl,)).rowcount
+
+# Отслеживается только присваивание ключа верхнего уровня (st["key"] = ...): изменения вложенных
+# списков/словарей на месте не помечают состояние изменённым, их нужно присваивать заново.
+# В базу состояние пишется не при каждом присваивании, а один раз через waiting.commit(buyer_id).
+class _TrackedState(dict):
+    __slots__ = ("_buyer_id", "_dirty")
+
+    def __init__(self, buyer_id: int, data: dict):
+        super().__init__(data)
+        self._buyer_id = buyer_id
+        self._dirty = False
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._dirty = True
+
+class WaitingStore:
+    def __init__(self, backend: MemoryStateBackend, ttl: float):
+        self._lock = threading.RLock()
+        self.backend = backend
+        self.ttl = float(ttl)
+        self._items: Dict[int, _TrackedState] = {}
+        self._touched: Dict[int, float] = {}
+        self._by_chat: Dict[int, int] = {}
+        self._next_prune = 0.0
+
+    def load(self) -> int:
+        now = time.time()
+        try:
+            rows = self.backend.load_waiting()
+        except Exception as e:
+            log_error("state", f"Не смог загрузить состояния: {short_text(e)}")
+            return 0
+        with self._lock:
+            for bid, (st, ts) in rows.items():
+                if self.ttl > 0 and now - ts > self.ttl:
+                    self.backend.delete_waiting(bid)
+                    continue
+                self._put_locked(bid, st, ts)
+            return len(self._items)
+
+    def _put_locked(self, buyer_id: int, st: dict, ts: float) -> _TrackedState:
+        self._unindex_locked(buyer_id)
+        tracked = st if isinstance(st, _TrackedState) and st._buyer_id == buyer_id else _TrackedState(buyer_id, st)
+        tracked._dirty = False
+        self._items[buyer_id] = tracked
+        self._touched[buyer_id] = ts
+        chat = _safe_int(tracked.get("chat_id"))
+        if chat is not None:
+            self._by_chat[chat] = buyer_id
+        return tracked
+
+    def _unindex_locked(self, buyer_id: int) -> None:
+        old = self._items.get(buyer_id)
+        if old is None:
+            return
+        chat = _safe_int(old.get("chat_id"))
+        if chat is not None and self._by_chat.get(chat) == buyer_id:
+            del self._by_chat[chat]
+
+    def _prune_locked(self, now: float) -> None:
+        if self.ttl <= 0 or now < self._next_prune:
+            return
+        self._next_prune = now + min(self.ttl, 300.0)
+        for bid in [b for b, ts in self._touched.items() if now - ts > self.ttl and self._items[b].get("state") != "delivering"]:
+            st = self._pop_locked(bid)
+            if st:
+                release_stars(st.get("order_id"))
+                log_info("state", f"Состояние buyer={bid} истекло (state={st.get('state')})")
+
+    def _pop_locked(self, buyer_id: int) -> Optional[_TrackedState]:
+        self._unindex_locked(buyer_id)
+        st = self._items.pop(buyer_id, None)
+        self._touched.pop(buyer_id, None)
+        if st is not None:
+            self.backend.delete_waiting(buyer_id)
+        return st
+
+    def commit(self, buyer_id: int) -> None:
+        now = time.time()
+        with self._lock:
+            st = self._items.get(buyer_id)
+            if st is None or not st._dirty:
+                return
+            st._dirty = False
+            self._touched[buyer_id] = now
+            chat = _safe_int(st.get("chat_id"))
+            if chat is not None:
+                self._by_chat[chat] = buyer_id
+            self.backend.save_waiting(buyer_id, dict(st), now)
+
+    def __setitem__(self, buyer_id: int, st: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._prune_locked(now)
+            self._put_locked(buyer_id, st, now)
+            self.backend.save_waiting(buyer_id, dict(st), now)
+
+    def __getitem__(self, buyer_id: int) -> _TrackedState:
+        with self._lock:
+            return self._items[buyer_id]
+
+    def __contains__(self, buyer_id) -> bool:
+        with self._lock:
+            self._prune_locked(time.time())
+            return buyer_id in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, buyer_id: int, default=None):
+        with self._lock:
+            return self._items.get(buyer_id, default)
+
+    def pop(self, buyer_id: int, default=None):
+        with self._lock:
+            st = self._pop_locked(buyer_id)
+        return st if st is not None else default
+
+    def items(self) -> List[Tuple[int, _TrackedState]]:
+        with self._lock:
+            return list(self._items.items())
+
+    def by_chat(self, chat_id: int) -> Optional[Tuple[int, _TrackedState]]:
+        chat = _safe_int(chat_id)
+        with self._lock:
+            bid = self._by_chat.get(chat) if chat is not None else None
+            if bid is None or bid not in self._items:
+                return None
+            return bid, self._items[bid]
+
+class CompletedBuyers:
+    def __init__(self, backend: MemoryStateBackend, ttl: float):
+        self._lock = threading.Lock()
+        self.backend = backend
+        self.ttl = float(ttl)
+        self._items: Dict[int, float] = {}
+
+    def load(self) -> int:
+        try:
+            rows = self.backend.load_completed(time.time() - self.ttl if self.ttl > 0 else 0.0)
+        except Exception as e:
+            log_error("state", f"Не смог загрузить завершённых покупателей: {short_text(e)}")
+            return 0
+        with self._lock:
+            self._items.update(rows)
+            return len(self._items)
+
+    def add(self, buyer_id: int) -> None:
+        now = time.time()
+        with self._lock:
+            self._items[buyer_id] = now
+        self.backend.save_completed(buyer_id, now)
+
+    def discard(self, buyer_id: int) -> None:
+        with self._lock:
+            had = self._items.pop(buyer_id, None) is not None
+        if had:
+            self.backend.delete_completed(buyer_id)
+
+    def __contains__(self, buyer_id) -> bool:
+        with self._lock:
+            ts = self._items.get(buyer_id)
+            if ts is None:
+                return False
+            if self.ttl > 0 and time.time() - ts > self.ttl:
+                del self._items[buyer_id]
+                return False
+            return True
+
+class ExpiringDict(dict):
+    def __init__(self, ttl: float):
+        super().__init__()
+        self.ttl = float(ttl)
+        self._next_prune = 0.0
         self._lock = threading.Lock()
-        self._last_any = 0.0
-        self._last_by_rec: Dict[str, float] = {}
-        self._burst = deque()
-        self._pause_until = 0.0
+
+    def __setitem__(self, key, value):
+        now = time.time()
+        with self._lock:
+            super().__setitem__(key, value)
+            if now >= self._next_prune:
+                self._next_prune = now + self.ttl
+                for k in [k for k, v in list(self.items()) if now - v > self.ttl]:
+                    super().__delitem__(k)
+
+_STATE_BACKEND = SqliteStateBackend() if STATE_BACKEND == "sqlite" else MemoryStateBackend()
+_completed_buyers = CompletedBuyers(_STATE_BACKEND, COMPLETED_BUYERS_TTL)
+waiting = WaitingStore(_STATE_BACKEND, WAITING_TTL)
+_last_reply_by_buyer = ExpiringDict(max(60.0, COOLDOWN_SECONDS * 2))
+DELIVERY_JOURNAL = DeliveryJournal(DELIVERY_JOURNAL_TTL, DELIVERY_JOURNAL_BATCH)
+ACCOUNT_GLOBAL: Optional[Account] = None
+
+class TgTokenBucket:
+    def __init__(self, interval: float, burst: int = 0, window: float = 0.0):
+        self.interval = max(0.0, float(interval))
+        self.capacity = float(burst) if burst > 0 and window > 0 else 0.0
+        self.rate = self.capacity / window if self.capacity else 0.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.next_at = 0.0
+        self.blocked_until = 0.0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _ready_at(self, now: float) -> float:
+        at = max(self.next_at, self.blocked_until)
+        if self.capacity:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                at = max(at, now + (1 - self.tokens) / self.rate)
+        return at
+
+    def _take(self, now: float) -> None:
+        self.next_at = now + self.interval
+        if self.capacity:
+            self.tokens -= 1
+
+    def idle(self, now: float) -> bool:
+        return not self._waiters and self.next_at <= now
+
+    def hold(self) -> None:
+        self.next_at = float("inf")
+
+    def release(self, at: float) -> None:
+        self.next_at = at
+        self._wake()
+
+    async def acquire(self) -> None:
+        now = time.monotonic()
+        if not self._waiters and self._ready_at(now) <= now:
+            self._take(now)
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        if self._timer is None:
+            self._wake()
+        await fut
+
+    def _wake(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            at = self._ready_at(now)
+            if at > now:
+                # hold(): очередь ждёт release(), таймер не нужен; pause() учитывается, когда таймер сработает
+                if at != float("inf"):
+                    delay = at - now + (random.uniform(0, SEND_JITTER) if SEND_JITTER > 0 else 0.0)
+                    self._timer = asyncio.get_running_loop().call_later(delay, self._wake)
+                return
+            self._waiters.popleft()
+            self._take(now)
+            fut.set_result(None)
+
+class TgSendLimiter:
+    def __init__(self, shared: Optional[TgTokenBucket] = None):
+        self._session = TgTokenBucket(MIN_SEND_DELAY, BURST_MAX_SENDS, BURST_WINDOW_SECONDS)
+        self._shared = shared
+        self._recipients: "OrderedDict[str, TgTokenBucket]" = OrderedDict()
 
     def pause(self, seconds: float):
         if seconds <= 0:
             return
-        now = time.monotonic()
-        with self._lock:
-            self._pause_until = max(self._pause_until, now + seconds)
-
-    def _calc_wait_locked(self, now: float, rec_key: str) -> float:
-        wait = 0.0
-        if now < self._pause_until:
-            wait = max(wait, self._pause_until - now)
-        if MIN_SEND_DELAY > 0:
-            wait = max(wait, MIN_SEND_DELAY - (now - self._last_any))
-        if PER_RECIPIENT_DELAY > 0:
-            last_r = self._last_by_rec.get(rec_key, 0.0)
-            wait = max(wait, PER_RECIPIENT_DELAY - (now - last_r))
-        if BURST_WINDOW_SECONDS > 0 and BURST_MAX_SENDS > 0:
-            while self._burst and (now - self._burst[0]) >= BURST_WINDOW_SECONDS:
-                self._burst.popleft()
-            if len(self._burst) >= BURST_MAX_SENDS:
-                wait = max(wait, BURST_WINDOW_SECONDS - (now - self._burst[0]))
-        if SEND_JITTER > 0 and wait > 0:
-            wait += random.uniform(0, SEND_JITTER)
-        return wait
-
-    def _reserve_locked(self, now: float, rec_key: str) -> None:
-        self._last_any = now
-        self._last_by_rec[rec_key] = now
-        if BURST_WINDOW_SECONDS > 0 and BURST_MAX_SENDS > 0:
-            self._burst.append(now)
+        self._session.blocked_until = max(self._session.blocked_until, time.monotonic() + seconds)
+
+    def _evict(self, now: float) -> None:
+        recs = self._recipients
+        while recs:
+            key, rec = next(iter(recs.items()))
+            if not rec.idle(now):
+                return
+            del recs[key]
 
     async def wait_async(self, rec_key: str) -> None:
         rec_key = rec_key.lower().strip()
-        while True:
-            now = time.monotonic()
-            with self._lock:
-                wait = self._calc_wait_locked(now, rec_key)
-                if wait <= 0:
-                    self._reserve_locked(now, rec_key)
-                    return
-            await asyncio.sleep(min(wait, 5.0))
+        rec = self._recipients.get(rec_key)
+        if rec is None:
+            rec = self._recipients[rec_key] = TgTokenBucket(PER_RECIPIENT_DELAY)
+        self._recipients.move_to_end(rec_key)
+        held = False
+        sent_at = None
+        try:
+            await rec.acquire()
+            rec.hold()
+            held = True
+            await self._session.acquire()
+            shared = self._shared
+            if shared is not None and shared.interval > 0:
+                await shared.acquire()
+            sent_at = time.monotonic()
+        finally:
+            if held:
+                rec.release(sent_at + PER_RECIPIENT_DELAY if sent_at is not None else time.monotonic())
+            self._evict(time.monotonic())
+
+class UsernameNotOccupied(Exception):
+    pass
+
+class UsernameCache:
+    def __init__(self, ttl: float, negative_ttl: float, max_rows: int, mem_size: int = 4096):
+        self._lock = threading.Lock()
+        self.ttl = float(ttl)
+        self.negative_ttl = float(negative_ttl)
+        self.max_rows = max(1, int(max_rows))
+        self.mem_size = max(1, int(mem_size))
+        self._mem: "OrderedDict[str, Tuple[Optional[int], float]]" = OrderedDict()
+        self._peers: "OrderedDict[Tuple[str, int], None]" = OrderedDict()
+        self._db_lock = threading.Lock()
+        self._db_conn: Optional[sqlite3.Connection] = None
+        self._writes = 0
+
+    def _conn(self) -> sqlite3.Connection:
+        # своё соединение и блокировка: резолв из цикла Pyrogram не ждёт _DB_LOCK, пока индекс лотов пишет в базу
+        if self._db_conn is None:
+            conn = sqlite3.connect(str(BOT_DB_PATH), check_same_thread=False, isolation_level=None, timeout=10.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS tg_usernames (username TEXT PRIMARY KEY, user_id INTEGER, expires REAL NOT NULL, last_used REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS tg_usernames_last_used ON tg_usernames(last_used)")
+            conn.execute("CREATE TABLE IF NOT EXISTS tg_peers (session TEXT NOT NULL, user_id INTEGER NOT NULL, PRIMARY KEY (session, user_id))")
+            self._db_conn = conn
+        return self._db_conn
+
+    def _remember_locked(self, key: str, uid: Optional[int], expires: float) -> None:
+        self._mem[key] = (uid, expires)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_size:
+            self._mem.popitem(last=False)
+
+    def get(self, username: str) -> Tuple[bool, Optional[int]]:
+        key = username.lstrip("@").lower()
+        now = time.time()
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                if hit[1] > now:
+                    self._mem.move_to_end(key)
+                    return True, hit[0]
+                del self._mem[key]
+        try:
+            with self._db_lock:
+                conn = self._conn()
+                row = conn.execute("SELECT user_id, expires FROM tg_usernames WHERE username = ?", (key,)).fetchone()
+                if row is None or row[1] <= now:
+                    return False, None
+                conn.execute("UPDATE tg_usernames SET last_used = ? WHERE username = ?", (now, key))
+        except sqlite3.Error as e:
+            log_warn("resolve", f"Кэш username недоступен: {short_text(e)}")
+            return False, None
+        with self._lock:
+            self._remember_locked(key, row[0], row[1])
+        return True, row[0]
+
+    def put(self, username: str, uid: Optional[int]) -> None:
+        key = username.lstrip("@").lower()
+        now = time.time()
+        expires = now + (self.ttl if uid is not None else self.negative_ttl)
+        with self._lock:
+            self._remember_locked(key, uid, expires)
+            self._writes += 1
+            prune = self._writes % 256 == 0
+        try:
+            with self._db_lock:
+                conn = self._conn()
+                conn.execute("INSERT OR REPLACE INTO tg_usernames (username, user_id, expires, last_used) VALUES (?, ?, ?, ?)", (key, uid, expires, now))
+                if prune:
+                    self._prune(conn, now)
+        except sqlite3.Error as e:
+            log_warn("resolve", f"Не смог сохранить кэш username: {short_text(e)}")
+
+    def _prune(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute("DELETE FROM tg_usernames WHERE expires <= ?", (now,))
+        (count,) = conn.execute("SELECT COUNT(*) FROM tg_usernames").fetchone()
+        if count > self.max_rows:
+            conn.execute("DELETE FROM tg_usernames WHERE username IN (SELECT username FROM tg_usernames ORDER BY last_used LIMIT ?)", (count - self.max_rows,))
+        conn.execute("DELETE FROM tg_peers WHERE user_id NOT IN (SELECT user_id FROM tg_usernames WHERE user_id IS NOT NULL)")
+
+    def has_peer(self, session: str, uid: int) -> bool:
+        k = (session, int(uid))
+        with self._lock:
+            if k in self._peers:
+                self._peers.move_to_end(k)
+                return True
+        try:
+            with self._db_lock:
+                row = self._conn().execute("SELECT 1 FROM tg_peers WHERE session = ? AND user_id = ?", k).fetchone()
+        except sqlite3.Error:
+            return False
+        if row is None:
+            return False
+        self._touch_peer(k)
+        return True
+
+    def add_peer(self, session: str, uid: int) -> None:
+        k = (session, int(uid))
+        with self._lock:
+            if k in self._peers:
+                return
+        try:
+            with self._db_lock:
+                self._conn().execute("INSERT OR IGNORE INTO tg_peers (session, user_id) VALUES (?, ?)", k)
+        except sqlite3.Error as e:
+            log_warn("resolve", f"Не смог сохранить peer: {short_text(e)}")
+            return
+        self._touch_peer(k)
+
+    def drop_peer(self, session: str, uid: int) -> None:
+        k = (session, int(uid))
+        with self._lock:
+            self._peers.pop(k, None)
+        try:
+            with self._db_lock:
+                self._conn().execute("DELETE FROM tg_peers WHERE session = ? AND user_id = ?", k)
+        except sqlite3.Error:
+            pass
+
+    def _touch_peer(self, k: Tuple[str, int]) -> None:
+        with self._lock:
+            self._peers[k] = None
+            self._peers.move_to_end(k)
+            while len(self._peers) > self.mem_size:
+                self._peers.popitem(last=False)
 
-_username_cache_lock = threading.Lock()
-_username_id_cache: Dict[str, Tuple[int, float]] = {}
+USERNAME_CACHE = UsernameCache(USERNAME_CACHE_TTL, USERNAME_NEGATIVE_TTL, USERNAME_CACHE_MAX)
 _last_flood_deactivate_ts = 0.0
 
 def _session_sort_key(name: str) -> Tuple[int, int, str]:
@@ -507,15 +1146,110 @@ def _load_session_names() -> List[str]:
     return names
 
 
+class StarsLedger:
+    def __init__(self, n: int):
+        self._lock = threading.Lock()
+        self.balance: List[Optional[int]] = [None] * n
+        self.synced_at: List[float] = [0.0] * n
+        self.held: List[int] = [0] * n
+        self._seq: List[int] = [0] * n
+        self._res: Dict[str, Tuple[int, int, float]] = {}
+
+    def _drop_locked(self, key: str) -> int:
+        r = self._res.pop(key, None)
+        if r is None:
+            return 0
+        self.held[r[0]] -= r[1]
+        return r[1]
+
+    def _expire_locked(self, now: float) -> None:
+        for k in [k for k, r in self._res.items() if r[2] <= now]:
+            self._drop_locked(k)
+
+    def seq(self, idx: int) -> int:
+        with self._lock:
+            return self._seq[idx]
+
+    def known(self, idxs: List[int]) -> bool:
+        with self._lock:
+            return any(self.balance[i] is not None for i in idxs)
+
+    def reconcile(self, idx: int, bal: Optional[int], seq: Optional[int] = None) -> bool:
+        if bal is None:
+            return False
+        with self._lock:
+            if seq is not None and seq != self._seq[idx]:
+                return False
+            self.balance[idx] = int(bal)
+            self.synced_at[idx] = time.time()
+            return True
+
+    def available(self, idx: int, key: Optional[str] = None) -> Optional[int]:
+        with self._lock:
+            self._expire_locked(time.time())
+            bal = self.balance[idx]
+            if bal is None:
+                return None
+            own = self._res.get(key) if key is not None else None
+            return bal - self.held[idx] + (own[1] if own and own[0] == idx else 0)
+
+    def reserve(self, key: str, idxs: List[int], need: int) -> Tuple[Optional[int], Optional[int]]:
+        now = time.time()
+        with self._lock:
+            self._expire_locked(now)
+            self._drop_locked(key)
+            avail = {i: self.balance[i] - self.held[i] for i in idxs if self.balance[i] is not None}
+            idx = _select_session(idxs, avail, need)
+            if idx is None:
+                return None, None
+            if need > 0 and avail[idx] >= need:
+                self._res[key] = (idx, need, now + TG_RESERVATION_TTL)
+                self.held[idx] += need
+            return idx, avail[idx]
+
+    def debit(self, idx: int, amount: int, key: Optional[str] = None) -> None:
+        with self._lock:
+            self._seq[idx] += 1
+            if self.balance[idx] is not None:
+                self.balance[idx] = max(0, self.balance[idx] - amount)
+            r = self._res.get(key) if key is not None else None
+            if r is None:
+                return
+            ridx, amt, exp = r
+            take = min(amt, amount)
+            self.held[ridx] -= take
+            if amt > take:
+                self._res[key] = (ridx, amt - take, exp)
+            else:
+                self._res.pop(key, None)
+
+    def exhaust(self, idx: int) -> None:
+        with self._lock:
+            self._seq[idx] += 1
+            self.balance[idx] = 0
+
+    def release(self, key: str) -> int:
+        with self._lock:
+            return self._drop_locked(key)
+
 class TgAccountManager:
     def __init__(self, session_names: List[str]):
         self._lock = threading.Lock()
         self.session_names = list(session_names)
         self.clients: List[Client] = []
         self.limiters: List[TgSendLimiter] = []
+        self.send_gate: Optional[TgTokenBucket] = None
         self.usable_until: List[float] = []
         self.alive: List[bool] = []
         self.balance_cache: List[Tuple[Optional[int], float]] = []
+        self.balance_locks: List[asyncio.Lock] = []
+        self.health_locks: List[asyncio.Lock] = []
+        self.latency: List[Optional[float]] = []
+        self.checked_at: List[float] = []
+        self.health_fails: List[int] = []
+        self.restart_fails: List[int] = []
+        self.next_restart: List[float] = []
+        self.ledger = StarsLedger(len(self.session_names))
         self.active_idx = 0
 
     def set_active(self, idx: int) -> None:
@@ -549,17 +1283,61 @@ class TgAccountManager:
         order = [a] + [i for i in range(n) if i != a]
         return order
 
-    async def _precheck_authorized(self, c: Client, name: str):
+    async def _boot(self, c: Client, name: str):
+        try:
+            authorized = await c.connect()
+        except Exception as e:
+            log_warn("tg", f"Сессия НЕ авторизована/битая: {name} :: {short_text(e)}")
+            return None
         try:
-            await c.connect()
+            if not authorized:
+                raise RuntimeError("session is not authorized")
             me = await c.get_me()
+            c.me = me
+            await c.initialize()
             return me
         except Exception as e:
             log_warn("tg", f"Сессия НЕ авторизована/битая: {name} :: {short_text(e)}")
+            with suppress(Exception):
+                await c.disconnect()
             return None
-        finally:
+
+    async def _boot_with_timeout(self, idx: int):
+        c = self.clients[idx]
+        name = self.session_names[idx]
+        try:
+            return await asyncio.wait_for(self._boot(c, name), TG_STARTUP_TIMEOUT)
+        except asyncio.TimeoutError:
+            log_error("tg", f"Сессия {name} не запустилась за {TG_STARTUP_TIMEOUT:.0f}с")
             with suppress(Exception):
                 await c.disconnect()
+            return None
+
+    async def _start_one(self, idx: int, gate: asyncio.Semaphore) -> None:
+        name = self.session_names[idx]
+        async with gate:
+            me = await self._boot_with_timeout(idx)
+        if me is None:
+            self.alive[idx] = False
+            return
+        self.alive[idx] = True
+
+        uname = None
+        try:
+            uname = f"@{me.username}" if getattr(me, "username", None) else (f"{getattr(me, 'first_name', '')}".strip() or "id=" + str(getattr(me, "id", "?")))
+        except Exception:
+            uname = None
+
+        stars = None
+        try:
+            stars = await asyncio.wait_for(self.get_balance(idx), TG_BALANCE_PROBE_TIMEOUT)
+        except Exception:
+            stars = None
+
+        if uname:
+            log_info("tg", f"Сессия активна: {name} -> {uname} | Stars: {stars if stars is not None else '—'}")
+        else:
+            log_info("tg", f"Сессия активна: {name} | Stars: {stars if stars is not None else '—'}")
 
     async def start_all(self) -> None:
         common = dict(workdir=str(SESSIONS_DIR), no_updates=True)
@@ -568,50 +1346,37 @@ class TgAccountManager:
 
         self.clients = []
         self.limiters = []
+        self.send_gate = TgTokenBucket(TG_GLOBAL_SEND_DELAY)
         self.usable_until = []
         self.alive = []
         self.balance_cache = []
+        self.balance_locks = []
+        self.health_locks = []
+        self.latency = []
+        self.checked_at = []
+        self.health_fails = []
+        self.restart_fails = []
+        self.next_restart = []
 
         for name in self.session_names:
             c = Client(name, api_id=API_ID, api_hash=API_HASH, **common)
             self.clients.append(c)
-            self.limiters.append(TgSendLimiter())
+            self.limiters.append(TgSendLimiter(self.send_gate))
             self.usable_until.append(0.0)
             self.alive.append(False)
             self.balance_cache.append((None, 0.0))
-
-        for i, c in enumerate(self.clients):
-            name = self.session_names[i]
-
-            me = await self._precheck_authorized(c, name)
-            if me is None:
-                self.alive[i] = False
-                continue
-
-            try:
-                await c.start()
-                self.alive[i] = True
-
-                uname = None
-                try:
-                    uname = f"@{me.username}" if getattr(me, "username", None) else (f"{getattr(me, 'first_name', '')}".strip() or "id=" + str(getattr(me, "id", "?")))
-                except Exception:
-                    uname = None
-
-                stars = None
-                try:
-                    stars = await self.get_balance(i)
-                except Exception:
-                    stars = None
-
-                if uname:
-                    log_info("tg", f"Сессия активна: {name} -> {uname} | Stars: {stars if stars is not None else '—'}")
-                else:
-                    log_info("tg", f"Сессия активна: {name} | Stars: {stars if stars is not None else '—'}")
-
-            except Exception as e:
-                self.alive[i] = False
-                log_error("tg", f"Не удалось запустить сессию {name}: {short_text(e)}")
+            self.balance_locks.append(asyncio.Lock())
+            self.health_locks.append(asyncio.Lock())
+            self.latency.append(None)
+            self.checked_at.append(0.0)
+            self.health_fails.append(0)
+            self.restart_fails.append(0)
+            self.next_restart.append(0.0)
+
+        t0 = time.monotonic()
+        gate = asyncio.Semaphore(max(1, TG_STARTUP_CONCURRENCY))
+        await asyncio.gather(*(self._start_one(i, gate) for i in range(len(self.clients))))
+        log_info("tg", f"Запуск сессий: {sum(self.alive)}/{len(self.clients)} за {time.monotonic() - t0:.1f}с")
 
         if not any(self.alive):
             raise RuntimeError("Ни одна Telegram-сессия не запустилась")
@@ -654,20 +1419,73 @@ class TgAccountManager:
         c = self.clients[idx]
         with suppress(Exception):
             await c.stop()
+        if getattr(c, "is_connected", False):
+            with suppress(Exception):
+                await c.disconnect()
         await asyncio.sleep(0.2)
 
-        me = await self._precheck_authorized(c, self.session_names[idx])
-        if me is None:
-            self.alive[idx] = False
-            return False
+        me = await self._boot_with_timeout(idx)
+        self.alive[idx] = me is not None
+        return me is not None
 
-        try:
-            await c.start()
-            self.alive[idx] = True
-            return True
-        except Exception:
-            self.alive[idx] = False
-            return False
+    async def check(self, idx: int) -> None:
+        lock = self.health_locks[idx]
+        if lock.locked():
+            return
+        async with lock:
+            await self._check_locked(idx)
+
+    async def _check_locked(self, idx: int) -> None:
+        name = self.session_names[idx]
+        if self.alive[idx]:
+            t0 = time.monotonic()
+            try:
+                await asyncio.wait_for(self.clients[idx].get_me(), TG_HEALTH_PING_TIMEOUT)
+                self.latency[idx] = time.monotonic() - t0
+                self.checked_at[idx] = time.time()
+                self.health_fails[idx] = 0
+                return
+            except Exception as e:
+                self.latency[idx] = None
+                self.health_fails[idx] += 1
+                log_warn("tg", f"Health: {name} ping failed ({self.health_fails[idx]}/{TG_HEALTH_MAX_FAILS}) :: {short_text(e)}")
+                if self.health_fails[idx] < TG_HEALTH_MAX_FAILS:
+                    self.mark_unusable(idx, TG_FAILOVER_NETWORK_PAUSE)
+                    return
+                self.alive[idx] = False
+        now = time.time()
+        if now < self.next_restart[idx]:
+            return
+        if await self.restart(idx):
+            self.health_fails[idx] = 0
+            self.restart_fails[idx] = 0
+            self.next_restart[idx] = 0.0
+            self.checked_at[idx] = time.time()
+            log_info("tg", f"Health: {name} перезапущена")
+            return
+        self.restart_fails[idx] += 1
+        delay = min(TG_HEALTH_MAX_BACKOFF, TG_HEALTH_RESTART_BACKOFF * 2 ** min(self.restart_fails[idx] - 1, 16))
+        self.next_restart[idx] = time.time() + delay
+        log_warn("tg", f"Health: {name} не поднялась, следующая попытка через {delay:.0f}с")
+
+    def health_snapshot(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        active = self.get_active()
+        out: List[Dict[str, Any]] = []
+        for i, name in enumerate(self.session_names[:len(self.clients)]):
+            lat = self.latency[i]
+            out.append({
+                "session": name,
+                "active": i == active,
+                "alive": bool(self.alive[i]),
+                "usable": self.is_usable(i),
+                "latency_ms": round(lat * 1000) if lat is not None else None,
+                "fails": self.health_fails[i],
+                "checked_ago": round(now - self.checked_at[i], 1) if self.checked_at[i] else None,
+                "restart_in": max(0.0, round(self.next_restart[i] - now, 1)) if self.next_restart[i] else None,
+                "stars": self.ledger.balance[i],
+            })
+        return out
 
     async def get_balance(self, idx: int) -> Optional[int]:
         if not (0 <= idx < len(self.clients)):
@@ -675,9 +1493,23 @@ class TgAccountManager:
         if not self.alive[idx]:
             return None
         cached, exp = self.balance_cache[idx]
-        now = time.time()
-        if cached is not None and now < exp:
+        if cached is not None and time.time() < exp:
             return cached
+        async with self.balance_locks[idx]:
+            cached, exp = self.balance_cache[idx]
+            if cached is not None and time.time() < exp:
+                return cached
+            return await self._fetch_balance(idx)
+
+    async def refresh_balance(self, idx: int) -> Optional[int]:
+        if not self.is_usable(idx):
+            return None
+        async with self.balance_locks[idx]:
+            return await self._fetch_balance(idx)
+
+    async def _fetch_balance(self, idx: int) -> Optional[int]:
+        now = time.time()
+        seq = self.ledger.seq(idx)
         try:
             bal = await self.clients[idx].get_stars_balance()
             out: Optional[int] = None
@@ -697,12 +1529,16 @@ class TgAccountManager:
                 except Exception:
                     out = None
             self.balance_cache[idx] = (out, now + TG_BALANCE_CACHE_SECONDS)
+            if TG_DELIVERY is None or not TG_DELIVERY.inflight.get(idx):
+                self.ledger.reconcile(idx, out, seq)
             return out
         except Exception:
             self.balance_cache[idx] = (None, now + min(2.0, TG_BALANCE_CACHE_SECONDS))
             return None
 
 TG_MANAGER: Optional[TgAccountManager] = None
+TG_DELIVERY: Optional["TgDeliveryScheduler"] = None
+TG_HEALTH: List[Dict[str, Any]] = []
 
 def _exc_wait_seconds(e: Exception) -> int:
     v = getattr(e, "value", None)
@@ -735,12 +1571,15 @@ def _handle_floodwait(idx: int, seconds: int, username: str, gift_id: int, exc:
         now = time.time()
         if now - _last_flood_deactivate_ts >= FLOOD_DEACTIVATE_COOLDOWN:
             _last_flood_deactivate_ts = now
-            try:
-                log_warn("tg", "AUTO_DEACTIVATE_ON_FLOODWAIT=ON -> деактивирую лоты во всех CATEGORY_IDS...")
-                for cid in CATEGORY_IDS_LIST:
-                    deactivate_lots(ACCOUNT_GLOBAL, cid)
-            except Exception as e:
-                log_error("tg", f"Не смог деактивировать лоты после FloodWait: {short_text(e)}")
+            log_warn("tg", "AUTO_DEACTIVATE_ON_FLOODWAIT=ON -> деактивирую лоты во всех CATEGORY_IDS...")
+            threading.Thread(target=_deactivate_all_categories, args=(ACCOUNT_GLOBAL,), daemon=True).start()
+
+def _deactivate_all_categories(account: Account) -> None:
+    try:
+        for cid in CATEGORY_IDS_LIST:
+            deactivate_lots(account, cid)
+    except Exception as e:
+        log_error("tg", f"Не смог деактивировать лоты после FloodWait: {short_text(e)}")
 
 def _handle_spamblock(idx: int, username: str, gift_id: int, exc: Optional[Exception] = None):
     if TG_MANAGER is not None:
@@ -754,6 +1593,8 @@ def _handle_network(idx: int, username: str, gift_id: int, exc: Optional[Excepti
         TG_MANAGER.mark_unusable(idx, float(TG_FAILOVER_NETWORK_PAUSE))
         if 0 <= idx < len(TG_MANAGER.limiters):
             TG_MANAGER.limiters[idx].pause(float(TG_FAILOVER_NETWORK_PAUSE))
+    if TG_MANAGER is not None and 0 <= idx < len(TG_MANAGER.health_locks):
+        asyncio.ensure_future(TG_MANAGER.check(idx))
     log_warn("tg", f"NETWORK session={TG_MANAGER.session_names[idx] if TG_MANAGER else idx} to=@{username.lstrip('@')} gift_id={gift_id} :: {short_text(exc)}")
 
 from contextlib import suppress
@@ -823,12 +1664,12 @@ def _fmt_ids(ids: List[int], limit: int = AUTO_RAISE_LOG_SUBCATS_LIMIT) -> str:
     head = ids[:limit]
     return "[" + ",".join(map(str, head)) + f",…(+{len(ids)-limit})]"
 
-def _auto_raise_loop(funpay_token: str):
+def _auto_raise_loop(funpay_token: str, session=None):
     if not AUTO_RAISE_LOTS:
         return
 
     try:
-        acc = Account(funpay_token)
+        acc = Account(funpay_token, session=session)
         acc.get()
     except Exception as e:
         log_error("raise", f"Автоподнятие: не удалось авторизоваться: {short_text(e)}")
@@ -875,31 +1716,80 @@ def _auto_raise_loop(funpay_token: str):
 async def _resolve_user_id_cached(idx: int, username: str) -> int:
     uname = username.lstrip("@")
     key = uname.lower()
-    now = time.monotonic()
-    with _username_cache_lock:
-        hit = _username_id_cache.get(key)
-        if hit and hit[1] > now:
-            return hit[0]
     if TG_MANAGER is None:
         raise RuntimeError("tg manager not started")
     if not (0 <= idx < len(TG_MANAGER.clients)):
         raise RuntimeError("bad tg idx")
+    session = TG_MANAGER.session_names[idx]
+    hit, uid = USERNAME_CACHE.get(key)
+    if hit and uid is None:
+        raise UsernameNotOccupied(f"USERNAME_NOT_OCCUPIED (cached) @{uname}")
+    if hit and USERNAME_CACHE.has_peer(session, uid):
+        return uid
     await TG_MANAGER.limiters[idx].wait_async(f"resolve:{key}")
-    u = await TG_MANAGER.clients[idx].get_users(uname)
+    try:
+        u = await TG_MANAGER.clients[idx].get_users(uname)
+    except (TgUsernameNotOccupied, TgUsernameInvalid) as e:
+        USERNAME_CACHE.put(key, None)
+        raise UsernameNotOccupied(f"USERNAME_NOT_OCCUPIED @{uname}: {short_text(e)}") from e
+    except Exception as e:
+        if getattr(e, "ID", None) in ("USERNAME_NOT_OCCUPIED", "USERNAME_INVALID"):
+            USERNAME_CACHE.put(key, None)
+            raise UsernameNotOccupied(f"USERNAME_NOT_OCCUPIED @{uname}: {short_text(e)}") from e
+        raise
     if isinstance(u, list):
         u = u[0]
     uid = int(getattr(u, "id", 0) or 0)
     if uid <= 0:
         raise RuntimeError("resolve returned empty user_id")
-    with _username_cache_lock:
-        _username_id_cache[key] = (uid, now + USERNAME_CACHE_TTL)
+    USERNAME_CACHE.put(key, uid)
+    USERNAME_CACHE.add_peer(session, uid)
     return uid
 
-async def _runner_start():
-    global TG_MANAGER
-    names = _load_session_names()
-    TG_MANAGER = TgAccountManager(names)
-    await TG_MANAGER.start_all()
+async def _prewarm_one(idx: int, username: str) -> str:
+    try:
+        await _resolve_user_id_cached(idx, username)
+        return "ok"
+    except UsernameNotOccupied:
+        return "not_found"
+    except Exception as e:
+        log_warn("resolve", f"prewarm @{username} failed: {short_text(e)}")
+        return "error"
+
+async def _prewarm_recipients(usernames: List[str]) -> Dict[str, str]:
+    if TG_MANAGER is None:
+        return {}
+    idx = next((i for i in TG_MANAGER.order_try_list() if TG_MANAGER.is_usable(i)), None)
+    if idx is None:
+        return {}
+    uniq = list(dict.fromkeys(u.lstrip("@").lower() for u in usernames if u))
+    res = await asyncio.gather(*(_prewarm_one(idx, u) for u in uniq))
+    return dict(zip(uniq, res))
+
+def prewarm_recipients_sync(usernames: List[str], wait: float = RECIPIENT_PREWARM_WAIT) -> Dict[str, str]:
+    if not RECIPIENT_PREWARM or TG_MANAGER is None or not usernames:
+        return {}
+    fut = asyncio.run_coroutine_threadsafe(_prewarm_recipients(usernames), loop)
+    try:
+        return fut.result(timeout=max(0.0, wait))
+    except Exception:
+        return {}
+
+def _unknown_recipients(usernames: List[str]) -> List[str]:
+    res = prewarm_recipients_sync(usernames)
+    return [f"@{u}" for u, v in res.items() if v == "not_found"]
+
+async def _runner_start():
+    global TG_MANAGER, TG_DELIVERY, TG_HEALTH
+    names = _load_session_names()
+    TG_MANAGER = TgAccountManager(names)
+    await TG_MANAGER.start_all()
+    TG_DELIVERY = TgDeliveryScheduler(TG_MANAGER)
+    if TG_LEDGER_RECONCILE_SECONDS > 0:
+        loop.create_task(_ledger_reconcile_loop())
+    TG_HEALTH = TG_MANAGER.health_snapshot()
+    if TG_HEALTH_INTERVAL > 0:
+        loop.create_task(_health_supervisor())
     mode = "auto" if TG_AUTO_SWITCH else "manual"
     active = TG_MANAGER.get_active() if TG_MANAGER else 0
     act_name = TG_MANAGER.session_names[active] if TG_MANAGER and TG_MANAGER.session_names else "?"
@@ -915,38 +1805,66 @@ def _thread_target():
         log_error("tg", f"Ошибка запуска Pyrogram-потока: {short_text(e)}")
         _app_started.set()
 
-async def _ensure_any_alive() -> bool:
-    if TG_MANAGER is None:
-        return False
-    order = TG_MANAGER.order_try_list()
-    if not order:
+def _run_on_loop(coro, timeout: float, default: Any = None) -> Any:
+    fut = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return fut.result(timeout=timeout)
+    except Exception:
+        fut.cancel()
+        return default
+
+def _tg_ready() -> bool:
+    if TG_MANAGER is None or not TG_MANAGER.clients:
         return False
-    a = TG_MANAGER.get_active()
-    if await TG_MANAGER.ping(a):
-        return True
-    if await TG_MANAGER.restart(a) and await TG_MANAGER.ping(a):
-        return True
     if not TG_AUTO_SWITCH:
+        return bool(TG_MANAGER.alive[TG_MANAGER.get_active()])
+    return any(TG_MANAGER.alive)
+
+async def _supervise_once() -> bool:
+    m = TG_MANAGER
+    if m is None:
         return False
-    for idx in order:
-        if idx == a:
-            continue
-        if await TG_MANAGER.ping(idx):
-            TG_MANAGER.set_active(idx)
-            return True
-        if await TG_MANAGER.restart(idx) and await TG_MANAGER.ping(idx):
-            TG_MANAGER.set_active(idx)
-            return True
-    return False
+    await asyncio.gather(*(m.check(i) for i in range(len(m.clients))), return_exceptions=True)
+    a = m.get_active()
+    if TG_AUTO_SWITCH and not m.alive[a]:
+        nxt = next((i for i in m.order_try_list() if m.is_usable(i)), None)
+        if nxt is not None:
+            m.set_active(nxt)
+            log_warn("tg", f"Health: активная сессия {m.session_names[a]} недоступна -> {m.session_names[nxt]}")
+    return _tg_ready()
+
+def _health_line(snap: List[Dict[str, Any]]) -> str:
+    parts = []
+    for h in snap:
+        if h["alive"]:
+            lat = f"{h['latency_ms']}ms" if h["latency_ms"] is not None else "?"
+            parts.append(f"{h['session']}{'*' if h['active'] else ''} ok {lat}")
+        else:
+            parts.append(f"{h['session']} DOWN" + (f" (retry {h['restart_in']:.0f}s)" if h["restart_in"] else ""))
+    return ", ".join(parts)
+
+async def _health_supervisor() -> None:
+    global TG_HEALTH
+    last_state = None
+    while True:
+        await asyncio.sleep(TG_HEALTH_INTERVAL)
+        try:
+            await _supervise_once()
+            snap = TG_MANAGER.health_snapshot() if TG_MANAGER else []
+            TG_HEALTH = snap
+            state = tuple((h["session"], h["alive"], h["active"]) for h in snap)
+            if state != last_state:
+                log_info("tg", f"Health: {_health_line(snap)}")
+                last_state = state
+        except Exception as e:
+            log_error("tg", f"Health supervisor error: {short_text(e)}")
 
 def _ensure_pyro_alive_sync() -> bool:
     if TG_MANAGER is None:
         return False
-    fut = asyncio.run_coroutine_threadsafe(_ensure_any_alive(), loop)
-    try:
-        return bool(fut.result(timeout=25.0))
-    except Exception:
-        return False
+    if _tg_ready():
+        return True
+    return bool(_run_on_loop(_supervise_once(), 25.0, False))
 
 def _safe_attr(o: Any, *names: str, default: Any = None):
     for n in names:
@@ -1151,7 +2069,7 @@ def _choice_menu(options: List[str]) -> Tuple[List[str], str]:
     lines: List[str] = []
     for gk in options or []:
         gk = str(gk)
-        g = GIFTS.get(gk)
+        g = _gift(gk)
         if not g:
             continue
         normalized.append(gk)
@@ -1175,7 +2093,7 @@ async def _get_stars_balance_once(idx: int) -> Optional[int]:
     if TG_MANAGER is None:
         return None
     try:
-        return await TG_MANAGER.get_balance(idx)
+        return await asyncio.wait_for(TG_MANAGER.get_balance(idx), TG_BALANCE_PROBE_TIMEOUT)
     except Exception:
         return None
 
@@ -1184,14 +2102,40 @@ def get_stars_balance_sync(timeout: float = 10.0) -> Optional[int]:
         return None
     if not _ensure_pyro_alive_sync():
         return None
-    idx = TG_MANAGER.get_active()
-    with _pyro_gate:
-        fut = asyncio.run_coroutine_threadsafe(_get_stars_balance_once(idx), loop)
-        try:
-            res = fut.result(timeout=timeout)
-            return res if isinstance(res, int) and res >= 0 else None
-        except Exception:
-            return None
+    res = _run_on_loop(_get_stars_balance_once(TG_MANAGER.get_active()), timeout)
+    return res if isinstance(res, int) and res >= 0 else None
+
+async def _timed_balance(idx: int) -> Tuple[Optional[int], float]:
+    t0 = time.monotonic()
+    bal = await _get_stars_balance_once(idx)
+    return bal, time.monotonic() - t0
+
+def _select_session(order: List[int], balances: Dict[int, int], need: int) -> Optional[int]:
+    if not balances:
+        return None
+    fit = [i for i in order if i in balances and balances[i] >= need]
+    if not fit:
+        return max(order, key=lambda i: balances.get(i, -1))
+    if TG_PICK_POLICY == "first":
+        return fit[0]
+    if TG_PICK_POLICY == "spread":
+        load = TG_DELIVERY.inflight if TG_DELIVERY is not None else {}
+        return min(fit, key=lambda i: (load.get(i, 0), -balances[i]))
+    return min(fit, key=lambda i: balances[i])
+
+async def _pick_account_for_need(need: int) -> Tuple[Optional[int], Optional[int]]:
+    if TG_MANAGER is None:
+        return None, None
+    order = [i for i in TG_MANAGER.order_try_list() if TG_MANAGER.is_usable(i)]
+    t0 = time.monotonic()
+    probes = await asyncio.gather(*(_timed_balance(i) for i in order))
+    total = time.monotonic() - t0
+    balances = {i: bal for i, (bal, _) in zip(order, probes) if isinstance(bal, int)}
+    idx = _select_session(order, balances, max(0, need))
+    stats = ", ".join(f"{TG_MANAGER.session_names[i]}={balances.get(i, '—')}⭐/{dt * 1000:.0f}ms" for i, (_, dt) in zip(order, probes))
+    chosen = TG_MANAGER.session_names[idx] if idx is not None else "—"
+    log_info("tg", f"Выбор сессии ({TG_PICK_POLICY}) need={need}: {chosen} | {stats} | {total * 1000:.0f}ms")
+    return idx, balances.get(idx) if idx is not None else None
 
 def pick_account_for_need_sync(need: int, timeout: float = 12.0) -> Tuple[Optional[int], Optional[int]]:
     if TG_MANAGER is None:
@@ -1203,35 +2147,78 @@ def pick_account_for_need_sync(need: int, timeout: float = 12.0) -> Tuple[Option
         return None, None
     if not TG_AUTO_SELECT_FOR_PRECHECK or not TG_AUTO_SWITCH:
         idx = TG_MANAGER.get_active()
-        with _pyro_gate:
-            fut = asyncio.run_coroutine_threadsafe(_get_stars_balance_once(idx), loop)
-            try:
-                bal = fut.result(timeout=timeout)
-            except Exception:
-                bal = None
+        bal = _run_on_loop(_get_stars_balance_once(idx), timeout)
         return idx, bal if isinstance(bal, int) else None
-    best_idx = None
-    best_bal = None
-    order = TG_MANAGER.order_try_list()
-    for idx in order:
-        if not TG_MANAGER.is_usable(idx):
-            continue
-        with _pyro_gate:
-            fut = asyncio.run_coroutine_threadsafe(_get_stars_balance_once(idx), loop)
-            try:
-                bal = fut.result(timeout=timeout)
-            except Exception:
-                bal = None
-        if not isinstance(bal, int):
+    return _run_on_loop(_pick_account_for_need(need), timeout, (None, None))
+
+def _precheck_candidates() -> List[int]:
+    if TG_MANAGER is None:
+        return []
+    if not TG_AUTO_SELECT_FOR_PRECHECK or not TG_AUTO_SWITCH:
+        return [TG_MANAGER.get_active()]
+    return [i for i in TG_MANAGER.order_try_list() if TG_MANAGER.is_usable(i)]
+
+def reserve_stars_sync(order_id: Any, need: int, timeout: float = 12.0) -> Tuple[Optional[int], Optional[int]]:
+    if TG_MANAGER is None:
+        return None, None
+    cands = _precheck_candidates()
+    if not TG_MANAGER.ledger.known(cands):
+        pick_account_for_need_sync(need, timeout)
+        cands = _precheck_candidates()
+    idx, avail = TG_MANAGER.ledger.reserve(_oid(order_id), cands, need)
+    if idx is not None:
+        verdict = "reserved" if isinstance(avail, int) and avail >= need else "insufficient"
+        log_info("tg", f"Ledger {verdict}: order={_oid(order_id)} need={need} session={TG_MANAGER.session_names[idx]} available={avail}")
+    return idx, avail
+
+def release_stars(order_id: Any) -> None:
+    if TG_MANAGER is None or order_id is None:
+        return
+    left = TG_MANAGER.ledger.release(_oid(order_id))
+    if left:
+        log_info("tg", f"Ledger release: order={_oid(order_id)} {left}⭐")
+
+def _drop_waiting(buyer_id: Any) -> Optional[dict]:
+    st = waiting.pop(buyer_id, None)
+    if st:
+        release_stars(st.get("order_id"))
+    return st
+
+def _restore_conversations(account: Account) -> List[int]:
+    done = _completed_buyers.load()
+    n = waiting.load()
+    log_info("state", f"Восстановлено диалогов: {n}, завершённых покупателей: {done} (backend={STATE_BACKEND})")
+    try:
+        pruned = DELIVERY_JOURNAL.prune()
+        if pruned:
+            log_info("state", f"Журнал выдачи: удалено старых записей {pruned}")
+    except sqlite3.Error as e:
+        log_error("state", f"Журнал выдачи недоступен: {short_text(e)}")
+    return [bid for bid, st in waiting.items() if st.get("state") == "delivering"]
+
+def _resume_delivery(account: Account, buyer_id: int) -> Optional[Future]:
+    st = waiting.get(buyer_id)
+    if not st or st.get("state") != "delivering":
+        return
+    chat_id = st.get("chat_id")
+    ctx_user = pretty_order_context(None, buyer_id=buyer_id, gift={"title": st.get("gift_title", "?"), "price": "?", "id": "?"})
+    log_warn(ctx_user, f"Выдача order={st.get('order_id')} прервана перезапуском — продолжаю по журналу")
+    need = DELIVERY_JOURNAL.remaining(_oid(st.get("order_id")))
+    if need is None:
+        need = int(st.get("choice_selected_price" if st.get("is_choice") else "price") or 0) * int(st.get("qty", 1))
+    if need > 0:
+        reserve_stars_sync(st.get("order_id"), need)
+    sm(account, chat_id, "delivery_resumed")
+    return _start_delivery(_deliver_choice if st.get("is_choice") else _deliver_normal, account, chat_id, buyer_id, st, ctx_user)
+
+async def _ledger_reconcile_loop() -> None:
+    while True:
+        await asyncio.sleep(TG_LEDGER_RECONCILE_SECONDS)
+        if TG_MANAGER is None:
             continue
-        if best_bal is None or bal > best_bal:
-            best_bal = bal
-            best_idx = idx
-        if need > 0 and bal >= need:
-            best_bal = bal
-            best_idx = idx
-            break
-    return best_idx, best_bal
+        idle = [i for i in range(len(TG_MANAGER.clients)) if TG_MANAGER.is_usable(i) and not (TG_DELIVERY and TG_DELIVERY.inflight.get(i))]
+        with suppress(Exception):
+            await asyncio.gather(*(asyncio.wait_for(TG_MANAGER.refresh_balance(i), TG_BALANCE_PROBE_TIMEOUT) for i in idle), return_exceptions=True)
 
 def try_partial_refund(account: Account, order_id: int, units: int, gift: dict, chat_id: int, ctx: str = "") -> bool:
     total_stars = int(units) * int(gift.get("price", 0))
@@ -1273,6 +2260,8 @@ async def _send_gift_once(idx: int, username: str, gift_id: int, hide_my_name: b
     peer: Any = uname
     try:
         peer = await _resolve_user_id_cached(idx, uname)
+    except UsernameNotOccupied:
+        raise
     except Exception as e:
         log_warn("resolve", f"resolve @{uname} failed, fallback to username: {short_text(e)}")
         peer = uname
@@ -1301,6 +2290,7 @@ async def _send_gift_once(idx: int, username: str, gift_id: int, hide_my_name: b
             se = str(e).lower()
             if isinstance(peer, int) and "peer_id_invalid" in se:
                 log_warn("send_gift", f"peer_id_invalid on id, fallback to username @{uname}")
+                USERNAME_CACHE.drop_peer(TG_MANAGER.session_names[idx], peer)
                 peer = uname
                 last_err = e
                 continue
@@ -1314,6 +2304,8 @@ def classify_send_error(info: str) -> str:
     if not info:
         return "other"
     lower = info.lower()
+    if lower.startswith("uncertain"):
+        return "uncertain"
     if "flood_wait:" in lower or "flood_wait_" in lower:
         return "flood"
     if "peer_flood" in lower:
@@ -1322,7 +2314,7 @@ def classify_send_error(info: str) -> str:
         return "balance_low"
     if "400 balance_too_low" in lower or "payments.sendstarsform" in lower:
         return "balance_low"
-    if "username_not_occupied" in lower or "contacts.resolveusername" in lower or "provided username is not occupied" in lower:
+    if "username_not_occupied" in lower or "username_invalid" in lower or "provided username is not occupied" in lower:
         return "username_not_found"
     if "peer_id_invalid" in lower:
         return "username_not_found"
@@ -1332,61 +2324,228 @@ def classify_send_error(info: str) -> str:
         return "network"
     return "other"
 
-def _send_gift_with_idx_sync(idx: int, username: str, gift_id: int, hide_my_name: bool, timeout: float) -> Tuple[bool, str]:
-    if TG_MANAGER is None:
-        return False, "TG manager not started"
-    if not _ensure_pyro_alive_sync():
-        return False, "Pyrogram not connected"
-    with _pyro_gate:
-        fut = asyncio.run_coroutine_threadsafe(_send_gift_once(idx, username, gift_id, hide_my_name), loop)
-        try:
-            res = fut.result(timeout=timeout)
-            return True, str(res)
-        except FloodWait as e:
-            sec = _exc_wait_seconds(e)
+async def _send_gift_attempt(idx: int, username: str, gift_id: int, hide_my_name: bool, timeout: float) -> Tuple[bool, str]:
+    try:
+        res = await asyncio.wait_for(_send_gift_once(idx, username, gift_id, hide_my_name), timeout)
+        return True, str(res)
+    except FloodWait as e:
+        sec = _exc_wait_seconds(e)
+        _handle_floodwait(idx, sec, username, gift_id, exc=e)
+        return False, f"FLOOD_WAIT:{sec}"
+    except PeerFlood as e:
+        _handle_spamblock(idx, username, gift_id, exc=e)
+        return False, "PEER_FLOOD"
+    except asyncio.TimeoutError:
+        return False, f"timeout after {timeout:.0f}s"
+    except Exception as e:
+        sec = _exc_wait_seconds(e)
+        low = str(e).lower()
+        if sec > 0 and ("flood" in low or "wait" in low):
             _handle_floodwait(idx, sec, username, gift_id, exc=e)
             return False, f"FLOOD_WAIT:{sec}"
-        except PeerFlood as e:
-            _handle_spamblock(idx, username, gift_id, exc=e)
-            return False, "PEER_FLOOD"
-        except Exception as e:
-            sec = _exc_wait_seconds(e)
-            low = str(e).lower()
-            if sec > 0 and ("flood" in low or "wait" in low):
-                _handle_floodwait(idx, sec, username, gift_id, exc=e)
-                return False, f"FLOOD_WAIT:{sec}"
-            if classify_send_error(str(e)) == "network":
-                _handle_network(idx, username, gift_id, exc=e)
-            return False, str(e)
+        if classify_send_error(str(e)) == "network":
+            _handle_network(idx, username, gift_id, exc=e)
+        return False, str(e)
+
+class _DeliveryJob:
+    __slots__ = ("username", "gift_id", "hide_my_name", "price", "timeout", "key", "part", "tried", "last_info", "dead", "future", "started")
+
+    def __init__(self, username: str, gift_id: int, hide_my_name: bool, price: int, timeout: float, key: Optional[str], part: Optional[int], dead: Dict[str, str], future: "asyncio.Future"):
+        self.username = username
+        self.gift_id = int(gift_id)
+        self.hide_my_name = bool(hide_my_name)
+        self.price = max(0, int(price or 0))
+        self.timeout = timeout
+        self.key = key
+        self.part = part
+        self.tried: set[int] = set()
+        self.last_info = "no_attempt"
+        self.dead = dead
+        self.future = future
+        self.started = False
+
+    def finish(self, ok: bool, info: str) -> None:
+        if not self.future.done():
+            self.future.set_result((ok, info))
+
+class TgDeliveryScheduler:
+    def __init__(self, manager: TgAccountManager):
+        self.manager = manager
+        self.queues: Dict[int, asyncio.Queue] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+        self.inflight: Dict[int, int] = {}
+        self.reserved: Dict[int, int] = {}
+
+    def _candidates(self, job: _DeliveryJob) -> List[int]:
+        m = self.manager
+        if not TG_AUTO_SWITCH:
+            a = m.get_active()
+            return [a] if a not in job.tried and m.is_usable(a) else []
+        out = [i for i in m.order_try_list() if i not in job.tried and m.is_usable(i)]
+        if TG_PARALLEL_SEND:
+            out.sort(key=lambda i: self.inflight.get(i, 0))
+        return out
+
+    async def _fits_balance(self, idx: int, price: int, key: Optional[str]) -> bool:
+        if price <= 0:
+            return True
+        avail = self.manager.ledger.available(idx, key)
+        if avail is None:
+            await _get_stars_balance_once(idx)
+            avail = self.manager.ledger.available(idx, key)
+        if avail is None:
+            return True
+        return avail - self.reserved.get(idx, 0) >= price
+
+    def _ensure_worker(self, idx: int) -> asyncio.Queue:
+        q = self.queues.get(idx)
+        if q is None:
+            q = self.queues[idx] = asyncio.Queue()
+        w = self.workers.get(idx)
+        if w is None or w.done():
+            self.workers[idx] = asyncio.ensure_future(self._worker(idx))
+        return q
+
+    async def _dispatch(self, job: _DeliveryJob) -> None:
+        if job.future.done():
+            return
+        for idx in self._candidates(job):
+            if not await self._fits_balance(idx, job.price, job.key):
+                job.tried.add(idx)
+                job.last_info = "BALANCE_TOO_LOW"
+                continue
+            self.inflight[idx] = self.inflight.get(idx, 0) + 1
+            self.reserved[idx] = self.reserved.get(idx, 0) + job.price
+            self._ensure_worker(idx).put_nowait(job)
+            return
+        job.finish(False, job.last_info)
 
-def send_gift_sync(username: str, gift_id: int, hide_my_name: bool, timeout: float = 30.0) -> Tuple[bool, str]:
-    if TG_MANAGER is None:
-        return False, "TG manager not started"
-    if not _ensure_pyro_alive_sync():
-        return False, "Pyrogram not connected"
-    order = TG_MANAGER.order_try_list()
-    last_info = "no_attempt"
-    for idx in order:
-        if not TG_MANAGER.is_usable(idx):
-            continue
-        if not TG_AUTO_SWITCH and idx != TG_MANAGER.get_active():
-            continue
-        ok, info = _send_gift_with_idx_sync(idx, username, gift_id, hide_my_name, timeout)
+    async def _worker(self, idx: int) -> None:
+        q = self.queues[idx]
+        while True:
+            job = await q.get()
+            try:
+                await self._run(idx, job)
+            except Exception as e:
+                log_error("tg", f"Ошибка воркера доставки session={self.manager.session_names[idx]}: {short_text(e)}")
+                job.finish(False, str(e))
+            finally:
+                self.inflight[idx] -= 1
+                self.reserved[idx] -= job.price
+                q.task_done()
+
+    async def _run(self, idx: int, job: _DeliveryJob) -> None:
+        m = self.manager
+        if job.future.done():
+            return
+        key = job.username.lstrip("@").lower()
+        if key in job.dead:
+            job.finish(False, job.dead[key])
+            return
+        if not m.is_usable(idx):
+            job.tried.add(idx)
+            await self._dispatch(job)
+            return
+        journaled = job.key is not None and job.part is not None
+        job.started = True
+        try:
+            if journaled:
+                DELIVERY_JOURNAL.begin(job.key, job.part, m.session_names[idx])
+                await asyncio.to_thread(DELIVERY_JOURNAL.flush)
+            ok, info = await _send_gift_attempt(idx, job.username, job.gift_id, job.hide_my_name, job.timeout)
+        finally:
+            job.started = False
+        if journaled and DELIVERY_JOURNAL.record(job.key, job.part, ok, info):
+            await asyncio.to_thread(DELIVERY_JOURNAL.flush)
         if ok:
-            TG_MANAGER.set_active(idx)
-            return True, info
-        last_info = info
-        kind = classify_send_error(str(info))
-        if not TG_AUTO_SWITCH:
-            return False, info
+            cached, exp = m.balance_cache[idx]
+            if cached is not None and job.price > 0:
+                m.balance_cache[idx] = (max(0, cached - job.price), exp)
+            m.ledger.debit(idx, job.price, job.key)
+            if not m.is_usable(m.get_active()):
+                m.set_active(idx)
+            job.finish(True, info)
+            return
+        job.last_info = info
+        kind = classify_send_error(info)
         if kind == "balance_low":
-            continue
-        if kind in ("flood", "spam_block", "network"):
-            continue
-        return False, info
-    return False, last_info
+            m.balance_cache[idx] = (0, time.time() + TG_BALANCE_CACHE_SECONDS)
+            m.ledger.exhaust(idx)
+        if TG_AUTO_SWITCH and kind in ("balance_low", "flood", "spam_block", "network"):
+            job.tried.add(idx)
+            log_warn("tg", f"{kind}: session={m.session_names[idx]} -> переназначаю @{key} gift_id={job.gift_id}")
+            await self._dispatch(job)
+            return
+        if kind == "username_not_found":
+            job.dead[key] = info
+        job.finish(False, info)
+
+    async def deliver(self, units: List[Tuple[str, int, int]], hide_my_name: bool, timeout: float, budget: float, key: Optional[str] = None, parts: Optional[List[int]] = None) -> List[Tuple[bool, str]]:
+        dead: Dict[str, str] = {}
+        parts = parts if parts is not None else [None] * len(units)
+        jobs = [_DeliveryJob(u, gid, hide_my_name, price, timeout, key, part, dead, loop.create_future()) for (u, gid, price), part in zip(units, parts)]
+        for job in jobs:
+            await self._dispatch(job)
+        if jobs:
+            await asyncio.wait([j.future for j in jobs], timeout=budget)
+        for job in jobs:
+            # отправка могла уже уйти в Telegram: не считаем её неудачной, чтобы не вернуть деньги за выданный подарок
+            job.finish(False, "UNCERTAIN: время выдачи истекло во время отправки, статус в Telegram неизвестен" if job.started else "timeout")
+        return [j.future.result() for j in jobs]
+
+def send_gifts_batch_sync(units: List[Tuple[str, int, int]], hide_my_name: bool, timeout: float = 30.0, ledger_key: Any = None, parts: Optional[List[int]] = None) -> List[Tuple[bool, str]]:
+    if TG_MANAGER is None or TG_DELIVERY is None:
+        return [(False, "TG manager not started")] * len(units)
+    if not _ensure_pyro_alive_sync():
+        return [(False, "Pyrogram not connected")] * len(units)
+    budget = timeout * (len(units) + 1)
+    fut = asyncio.run_coroutine_threadsafe(TG_DELIVERY.deliver(units, hide_my_name, timeout, budget, _oid(ledger_key) if ledger_key is not None else None, parts), loop)
+    try:
+        return fut.result(timeout=budget + 10.0)
+    except Exception as e:
+        fut.cancel()
+        return [(False, str(e) or "timeout")] * len(units)
+
+def send_gift_sync(username: str, gift_id: int, hide_my_name: bool, timeout: float = 30.0) -> Tuple[bool, str]:
+    return send_gifts_batch_sync([(username, gift_id, 0)], hide_my_name, timeout=timeout)[0]
+
+def send_journaled_sync(order_id: Any, units: List[Tuple[int, str, int, int]], hide_my_name: bool) -> List[Tuple[int, str, int, int, bool, str]]:
+    key = _oid(order_id)
+    rows = DELIVERY_JOURNAL.plan(key, units)
+    out: List[Any] = [None] * len(rows)
+    todo: List[int] = []
+    for part, (unit, username, gid, price, status, info) in enumerate(rows):
+        if status == "ok":
+            out[part] = (unit, username, gid, price, True, info or "journal")
+        elif status == "fail":
+            out[part] = (unit, username, gid, price, False, info or "failed")
+        elif status == "sending":
+            out[part] = (unit, username, gid, price, False, "UNCERTAIN: отправка прервана, статус в Telegram неизвестен")
+        else:
+            todo.append(part)
+    if len(todo) < len(rows):
+        log_info("tg", f"Журнал order={key}: уже обработано {len(rows) - len(todo)}/{len(rows)} частей, досылаю {len(todo)}")
+    if todo:
+        sent = send_gifts_batch_sync([(rows[p][1], rows[p][2], rows[p][3]) for p in todo], hide_my_name, ledger_key=key, parts=todo)
+        DELIVERY_JOURNAL.settle(key, [(p, ok, info) for p, (ok, info) in zip(todo, sent)])
+        for p, (ok, info) in zip(todo, sent):
+            unit, username, gid, price = rows[p][:4]
+            out[p] = (unit, username, gid, price, ok, info)
+    return out
+
+def _refund_units_once(account: Account, buyer_id: int, st: dict, units: int, price: int, title: str, chat_id: int, ctx: str) -> None:
+    if st.get("refund_units") is not None:
+        log_warn(ctx, f"Возврат по order={st.get('order_id')} уже запускался ({st['refund_units']} шт.) — не повторяю")
+        return
+    st["refund_units"] = int(units)
+    waiting.commit(buyer_id)
+    if units >= int(st.get("qty", 1)):
+        refund_order(account, st["order_id"], chat_id, ctx=ctx)
+    else:
+        try_partial_refund(account, st["order_id"], units, {"price": price, "title": title}, chat_id, ctx=ctx)
 
 def refund_order(account: Account, order_id: int, chat_id: int, ctx: str = "") -> bool:
+    release_stars(order_id)
     try:
         account.refund(order_id)
         log_info(ctx, f"Refund done for order {order_id}")
@@ -1425,25 +2584,92 @@ def _list_my_subcat_lots(account: Account, subcat_id: int):
         logger.debug("Подробности получения лотов:", exc_info=True)
         return []
 
-def update_lot_state(account: Account, lot, active: bool) -> bool:
+class FunPayThrottle:
+    def __init__(self, base: float, cap: float):
+        self._lock = threading.Lock()
+        self.base = float(base)
+        self.cap = float(cap)
+        self._resume_at = 0.0
+        self._strikes = 0
+
+    def wait(self) -> None:
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.time()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def hit(self, retry_after: Optional[float]) -> float:
+        with self._lock:
+            self._strikes += 1
+            delay = retry_after if retry_after and retry_after > 0 else self.base * 2 ** min(self._strikes - 1, 8)
+            delay = min(self.cap, delay) * random.uniform(1.0, 1.2)
+            self._resume_at = max(self._resume_at, time.time() + delay)
+            return delay
+
+    def ok(self) -> None:
+        with self._lock:
+            self._strikes = 0
+
+FUNPAY_THROTTLE = FunPayThrottle(FUNPAY_429_BACKOFF, FUNPAY_429_MAX_BACKOFF)
+
+def _is_http_429(e: Exception) -> bool:
+    return getattr(e, "status_code", None) == 429
+
+def _retry_after(e: Exception) -> Optional[float]:
+    resp = getattr(e, "response", None)
+    try:
+        return float(resp.headers.get("Retry-After"))
+    except Exception:
+        return None
+
+def _apply_lot_state(account: Account, lot, active: bool, check=None) -> Tuple[str, Any]:
+    lot_id = getattr(lot, "id", "?")
+    fields = None
     attempts = 3
+    limited = 0
     while attempts:
+        FUNPAY_THROTTLE.wait()
         try:
-            lot_fields = account.get_lot_fields(lot.id)
-            if getattr(lot_fields, "active", None) == active:
-                log_info("", f"Лот {getattr(lot, 'id', '?')} уже active={active}")
-                return True
-            lot_fields.active = active
-            account.save_lot(lot_fields)
-            log_warn("", f"Лот {getattr(lot, 'id', '?')} изменён: active={active}")
-            return True
+            if fields is None:
+                fields = account.get_lot_fields(lot.id)
+                if getattr(fields, "active", None) == active:
+                    return "same", fields
+                if check is not None and not check(lot, fields):
+                    return "skip", fields
+            fields.active = active
+            account.save_lot(fields)
+            FUNPAY_THROTTLE.ok()
+            return "changed", fields
         except Exception as e:
-            log_error("", f"Ошибка при изменении лота {getattr(lot, 'id', '?')}: {short_text(e)}")
+            if _is_http_429(e) and limited < LOT_UPDATE_MAX_429:
+                limited += 1
+                delay = FUNPAY_THROTTLE.hit(_retry_after(e))
+                log_warn("", f"FunPay 429 на лоте {lot_id} — пауза {delay:.1f}с для всех запросов")
+                continue
+            log_error("", f"Ошибка при изменении лота {lot_id}: {short_text(e)}")
             logger.debug("Подробности update_lot_state:", exc_info=True)
             attempts -= 1
             time.sleep(min(0.5 * (3 - attempts), 1.5))
-    log_error("", f"Не удалось изменить лот {getattr(lot, 'id', '?')} (исчерпаны попытки)")
-    return False
+    log_error("", f"Не удалось изменить лот {lot_id} (исчерпаны попытки)")
+    return "error", fields
+
+def set_lots_state(account: Account, lots: list, active: bool, check=None) -> List[Tuple[Any, str, Any]]:
+    if not lots:
+        return []
+    workers = max(1, min(LOT_UPDATE_CONCURRENCY, FUNPAY_POOL_MAXSIZE, len(lots)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lots") as pool:
+        states = list(pool.map(lambda lot: _apply_lot_state(account, lot, active, check), lots))
+    return [(lot, status, fields) for lot, (status, fields) in zip(lots, states)]
+
+def update_lot_state(account: Account, lot, active: bool) -> bool:
+    status, _fields = _apply_lot_state(account, lot, active)
+    if status == "same":
+        log_info("", f"Лот {getattr(lot, 'id', '?')} уже active={active}")
+    elif status == "changed":
+        log_warn("", f"Лот {getattr(lot, 'id', '?')} изменён: active={active}")
+    return status in ("same", "changed")
 
 def deactivate_lots(account: Account, subcat_id: int):
     log_warn("", f"Запускаю деактивацию ВСЕХ лотов в подкатегории {subcat_id}...")
@@ -1451,33 +2677,29 @@ def deactivate_lots(account: Account, subcat_id: int):
     if not lots:
         log_info("", "Лоты не найдены — пропускаю деактивацию.")
         return
+    started = time.monotonic()
     affected: List[str] = []
-    consecutive_errors = 0
-    for lot in lots:
-        try:
-            fields = account.get_lot_fields(lot.id)
-            is_active = bool(getattr(fields, "active", False))
-            title = short_text(_safe_attr(lot, "title", "description", default=str(getattr(lot, "id", "?"))), 80)
-            if not is_active:
-                log_info("", f"Лот уже выключен: {title} (id={lot.id})")
-                continue
-            ok = update_lot_state(account, lot, active=False)
-            if ok:
-                affected.append(f"{title} (id={lot.id})")
-                consecutive_errors = 0
-        except Exception as e:
-            log_error("", f"Ошибка при деактивации лота {getattr(lot, 'id', '?')}: {short_text(e)}")
-            logger.debug("Подробности деактивации лота:", exc_info=True)
-            consecutive_errors += 1
-        if consecutive_errors:
-            pause = min(0.2 * consecutive_errors, 1.5)
-            time.sleep(pause)
+    done: List[int] = []
+    errors = 0
+    for lot, status, _fields in set_lots_state(account, lots, active=False):
+        title = short_text(_safe_attr(lot, "title", "description", default=str(getattr(lot, "id", "?"))), 80)
+        if status in ("same", "changed"):
+            done.append(lot.id)
+        if status == "changed":
+            affected.append(f"{title} (id={lot.id})")
+        elif status == "error":
+            errors += 1
+    LOT_INDEX.set_active(done, False)
     if affected:
-        log_warn("", "Деактивированы лоты:\n- " + "\n- ".join(affected))
+        log_warn("", f"Деактивированы лоты ({len(affected)} за {time.monotonic() - started:.1f}с):\n- " + "\n- ".join(affected))
     else:
         log_info("", "Не было активных лотов для деактивации.")
+    if errors:
+        log_error("", f"Не удалось деактивировать лотов: {errors}")
 
 def _choice_max_price(options: List[str]) -> int:
+    if GIFT_CATALOG is not None:
+        return GIFT_CATALOG.choice_max_price(options)
     prices = []
     for k in options:
         g = GIFTS.get(str(k))
@@ -1504,6 +2726,17 @@ def _parse_stars_from_text_hint(text: str) -> Optional[int]:
     except Exception:
         return None
 
+def _obj_attrs(obj) -> Dict[str, Any]:
+    d = getattr(obj, "__dict__", None)
+    if isinstance(d, dict):
+        return d
+    out: Dict[str, Any] = {}
+    for cls in type(obj).__mro__:
+        for k in getattr(cls, "__slots__", ()):
+            if k not in out and hasattr(obj, k):
+                out[k] = getattr(obj, k)
+    return out
+
 def _collect_lot_text(lot, lot_fields) -> str:
     chunks: List[str] = []
 
@@ -1519,23 +2752,23 @@ def _collect_lot_text(lot, lot_fields) -> str:
         for attr in ("full_description", "description", "desc", "text", "public_description", "offer_description", "short_description", "title", "name"):
             add(getattr(obj, attr, None))
     for obj in (lot_fields, lot):
-        if not obj or not hasattr(obj, "__dict__") or not isinstance(obj.__dict__, dict):
+        if not obj:
             continue
-        for _k, _v in obj.__dict__.items():
+        attrs = _obj_attrs(obj)
+        for _k, _v in attrs.items():
             if isinstance(_v, str):
                 nv = _norm_param_key(_v)
                 if (GIFT_PARAM_KEY_NORM and GIFT_PARAM_KEY_NORM in nv) or ("gift" in _v.lower() and "tg" in _v.lower()):
                     add(_v)
-        for _k, _v in obj.__dict__.items():
+        for _k, _v in attrs.items():
             if isinstance(_v, str) and 0 < len(_v.strip()) <= 5000:
                 add(_v)
     fs = getattr(lot_fields, "fields", None)
     if isinstance(fs, list):
         for f in fs:
-            if hasattr(f, "__dict__") and isinstance(f.__dict__, dict):
-                for _k, _v in f.__dict__.items():
-                    if isinstance(_v, str):
-                        add(_v)
+            for _k, _v in _obj_attrs(f).items():
+                if isinstance(_v, str):
+                    add(_v)
             for attr in ("value", "text", "name", "label"):
                 add(getattr(f, attr, None))
     elif isinstance(fs, dict):
@@ -1545,8 +2778,8 @@ def _collect_lot_text(lot, lot_fields) -> str:
 
 def _obj_keys_preview(obj, limit: int = 40) -> str:
     try:
-        d = getattr(obj, "__dict__", None)
-        if isinstance(d, dict):
+        d = _obj_attrs(obj)
+        if d:
             keys = list(d.keys())
             if len(keys) > limit:
                 keys = keys[:limit] + ["…"]
@@ -1561,68 +2794,242 @@ def lot_required_stars_from_description(desc: str) -> Optional[int]:
     if not gift_num:
         return _parse_stars_from_text_hint(text)
     try:
-        _ids_per_unit, price_per_unit, _title, _is_set_any, is_choice, choice_options = resolve_item(gift_num)
-        if is_choice:
-            mx = _choice_max_price(choice_options)
-            return int(mx) if mx > 0 else None
-        v = int(price_per_unit)
-        return v if v > 0 else None
+        return _stars_for_gift_num(gift_num)
     except Exception:
         return _parse_stars_from_text_hint(text)
 
-def deactivate_lots_over_balance(account: Account, subcat_id: int, balance: int):
-    log_warn("", f"Выборочная деактивация: subcat={subcat_id}, balance={balance}⭐ ...")
-    lots = _list_my_subcat_lots(account, subcat_id)
-    if not lots:
-        log_info("", "Лоты не найдены — пропускаю.")
-        return
-    affected: List[str] = []
-    skipped_unknown = 0
-    for lot in lots:
+def _stars_for_gift_num(gift_num: str) -> Optional[int]:
+    _ids_per_unit, price_per_unit, _title, _is_set_any, is_choice, choice_options = resolve_item(gift_num)
+    if is_choice:
+        mx = _choice_max_price(choice_options)
+        return int(mx) if mx > 0 else None
+    v = int(price_per_unit)
+    return v if v > 0 else None
+
+def _catalog_token() -> int:
+    return id(GIFT_CATALOG.index()) if GIFT_CATALOG is not None else id(GIFTS)
+
+def _fetch_lot_fields(account: Account, lot):
+    limited = 0
+    while True:
+        FUNPAY_THROTTLE.wait()
         try:
             fields = account.get_lot_fields(lot.id)
-            is_active = bool(getattr(fields, "active", False))
-            if not is_active:
-                continue
-            title = short_text(_safe_attr(lot, "title", "name", default=str(getattr(lot, "id", "?"))), 80)
-            lot_text = _collect_lot_text(lot, fields)
-            need = lot_required_stars_from_description(lot_text)
+            FUNPAY_THROTTLE.ok()
+            return fields
+        except Exception as e:
+            if not _is_http_429(e) or limited >= LOT_UPDATE_MAX_429:
+                raise
+            limited += 1
+            delay = FUNPAY_THROTTLE.hit(_retry_after(e))
+            log_warn("", f"FunPay 429 на лоте {getattr(lot, 'id', '?')} — пауза {delay:.1f}с для всех запросов")
+
+class LotIndex:
+    def __init__(self, max_age: float):
+        self._lock = threading.RLock()
+        self.max_age = float(max_age)
+        self._lots: Dict[int, Any] = {}
+        self._refreshed: Dict[int, float] = {}
+        self._catalog: Optional[int] = None
+        self._ready = False
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = _db()
+        if not self._ready:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS lot_index ("
+                "lot_id INTEGER PRIMARY KEY, subcat_id INTEGER NOT NULL, title TEXT, gift_num TEXT, need INTEGER, "
+                "active INTEGER NOT NULL, listing_hash TEXT, fields_hash TEXT, seen REAL NOT NULL, parsed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS lot_index_need ON lot_index(subcat_id, active, need)")
+            self._ready = True
+        return conn
+
+    @staticmethod
+    def _listing_hash(lot) -> str:
+        raw = "|".join(str(getattr(lot, a, "") or "") for a in ("description", "server", "side", "price"))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _subcat_of(lot, fields, default: Optional[int] = None) -> Optional[int]:
+        for obj in (lot, fields):
+            sid = _safe_int(getattr(getattr(obj, "subcategory", None), "id", None))
+            if sid is not None:
+                return sid
+        return default
+
+    def observe(self, lot, fields, active: Optional[bool] = None, subcat_id: Optional[int] = None) -> Optional[int]:
+        lot_id = _safe_int(getattr(lot, "id", None))
+        sid = self._subcat_of(lot, fields, subcat_id)
+        if lot_id is None or sid is None:
+            return None
+        text = _collect_lot_text(lot, fields)
+        fields_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        is_active = bool(getattr(fields, "active", False)) if active is None else bool(active)
+        now = time.time()
+        title = short_text(_safe_attr(lot, "title", "description", default=str(lot_id)), 80)
+        listing_hash = self._listing_hash(lot)
+        with _DB_LOCK:
+            row = self._conn().execute("SELECT fields_hash, gift_num, need FROM lot_index WHERE lot_id = ?", (lot_id,)).fetchone()
+        if row and row[0] == fields_hash:
+            gift_num, need = row[1], row[2]
+        else:
+            gift_num = parse_gift_num(text)
+            need = lot_required_stars_from_description(text)
             if need is None:
-                skipped_unknown += 1
-                snippet = short_text(lot_text.replace("\n", " "), 160)
-                log_warn("", f"Не смог определить ⭐ по описанию лота: {title} (id={lot.id}) — оставляю активным | text≈'{snippet}' | lot_fields_keys={_obj_keys_preview(fields)}")
+                snippet = short_text(text.replace("\n", " "), 160)
+                log_warn("", f"Не смог определить ⭐ по описанию лота: {title} (id={lot_id}) — оставляю активным | text≈'{snippet}' | lot_fields_keys={_obj_keys_preview(fields)}")
+        with _DB_LOCK:
+            self._conn().execute(
+                "INSERT OR REPLACE INTO lot_index (lot_id, subcat_id, title, gift_num, need, active, listing_hash, fields_hash, seen, parsed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (lot_id, sid, title, gift_num, need, 1 if is_active else 0, listing_hash, fields_hash, now, now),
+            )
+        with self._lock:
+            self._lots[lot_id] = lot
+        return need
+
+    def set_active(self, lot_ids: List[int], active: bool) -> None:
+        if not lot_ids:
+            return
+        with _DB_LOCK:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany("UPDATE lot_index SET active = ? WHERE lot_id = ?", [(1 if active else 0, int(i)) for i in lot_ids])
+
+    def refresh(self, account: Account, subcat_id: int) -> Tuple[int, int]:
+        lots = account.get_my_subcategory_lots(subcat_id)
+        now = time.time()
+        with _DB_LOCK:
+            known = {r[0]: (r[1], r[2]) for r in self._conn().execute("SELECT lot_id, listing_hash, parsed FROM lot_index WHERE subcat_id = ?", (subcat_id,))}
+        fresh: List[Tuple[int, float, int]] = []
+        stale: List[Any] = []
+        for lot in lots:
+            lot_id = _safe_int(getattr(lot, "id", None))
+            if lot_id is None:
                 continue
-            if need > balance:
-                ok = update_lot_state(account, lot, active=False)
-                if ok:
-                    affected.append(f"{title} (id={lot.id}, need={need}⭐)")
+            row = known.pop(lot_id, None)
+            if row and row[0] == self._listing_hash(lot) and now - row[1] < self.max_age:
+                fresh.append((1 if getattr(lot, "active", False) else 0, now, lot_id))
+            else:
+                stale.append(lot)
+        if stale:
+            workers = max(1, min(LOT_UPDATE_CONCURRENCY, FUNPAY_POOL_MAXSIZE, len(stale)))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="lotidx") as pool:
+                fetched = list(pool.map(lambda lot: self._fetch_quiet(account, lot), stale))
+            for lot, fields in zip(stale, fetched):
+                if fields is not None:
+                    self.observe(lot, fields, active=getattr(lot, "active", None), subcat_id=subcat_id)
+        with _DB_LOCK:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                conn.executemany("UPDATE lot_index SET active = ?, seen = ? WHERE lot_id = ?", fresh)
+                conn.executemany("DELETE FROM lot_index WHERE lot_id = ?", [(i,) for i in known])
+        with self._lock:
+            for lot in lots:
+                lot_id = _safe_int(getattr(lot, "id", None))
+                if lot_id is not None:
+                    self._lots[lot_id] = lot
+            for lot_id in known:
+                self._lots.pop(lot_id, None)
+            self._refreshed[subcat_id] = now
+        log_info("", f"Индекс лотов subcat={subcat_id}: {len(lots)} лотов, перечитано {len(stale)}, удалено {len(known)}")
+        return len(lots), len(stale)
+
+    def _fetch_quiet(self, account: Account, lot):
+        try:
+            return _fetch_lot_fields(account, lot)
         except Exception as e:
-            log_error("", f"Ошибка выборочной деактивации лота {getattr(lot, 'id', '?')}: {short_text(e)}")
-            logger.debug("Подробности:", exc_info=True)
+            log_warn("", f"Индекс лотов: не смог прочитать лот {getattr(lot, 'id', '?')}: {short_text(e)}")
+            return None
+
+    def ensure(self, account: Account, subcat_id: int, max_age: float) -> None:
+        with self._lock:
+            ts = self._refreshed.get(subcat_id, 0.0)
+        if time.time() - ts >= max_age:
+            self.refresh(account, subcat_id)
+
+    def _reprice(self) -> None:
+        token = _catalog_token()
+        if token == self._catalog:
+            return
+        with _DB_LOCK:
+            rows = self._conn().execute("SELECT lot_id, gift_num FROM lot_index WHERE gift_num IS NOT NULL").fetchall()
+        upd = []
+        for lot_id, gift_num in rows:
+            try:
+                need = _stars_for_gift_num(gift_num)
+            except Exception:
+                need = None
+            upd.append((need, lot_id, gift_num))
+        with _DB_LOCK:
+            conn = self._conn()
+            with conn:
+                conn.execute("BEGIN")
+                # лот мог быть перечитан между SELECT и UPDATE — его need уже посчитан по новому описанию
+                conn.executemany("UPDATE lot_index SET need = ? WHERE lot_id = ? AND gift_num = ?", upd)
+        self._catalog = token
+
+    def over_balance(self, subcat_id: int, balance: int) -> Tuple[List[Tuple[Any, str, int]], int]:
+        self._reprice()
+        with _DB_LOCK:
+            conn = self._conn()
+            rows = conn.execute("SELECT lot_id, title, need FROM lot_index WHERE subcat_id = ? AND active = 1 AND need > ? ORDER BY need DESC", (subcat_id, int(balance))).fetchall()
+            unknown = conn.execute("SELECT COUNT(*) FROM lot_index WHERE subcat_id = ? AND active = 1 AND need IS NULL", (subcat_id,)).fetchone()[0]
+        with self._lock:
+            return [(self._lots.get(lot_id), title, need) for lot_id, title, need in rows], unknown
+
+LOT_INDEX = LotIndex(LOT_INDEX_MAX_AGE)
+
+def _lot_index_loop(account: Account) -> None:
+    while True:
+        for cid in CATEGORY_IDS_LIST:
+            try:
+                LOT_INDEX.refresh(account, cid)
+            except Exception as e:
+                log_warn("", f"Индекс лотов subcat={cid}: обновление не удалось: {short_text(e)}")
+        time.sleep(LOT_INDEX_REFRESH_SECONDS)
+
+def deactivate_lots_over_balance(account: Account, subcat_id: int, balance: int):
+    log_warn("", f"Выборочная деактивация: subcat={subcat_id}, balance={balance}⭐ ...")
+    try:
+        LOT_INDEX.ensure(account, subcat_id, LOT_INDEX_REFRESH_SECONDS * 2)
+    except Exception as e:
+        log_warn("", f"Индекс лотов subcat={subcat_id} не обновлён, использую сохранённый: {short_text(e)}")
+    rows, unknown = LOT_INDEX.over_balance(subcat_id, balance)
+    lots = [lot for lot, _title, _need in rows if lot is not None]
+    needs: Dict[Any, int] = {}
+
+    def over_balance(lot, fields) -> bool:
+        need = LOT_INDEX.observe(lot, fields, subcat_id=subcat_id)
+        needs[lot.id] = need
+        return need is not None and need > balance
+
+    affected: List[str] = []
+    done: List[int] = []
+    for lot, status, _fields in set_lots_state(account, lots, active=False, check=over_balance):
+        if status in ("same", "changed"):
+            done.append(lot.id)
+        if status == "changed":
+            title = short_text(_safe_attr(lot, "title", "name", default=str(getattr(lot, "id", "?"))), 80)
+            affected.append(f"{title} (id={lot.id}, need={needs.get(lot.id)}⭐)")
+    LOT_INDEX.set_active(done, False)
     if affected:
         log_warn("", "Деактивированы (дороже текущего баланса):\n- " + "\n- ".join(affected))
     else:
         log_info("", "Нет лотов дороже баланса — ничего не выключал.")
-    if skipped_unknown:
-        log_warn("", f"Лотов с неизвестной ценой в ⭐ (не выключал): {skipped_unknown}")
+    if unknown:
+        log_warn("", f"Лотов с неизвестной ценой в ⭐ (не выключал): {unknown}")
 
 def resolve_item(key: str) -> Tuple[List[int], int, str, bool, bool, List[str]]:
     key_s = str(key)
-    if GIFT_SETS_AVAILABLE:
-        try:
-            sets_map = load_sets() or {}
-            if key_s in sets_map:
-                s = sets_map[key_s]
-                title = getattr(s, "title", None) or f"Набор #{key_s}"
-                mode = str(getattr(s, "mode", "fixed")).lower().strip()
-                if mode == "choice":
-                    options = [str(x) for x in (getattr(s, "options", None) or [])]
-                    return [], 0, title, True, True, options
-                ids = [int(x) for x in resolve_to_gift_ids(key_s)]
-                price = int(get_required_stars(key_s))
-                return ids, price, title, True, False, []
-        except Exception:
-            pass
+    if GIFT_CATALOG is not None:
+        e = GIFT_CATALOG.get(key_s)
+        if e is None:
+            raise KeyError("not_found")
+        return list(e.ids), e.price, e.title, e.is_set, e.is_choice, list(e.options)
     g = GIFTS.get(key_s)
     if not g:
         raise KeyError("not_found")
@@ -1636,50 +3043,58 @@ def _deliver_normal(account: Account, chat_id: int, author_id: int, st: dict, ct
     item_title = st.get("gift_title", "товар")
     ids_per_unit = list(st.get("ids_per_unit") or [])
     price = int(st.get("price", 0) or 0)
+    hide_my_name = bool(st.get("hide_my_name", ANONYMOUS_GIFTS))
     sm(account, chat_id, "send_start_normal", item_title=item_title, qty=qty)
     log_info(ctx_user, f"NORMAL: START delivery {item_title} x{qty}")
+    per_unit = len(ids_per_unit)
+    part_price = price // per_unit if per_unit else 0
+    batch = [(i, assign[i], gid, part_price) for i in range(qty) for gid in ids_per_unit]
+    results = send_journaled_sync(order_id, batch, hide_my_name) if batch else []
+    by_unit: Dict[int, List[Tuple[str, int, bool, str]]] = {}
+    for unit, username, gid, _price, ok, info in results:
+        by_unit.setdefault(unit, []).append((username, gid, ok, info))
     sent_units = 0
     failed_units = 0
+    uncertain_units = 0
+    refund_units = 0
     failed_reasons: List[str] = []
+    notified: set[str] = set()
     for i in range(qty):
-        username = assign[i]
         unit_ok = True
-        for gid in ids_per_unit:
-            hide_my_name = bool(st.get("hide_my_name", ANONYMOUS_GIFTS))
-            ok, info = send_gift_sync(username, gift_id=gid, hide_my_name=hide_my_name)
+        unit_failed = False
+        for username, gid, ok, info in by_unit.get(i, []):
             if ok:
-                time.sleep(0.25)
                 log_info(ctx_user, f"NORMAL: OK -> {username} [unit {i + 1}/{qty}] part={gid}")
                 continue
             kind = classify_send_error(str(info))
-            failed_reasons.append(kind)
             unit_ok = False
             log_warn(ctx_user, f"NORMAL: FAIL -> {username}: {kind} :: {short_text(info)}")
-            if kind == "balance_low":
-                sm(account, chat_id, "send_err_balance_low_seller")
-                break
-            elif kind == "spam_block":
-                sm(account, chat_id, "send_err_flood")
-                break
-            elif kind == "flood":
-                sm(account, chat_id, "send_err_flood")
-                break
-            elif kind == "username_not_found":
-                if AUTO_REFUND:
-                    try_partial_refund(account, order_id, 1, {"price": price, "title": item_title}, chat_id, ctx=ctx_user)
-                break
-            elif kind == "network":
-                sm(account, chat_id, "send_err_network")
-                _ensure_pyro_alive_sync()
-                break
-            else:
+            if kind == "uncertain":
+                continue
+            failed_reasons.append(kind)
+            unit_failed = True
+            if kind == "username_not_found":
+                # единица с отправленной или неизвестной частью могла дойти до получателя — её не возвращаем
+                if not any(r[2] or classify_send_error(str(r[3])) == "uncertain" for r in by_unit.get(i, [])):
+                    refund_units += 1
                 break
+            key = {"balance_low": "send_err_balance_low_seller", "spam_block": "send_err_flood", "flood": "send_err_flood", "network": "send_err_network"}.get(kind)
+            if key and key not in notified:
+                notified.add(key)
+                sm(account, chat_id, key)
+                if kind == "network":
+                    _ensure_pyro_alive_sync()
+            break
         if unit_ok:
             sent_units += 1
-        else:
+        elif unit_failed:
             failed_units += 1
-            if failed_reasons and failed_reasons[-1] in ("balance_low", "flood", "spam_block", "network"):
-                break
+        else:
+            uncertain_units += 1
+    if refund_units and AUTO_REFUND:
+        _refund_units_once(account, author_id, st, refund_units, price, item_title, chat_id, ctx_user)
+    if uncertain_units:
+        log_warn(ctx_user, f"NORMAL: order={order_id} есть части с неизвестным статусом ({uncertain_units} шт.) — проверьте вручную, повторно не отправляю")
     if sent_units > 0:
         sm(account, chat_id, "send_done_units", sent_units=sent_units)
         _completed_buyers.add(author_id)
@@ -1688,7 +3103,7 @@ def _deliver_normal(account: Account, chat_id: int, author_id: int, st: dict, ct
     if failed_units == 0 and sent_units == qty:
         order_url = f"https://funpay.com/orders/{order_id}/"
         sm(account, chat_id, "request_review", order_url=order_url)
-    waiting.pop(author_id, None)
+    _drop_waiting(author_id)
 
 def _deliver_choice(account: Account, chat_id: int, author_id: int, st: dict, ctx_user: str):
     order_id = st["order_id"]
@@ -1702,42 +3117,36 @@ def _deliver_choice(account: Account, chat_id: int, author_id: int, st: dict, ct
         return
     sm(account, chat_id, "send_start_choice", gift_title=gift_title, qty=qty, recipient=recipient)
     log_info(ctx_user, f"CHOICE: START delivery {gift_title} x{qty} to {recipient}")
+    hide_my_name = bool(st.get("hide_my_name", ANONYMOUS_GIFTS))
+    results = send_journaled_sync(order_id, [(i, recipient, int(gift_id), price) for i in range(qty)], hide_my_name)
     sent_units = 0
     failed_units = 0
+    uncertain_units = 0
     failed_reasons: List[str] = []
-    for i in range(qty):
-        hide_my_name = bool(st.get("hide_my_name", ANONYMOUS_GIFTS))
-        ok, info = send_gift_sync(recipient, gift_id=int(gift_id), hide_my_name=hide_my_name)   
+    notified: set[str] = set()
+    for i, (_unit, _username, _gid, _price, ok, info) in enumerate(results):
         if ok:
             sent_units += 1
-            time.sleep(0.25)
             log_info(ctx_user, f"CHOICE: OK -> {recipient} [unit {i + 1}/{qty}] gift_id={gift_id}")
             continue
         kind = classify_send_error(str(info))
+        log_warn(ctx_user, f"CHOICE: FAIL -> {recipient}: {kind} :: {short_text(info)}")
+        if kind == "uncertain":
+            uncertain_units += 1
+            continue
         failed_units += 1
         failed_reasons.append(kind)
-        log_warn(ctx_user, f"CHOICE: FAIL -> {recipient}: {kind} :: {short_text(info)}")
-        if kind == "username_not_found":
-            sm(account, chat_id, "send_err_username_not_found")
-            if AUTO_REFUND:
-                if sent_units == 0:
-                    refund_order(account, order_id, chat_id, ctx=ctx_user)
-                else:
-                    remaining = qty - sent_units
-                    try_partial_refund(account, order_id, remaining, {"price": price, "title": gift_title}, chat_id, ctx=ctx_user)
-            break
-        if kind == "balance_low":
-            sm(account, chat_id, "send_err_balance_low_contact")
-            break
-        if kind in ("flood", "spam_block"):
-            sm(account, chat_id, "send_err_flood")
-            break
+        key = {"username_not_found": "send_err_username_not_found", "balance_low": "send_err_balance_low_contact", "flood": "send_err_flood", "spam_block": "send_err_flood", "network": "send_err_network"}.get(kind, "send_err_generic")
+        if key in notified:
+            continue
+        notified.add(key)
+        sm(account, chat_id, key)
         if kind == "network":
-            sm(account, chat_id, "send_err_network")
             _ensure_pyro_alive_sync()
-            break
-        sm(account, chat_id, "send_err_generic")
-        break
+    if "username_not_found" in failed_reasons and AUTO_REFUND:
+        _refund_units_once(account, author_id, st, failed_units, price, gift_title, chat_id, ctx_user)
+    if uncertain_units:
+        log_warn(ctx_user, f"CHOICE: order={order_id} есть единицы с неизвестным статусом ({uncertain_units} шт.) — проверьте вручную, повторно не отправляю")
     if sent_units > 0:
         sm(account, chat_id, "send_done_units", sent_units=sent_units)
     if failed_units > 0:
@@ -1746,7 +3155,480 @@ def _deliver_choice(account: Account, chat_id: int, author_id: int, st: dict, ct
         order_url = f"https://funpay.com/orders/{order_id}/"
         sm(account, chat_id, "request_review", order_url=order_url)
         _completed_buyers.add(author_id)
-    waiting.pop(author_id, None)
+    _drop_waiting(author_id)
+
+DELIVERY_POOL = ThreadPoolExecutor(max_workers=DELIVERY_WORKERS, thread_name_prefix="deliver")
+
+def _run_delivery(fn, *args) -> None:
+    try:
+        fn(*args)
+    except Exception as e:
+        log_error("", f"Ошибка выдачи: {short_text(e)}")
+        logger.debug("Подробности ошибки выдачи:", exc_info=True)
+
+def _start_delivery(fn, *args) -> Future:
+    return DELIVERY_POOL.submit(_run_delivery, fn, *args)
+
+class BuyerDispatcher:
+    def __init__(self, workers: int):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(workers)), thread_name_prefix="buyer")
+        self._lock = threading.Lock()
+        self._queues: Dict[Any, deque] = {}
+
+    def submit(self, key: Any, fn, *args) -> None:
+        with self._lock:
+            q = self._queues.get(key)
+            if q is not None:
+                q.append((fn, args))
+                return
+            self._queues[key] = deque([(fn, args)])
+        self._pool.submit(self._drain, key)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+    def _drain(self, key: Any) -> None:
+        while True:
+            with self._lock:
+                q = self._queues.get(key)
+                if not q:
+                    self._queues.pop(key, None)
+                    return
+                fn, args = q.popleft()
+            try:
+                res = fn(*args)
+            except Exception as e:
+                res = None
+                log_error("", f"Ошибка обработки события: {short_text(e)}")
+                logger.debug("Подробности ошибки обработки события:", exc_info=True)
+            if isinstance(res, Future):
+                res.add_done_callback(lambda _f, key=key: self._pool.submit(self._drain, key))
+                return
+
+def _event_key(event) -> Optional[Tuple[str, Any]]:
+    if isinstance(event, NewOrderEvent):
+        buyer_id = getattr(event.order, "buyer_id", None)
+        return ("buyer", buyer_id) if buyer_id is not None else ("order", event.order.id)
+    if isinstance(event, NewMessageEvent):
+        msg = event.message
+        if msg.interlocutor_id is not None:
+            return ("buyer", msg.interlocutor_id)
+        return ("chat", msg.chat_id)
+    return None
+
+def handle_event(account: Account, event) -> Optional[Future]:
+    now = time.time()
+
+    if isinstance(event, NewOrderEvent):
+        order = account.get_order(event.order.id)
+        buyer_id = getattr(order, "buyer_id", None)
+        if buyer_id is None:
+            return
+
+        if _is_manual_order(order.id):
+            log_warn("manual", f"SKIP auto: order_id={order.id} buyer_id={buyer_id} chat_id={order.chat_id}")
+            try:
+                with _MANUAL_LOCK:
+                    rec = _MANUAL_ORDERS.get(str(order.id), {})
+                    notified = bool(rec.get("notified", False))
+                if not notified:
+                    account.send_message(order.chat_id, "🛑 Этот заказ переведён в ручной режим. Ожидайте продавца.")
+                    _set_manual_notified(order.id)
+            except Exception:
+                pass
+            return
+
+        _completed_buyers.discard(buyer_id)
+        if now - _last_reply_by_buyer.get(buyer_id, 0.0) < COOLDOWN_SECONDS:
+            return
+
+        subcat_id, _ = get_subcategory_id_safe(order, account)
+        if subcat_id not in ALLOWED_CATEGORY_IDS:
+            return
+
+        desc = (getattr(order, "full_description", None) or getattr(order, "short_description", None) or getattr(order, "title", None) or "")
+        gift_num = parse_gift_num(desc)
+        if not gift_num:
+            ctx = f"Buyer {buyer_id} @{getattr(order, 'buyer_username', '')}"
+            log_error(ctx, f"❌ Отсутствует обязательный параметр {GIFT_PARAM_KEY} в описании заказа. Заказ пропущен без ответа в чат.")
+            return
+
+        try:
+            ids_per_unit, price_per_unit, item_title, is_set_any, is_choice, choice_options = resolve_item(gift_num)
+        except KeyError:
+            sm(account, order.chat_id, "gift_num_not_found", gift_param_key=GIFT_PARAM_KEY, gift_num=gift_num)
+            log_info(f"Buyer {buyer_id}", f"{GIFT_PARAM_KEY}:{gift_num} не найден ни в gifts.json, ни в наборах.")
+            _last_reply_by_buyer[buyer_id] = now
+            return
+
+        qty = parse_quantity(order, desc)
+        if qty <= 0:
+            sm(account, order.chat_id, "qty_invalid")
+            _last_reply_by_buyer[buyer_id] = now
+            return
+
+        shown_price = "?"
+        if not is_choice:
+            shown_price = str(int(price_per_unit))
+        ctx_purchase = pretty_order_context(order, gift={"title": item_title, "price": shown_price, "id": ids_per_unit[0] if ids_per_unit else "?"})
+        log_info(ctx_purchase, f"Новый заказ принят. qty={qty}, is_choice={is_choice}, {GIFT_PARAM_KEY}={gift_num}")
+
+        bal = None
+        need_all = 0
+        if is_choice:
+            max_price = _choice_max_price(choice_options)
+            need_all = max_price * qty if max_price > 0 else 0
+        else:
+            price = int(price_per_unit)
+            need_all = price * qty
+
+        if PRECHECK_BALANCE and need_all > 0:
+            prev = waiting.get(buyer_id)
+            if prev and _oid(prev.get("order_id")) != _oid(order.id):
+                release_stars(prev.get("order_id"))
+            pick_idx, pick_bal = reserve_stars_sync(order.id, need_all)
+            if pick_idx is not None and TG_MANAGER is not None:
+                TG_MANAGER.set_active(pick_idx)
+            bal = pick_bal
+            if isinstance(bal, int) and bal < need_all:
+                if AUTO_REFUND:
+                    sm(account, order.chat_id, "seller_balance_low_refund")
+                else:
+                    sm(account, order.chat_id, "seller_balance_low_wait")
+                log_warn(ctx_purchase, f"BALANCE_TOO_LOW pre-check: bal={bal}, need_all={need_all}, qty={qty}")
+                if AUTO_DEACTIVATE:
+                    for cid in CATEGORY_IDS_LIST:
+                        try:
+                            deactivate_lots_over_balance(account, cid, bal)
+                        except Exception as e:
+                            log_error(ctx_purchase, f"Ошибка выборочной деактивации в {cid}: {e}")
+                if AUTO_REFUND:
+                    refund_order(account, order.id, order.chat_id, ctx=ctx_purchase)
+                _last_reply_by_buyer[buyer_id] = now
+                return
+            elif bal is None:
+                sm(account, order.chat_id, "stars_check_unavailable")
+
+        log_info(ctx_purchase, f"need_all={need_all}, bal={bal}")
+
+        if ANON_POLICY == "forced":
+            hide_my_name = bool(ANON_FORCED_VALUE)
+            need_ask = False
+        elif ANON_POLICY == "seller":
+            hide_my_name = bool(ANONYMOUS_GIFTS)
+            need_ask = False
+        else:
+            hide_my_name = None
+            need_ask = True
+
+        next_state = "awaiting_choice_nick" if is_choice else "awaiting_nicks"
+        state = "awaiting_anon" if need_ask else next_state
+
+        waiting[buyer_id] = {
+            "chat_id": order.chat_id,
+            "order_id": order.id,
+            "gift_num": gift_num,
+            "gift_title": item_title,
+            "ids_per_unit": ids_per_unit,
+            "price": int(price_per_unit) if not is_choice else 0,
+            "is_set_any": bool(is_set_any),
+            "is_choice": bool(is_choice),
+            "choice_options": [str(x) for x in (choice_options or [])],
+            "qty": int(qty),
+            "subcat_id": subcat_id,
+            "state": state,
+            "next_state": next_state,
+            "recipients": [],
+            "choice_recipient": None,
+            "choice_selected_key": None,
+            "choice_selected_title": None,
+            "choice_selected_gift_id": None,
+            "choice_selected_price": None,
+        }
+
+        if need_ask:
+            shown_price = ""
+            if not is_choice:
+                shown_price = f"{int(price_per_unit)}⭐"
+            account.send_message(order.chat_id, get_message(
+                "anon_choose_prompt",
+                item_title=item_title,
+                qty=qty,
+                shown_price=shown_price
+            ))
+        else:
+            if is_choice:
+                account.send_message(order.chat_id, get_message("order_start_choice", item_title=item_title, qty=qty))
+            else:
+                shown_price = f"{int(price_per_unit)}⭐"
+                account.send_message(order.chat_id, get_message("order_start_normal", item_title=item_title, qty=qty, shown_price=shown_price))
+
+
+        log_info(ctx_purchase, f"Состояние создано: state={waiting[buyer_id]['state']}")
+        _last_reply_by_buyer[buyer_id] = now
+        return
+
+    elif isinstance(event, NewMessageEvent):
+        msg = event.message
+        chat_id = msg.chat_id
+        author_id = msg.author_id
+        raw_text = msg.text or ""
+        text = _strip_invisible(raw_text).strip()
+        seller_id = getattr(account, "id", None)
+        mstop = _STOP_CMD_RE.match(text)
+        if mstop and seller_id is not None and author_id == seller_id:
+            order_id_arg = mstop.group(1)
+            note = (mstop.group(2) or "").strip()
+
+            found = _find_waiting_by_chat(chat_id)
+            buyer_id = found[0] if found else None
+            st = found[1] if found else None
+
+            order_id = None
+            if order_id_arg:
+                order_id = str(order_id_arg).strip()
+            elif st:
+                order_id = str(st.get("order_id")).strip() if st.get("order_id") is not None else None
+
+            if order_id is not None and st is None:
+                try:
+                    o = account.get_order(order_id)
+                    if o and int(getattr(o, "chat_id", 0) or 0) == int(chat_id):
+                        buyer_id = getattr(o, "buyer_id", None)
+                except Exception:
+                    pass
+
+            _mark_order_manual(order_id, chat_id=chat_id, buyer_id=buyer_id, actor_id=author_id, note=note)
+            log_warn("manual", f"!stop by seller -> order_id={order_id} chat_id={chat_id} buyer_id={buyer_id} note='{note}'")
+
+            if st and buyer_id is not None:
+                _drop_waiting(buyer_id)
+
+            try:
+                account.send_message(chat_id, f"🛑 Заказ #{order_id} переведён в ручной режим. Автовыдача отключена.")
+            except Exception:
+                pass
+
+            _last_reply_by_buyer[author_id] = now
+            return
+
+        if author_id in _completed_buyers:
+            return
+        if now - _last_reply_by_buyer.get(author_id, 0.0) < COOLDOWN_SECONDS:
+            return
+        if author_id == getattr(account, "id", None):
+            return
+
+        manual_oid = _manual_order_for_chat(chat_id)
+        if manual_oid is not None:
+            with _MANUAL_NOTICE_LOCK:
+                notify = now - _last_manual_notice_by_chat.get(int(chat_id), 0.0) >= MANUAL_NOTICE_COOLDOWN
+                if notify:
+                    _last_manual_notice_by_chat[int(chat_id)] = now
+            if notify:
+                log_info("manual", f"Buyer message ignored (manual mode): chat_id={chat_id} order_id={manual_oid} author_id={author_id}")
+                try:
+                    account.send_message(chat_id, "ℹ️ Заказ в ручном режиме. Пожалуйста, ожидайте продавца.")
+                except Exception:
+                    pass
+            _last_reply_by_buyer[author_id] = now
+            return
+
+        if author_id not in waiting:
+            return
+        try:
+            return _handle_buyer_reply(account, chat_id, author_id, waiting[author_id], text, raw_text, now)
+        finally:
+            waiting.commit(author_id)
+
+def _handle_buyer_reply(account: Account, chat_id: int, author_id: int, st: dict, text: str, raw_text: str, now: float) -> Optional[Future]:
+    qty = int(st.get("qty", 1))
+    is_choice = bool(st.get("is_choice"))
+    ctx_user = pretty_order_context(None, buyer_id=author_id, gift={"title": st.get("gift_title", "?"), "price": "?", "id": "?"})
+
+    if st.get("state") == "awaiting_anon":
+        ans = parse_anon_choice(text)
+        if ans is None:
+            sm(account, chat_id, "anon_choose_bad")
+            _last_reply_by_buyer[author_id] = now
+            return
+
+        st["hide_my_name"] = bool(ans)
+        st["state"] = st.get("next_state") or ("awaiting_choice_nick" if st.get("is_choice") else "awaiting_nicks")
+
+        sm(account, chat_id, "anon_chosen", mode=("анонимно" if ans else "не анонимно"))
+
+        if st.get("is_choice"):
+            account.send_message(chat_id, get_message("order_start_choice", item_title=st.get("gift_title", "товар"), qty=int(st.get("qty", 1))))
+        else:
+            shown_price = f"{int(st.get('price', 0) or 0)}⭐" if int(st.get('price', 0) or 0) > 0 else "?"
+            account.send_message(chat_id, get_message("order_start_normal", item_title=st.get("gift_title", "товар"), qty=int(st.get("qty", 1)), shown_price=shown_price))
+
+        _last_reply_by_buyer[author_id] = now
+        return
+
+    if is_choice:
+        maybe_nick = parse_single_recipient(text)
+        if maybe_nick and st["state"] in ("awaiting_choice_pick", "awaiting_choice_confirmation"):
+            missing = _unknown_recipients([maybe_nick])
+            if missing:
+                sm(account, chat_id, "recipients_not_found", usernames=", ".join(missing))
+                _last_reply_by_buyer[author_id] = now
+                return
+            st["choice_recipient"] = maybe_nick
+            log_info(ctx_user, f"CHOICE: получатель обновлён -> {maybe_nick}")
+            if st.get("choice_selected_title"):
+                sm(account, chat_id, "choice_recipient_updated_with_selected", recipient=maybe_nick, gift_title=st["choice_selected_title"], qty=qty)
+            else:
+                sm(account, chat_id, "choice_recipient_updated_no_selected", recipient=maybe_nick)
+            _last_reply_by_buyer[author_id] = now
+            return
+
+        if st["state"] == "awaiting_choice_nick":
+            recip = parse_single_recipient(text)
+            if not recip:
+                sm(account, chat_id, "choice_need_one_nick")
+                _last_reply_by_buyer[author_id] = now
+                return
+            missing = _unknown_recipients([recip])
+            if missing:
+                sm(account, chat_id, "recipients_not_found", usernames=", ".join(missing))
+                _last_reply_by_buyer[author_id] = now
+                return
+            st["choice_recipient"] = recip
+            st["state"] = "awaiting_choice_pick"
+            log_info(ctx_user, f"CHOICE: получатель -> {recip}")
+            options_raw = list(st.get("choice_options") or [])
+            options_norm, menu = _choice_menu(options_raw)
+            st["choice_options"] = options_norm
+            if not options_norm:
+                sm(account, chat_id, "choice_empty_options")
+                log_error(ctx_user, "CHOICE: пустые варианты")
+                if AUTO_REFUND:
+                    refund_order(account, st["order_id"], chat_id, ctx="choice-empty-options")
+                _drop_waiting(author_id)
+                _last_reply_by_buyer[author_id] = now
+                return
+            sm(account, chat_id, "choice_pick_prompt", menu=menu)
+            _last_reply_by_buyer[author_id] = now
+            return
+
+        if st["state"] == "awaiting_choice_pick":
+            options_norm = list(st.get("choice_options") or [])
+            idx = _parse_choice_index(text, max_n=len(options_norm))
+            if idx is None:
+                _, menu = _choice_menu(options_norm)
+                sm(account, chat_id, "choice_bad_number", max_n=len(options_norm), menu=menu)
+                _last_reply_by_buyer[author_id] = now
+                return
+            gift_key = options_norm[idx - 1]
+            g = _gift(gift_key)
+            if not g:
+                sm(account, chat_id, "choice_gift_missing")
+                log_error(ctx_user, f"CHOICE: gift_key={gift_key} отсутствует в gifts.json")
+                if AUTO_REFUND:
+                    refund_order(account, st["order_id"], chat_id, ctx="choice-gift-missing")
+                _drop_waiting(author_id)
+                _last_reply_by_buyer[author_id] = now
+                return
+            recipient = st.get("choice_recipient")
+            if not recipient:
+                st["state"] = "awaiting_choice_nick"
+                sm(account, chat_id, "choice_send_nick_first")
+                _last_reply_by_buyer[author_id] = now
+                return
+            st["choice_selected_key"] = gift_key
+            st["choice_selected_title"] = g.get("title", f"Подарок {gift_key}")
+            st["choice_selected_gift_id"] = int(g["id"])
+            st["choice_selected_price"] = int(g.get("price", 0) or 0)
+            log_info(ctx_user, f"CHOICE: выбрано -> {st['choice_selected_title']} (gift_key={gift_key}), qty={qty}")
+            if REQUIRE_PLUS_CONFIRMATION:
+                st["state"] = "awaiting_choice_confirmation"
+                sm(account, chat_id, "choice_selected_confirm", gift_title=st["choice_selected_title"], recipient=recipient, qty=qty)
+                _last_reply_by_buyer[author_id] = now
+                return
+            else:
+                st["state"] = "delivering"
+                _last_reply_by_buyer[author_id] = now
+                waiting.commit(author_id)
+                return _start_delivery(_deliver_choice, account, chat_id, author_id, st, ctx_user)
+
+        if st["state"] == "awaiting_choice_confirmation":
+            if not is_plus_confirm(raw_text):
+                options_norm = list(st.get("choice_options") or [])
+                idx = _parse_choice_index(text, max_n=len(options_norm))
+                if idx is not None:
+                    gift_key = options_norm[idx - 1]
+                    g = _gift(gift_key)
+                    if not g:
+                        sm(account, chat_id, "choice_selected_missing")
+                        _last_reply_by_buyer[author_id] = now
+                        return
+                    st["choice_selected_key"] = gift_key
+                    st["choice_selected_title"] = g.get("title", f"Подарок {gift_key}")
+                    st["choice_selected_gift_id"] = int(g["id"])
+                    st["choice_selected_price"] = int(g.get("price", 0) or 0)
+                    log_info(ctx_user, f"CHOICE: выбор обновлён -> {st['choice_selected_title']} (gift_key={gift_key})")
+                    recipient = st.get("choice_recipient") or "—"
+                    sm(account, chat_id, "choice_selection_updated", gift_title=st["choice_selected_title"], recipient=recipient, qty=qty)
+                    _last_reply_by_buyer[author_id] = now
+                    return
+                sm(account, chat_id, "choice_need_plus_or_number")
+                _last_reply_by_buyer[author_id] = now
+                return
+            st["state"] = "delivering"
+            _last_reply_by_buyer[author_id] = now
+            waiting.commit(author_id)
+            return _start_delivery(_deliver_choice, account, chat_id, author_id, st, ctx_user)
+
+    if st["state"] == "awaiting_nicks":
+        recips = parse_recipients(text)
+        if not recips:
+            sm(account, chat_id, "normal_bad_format")
+            _last_reply_by_buyer[author_id] = now
+            return
+        missing = _unknown_recipients(recips)
+        if missing:
+            sm(account, chat_id, "recipients_not_found", usernames=", ".join(missing))
+            _last_reply_by_buyer[author_id] = now
+            return
+        st["recipients"] = recips
+        assign = expand_assignment(recips, qty)
+        plan = _format_plan(assign)
+        if REQUIRE_PLUS_CONFIRMATION:
+            st["state"] = "awaiting_confirmation"
+            sm(account, chat_id, "normal_plan_confirm", item_title=st.get("gift_title", "товар"), plan=plan)
+            log_info(ctx_user, f"NORMAL: получатели приняты. plan={plan}")
+            _last_reply_by_buyer[author_id] = now
+            return
+        else:
+            st["state"] = "delivering"
+            _last_reply_by_buyer[author_id] = now
+            waiting.commit(author_id)
+            return _start_delivery(_deliver_normal, account, chat_id, author_id, st, ctx_user)
+
+    if st["state"] == "awaiting_confirmation":
+        if is_plus_confirm(raw_text):
+            st["state"] = "delivering"
+            _last_reply_by_buyer[author_id] = now
+            waiting.commit(author_id)
+            return _start_delivery(_deliver_normal, account, chat_id, author_id, st, ctx_user)
+        recips = parse_recipients(text)
+        missing = _unknown_recipients(recips) if recips else []
+        if missing:
+            sm(account, chat_id, "recipients_not_found", usernames=", ".join(missing))
+        elif recips:
+            st["recipients"] = recips
+            assign = expand_assignment(recips, qty)
+            plan = _format_plan(assign)
+            sm(account, chat_id, "normal_plan_updated", plan=plan)
+            log_info(ctx_user, f"NORMAL: план обновлён. plan={plan}")
+        else:
+            sm(account, chat_id, "normal_need_plus_or_list")
+        _last_reply_by_buyer[author_id] = now
+        return
+
 
 def main():
     check_branding_or_warn()
@@ -1763,7 +3645,7 @@ def main():
     if BAD_TOKENS:
         log_warn("", f"CATEGORY_ID(S) содержит нечисловые значения и они будут проигнорированы: {BAD_TOKENS}")
 
-    account = Account(GOLDEN_KEY)
+    account = Account(GOLDEN_KEY, pool_maxsize=FUNPAY_POOL_MAXSIZE, max_retries=FUNPAY_HTTP_RETRIES)
     try:
         account.get()
     except UnauthorizedError as e:
@@ -1799,405 +3681,27 @@ def main():
             f"AUTO_RAISE_LOTS=ON subcats={AUTO_RAISE_SUBCATS_LIST} "
             f"interval={AUTO_RAISE_INTERVAL_SECONDS}s jitter={AUTO_RAISE_JITTER_SECONDS}s"
         )
-        threading.Thread(target=_auto_raise_loop, args=(GOLDEN_KEY,), daemon=True).start()
+        threading.Thread(target=_auto_raise_loop, args=(GOLDEN_KEY, account.session), daemon=True).start()
     else:
         log_info("raise", "AUTO_RAISE_LOTS=OFF")
+    if AUTO_DEACTIVATE:
+        threading.Thread(target=_lot_index_loop, args=(account,), daemon=True).start()
     _load_manual_orders()
     log_info("manual", f"Загружено ручных заказов: {len(_MANUAL_ORDERS)}")
+    resume = _restore_conversations(account)
 
+    watch_messages(MESSAGES_RELOAD_SECONDS)
     runner = Runner(account)
     log_info("", "Ожидаю события от FunPay...")
 
+    dispatcher = BuyerDispatcher(EVENT_WORKERS)
+    for bid in resume:
+        dispatcher.submit(("buyer", bid), _resume_delivery, account, bid)
     for event in runner.listen(requests_delay=3.0):
-        try:
-            reload_messages()
-            now = time.time()
-
-            if isinstance(event, NewOrderEvent):
-                order = account.get_order(event.order.id)
-                buyer_id = getattr(order, "buyer_id", None)
-                if buyer_id is None:
-                    continue
-
-                if _is_manual_order(order.id):
-                    log_warn("manual", f"SKIP auto: order_id={order.id} buyer_id={buyer_id} chat_id={order.chat_id}")
-                    try:
-                        with _MANUAL_LOCK:
-                            rec = _MANUAL_ORDERS.get(str(order.id), {})
-                            notified = bool(rec.get("notified", False))
-                        if not notified:
-                            account.send_message(order.chat_id, "🛑 Этот заказ переведён в ручной режим. Ожидайте продавца.")
-                            _set_manual_notified(order.id)
-                    except Exception:
-                        pass
-                    continue
-
-                _completed_buyers.discard(buyer_id)
-                if now - _last_reply_by_buyer.get(buyer_id, 0.0) < COOLDOWN_SECONDS:
-                    continue
-
-                subcat_id, _ = get_subcategory_id_safe(order, account)
-                if subcat_id not in ALLOWED_CATEGORY_IDS:
-                    continue
-
-                desc = (getattr(order, "full_description", None) or getattr(order, "short_description", None) or getattr(order, "title", None) or "")
-                gift_num = parse_gift_num(desc)
-                if not gift_num:
-                    ctx = f"Buyer {buyer_id} @{getattr(order, 'buyer_username', '')}"
-                    log_error(ctx, f"❌ Отсутствует обязательный параметр {GIFT_PARAM_KEY} в описании заказа. Заказ пропущен без ответа в чат.")
-                    continue
-
-                try:
-                    ids_per_unit, price_per_unit, item_title, is_set_any, is_choice, choice_options = resolve_item(gift_num)
-                except KeyError:
-                    sm(account, order.chat_id, "gift_num_not_found", gift_param_key=GIFT_PARAM_KEY, gift_num=gift_num)
-                    log_info(f"Buyer {buyer_id}", f"{GIFT_PARAM_KEY}:{gift_num} не найден ни в gifts.json, ни в наборах.")
-                    _last_reply_by_buyer[buyer_id] = now
-                    continue
-
-                qty = parse_quantity(order, desc)
-                if qty <= 0:
-                    sm(account, order.chat_id, "qty_invalid")
-                    _last_reply_by_buyer[buyer_id] = now
-                    continue
-
-                shown_price = "?"
-                if not is_choice:
-                    shown_price = str(int(price_per_unit))
-                ctx_purchase = pretty_order_context(order, gift={"title": item_title, "price": shown_price, "id": ids_per_unit[0] if ids_per_unit else "?"})
-                log_info(ctx_purchase, f"Новый заказ принят. qty={qty}, is_choice={is_choice}, {GIFT_PARAM_KEY}={gift_num}")
-
-                bal = None
-                need_all = 0
-                if is_choice:
-                    max_price = _choice_max_price(choice_options)
-                    need_all = max_price * qty if max_price > 0 else 0
-                else:
-                    price = int(price_per_unit)
-                    need_all = price * qty
-
-                if PRECHECK_BALANCE and need_all > 0:
-                    pick_idx, pick_bal = pick_account_for_need_sync(need_all)
-                    if pick_idx is not None and TG_MANAGER is not None:
-                        TG_MANAGER.set_active(pick_idx)
-                    bal = pick_bal
-                    if isinstance(bal, int) and bal < need_all:
-                        if AUTO_REFUND:
-                            sm(account, order.chat_id, "seller_balance_low_refund")
-                        else:
-                            sm(account, order.chat_id, "seller_balance_low_wait")
-                        log_warn(ctx_purchase, f"BALANCE_TOO_LOW pre-check: bal={bal}, need_all={need_all}, qty={qty}")
-                        if AUTO_DEACTIVATE:
-                            for cid in CATEGORY_IDS_LIST:
-                                try:
-                                    deactivate_lots_over_balance(account, cid, bal)
-                                except Exception as e:
-                                    log_error(ctx_purchase, f"Ошибка выборочной деактивации в {cid}: {e}")
-                        if AUTO_REFUND:
-                            refund_order(account, order.id, order.chat_id, ctx=ctx_purchase)
-                        _last_reply_by_buyer[buyer_id] = now
-                        continue
-                    elif bal is None:
-                        sm(account, order.chat_id, "stars_check_unavailable")
-
-                log_info(ctx_purchase, f"need_all={need_all}, bal={bal}")
-
-                if ANON_POLICY == "forced":
-                    hide_my_name = bool(ANON_FORCED_VALUE)
-                    need_ask = False
-                elif ANON_POLICY == "seller":
-                    hide_my_name = bool(ANONYMOUS_GIFTS)
-                    need_ask = False
-                else:
-                    hide_my_name = None
-                    need_ask = True
-
-                next_state = "awaiting_choice_nick" if is_choice else "awaiting_nicks"
-                state = "awaiting_anon" if need_ask else next_state
-
-                waiting[buyer_id] = {
-                    "chat_id": order.chat_id,
-                    "order_id": order.id,
-                    "gift_num": gift_num,
-                    "gift_title": item_title,
-                    "ids_per_unit": ids_per_unit,
-                    "price": int(price_per_unit) if not is_choice else 0,
-                    "is_set_any": bool(is_set_any),
-                    "is_choice": bool(is_choice),
-                    "choice_options": [str(x) for x in (choice_options or [])],
-                    "qty": int(qty),
-                    "subcat_id": subcat_id,
-                    "state": state,
-                    "next_state": next_state,
-                    "recipients": [],
-                    "choice_recipient": None,
-                    "choice_selected_key": None,
-                    "choice_selected_title": None,
-                    "choice_selected_gift_id": None,
-                    "choice_selected_price": None,
-                }
-
-                if need_ask:
-                    shown_price = ""
-                    if not is_choice:
-                        shown_price = f"{int(price_per_unit)}⭐"
-                    account.send_message(order.chat_id, get_message(
-                        "anon_choose_prompt",
-                        item_title=item_title,
-                        qty=qty,
-                        shown_price=shown_price
-                    ))
-                else:
-                    if is_choice:
-                        account.send_message(order.chat_id, get_message("order_start_choice", item_title=item_title, qty=qty))
-                    else:
-                        shown_price = f"{int(price_per_unit)}⭐"
-                        account.send_message(order.chat_id, get_message("order_start_normal", item_title=item_title, qty=qty, shown_price=shown_price))
-
-
-                log_info(ctx_purchase, f"Состояние создано: state={waiting[buyer_id]['state']}")
-                _last_reply_by_buyer[buyer_id] = now
-                continue
-
-            elif isinstance(event, NewMessageEvent):
-                msg = event.message
-                chat_id = msg.chat_id
-                author_id = msg.author_id
-                raw_text = msg.text or ""
-                text = _strip_invisible(raw_text).strip()
-                seller_id = getattr(account, "id", None)
-                mstop = _STOP_CMD_RE.match(text)
-                if mstop and seller_id is not None and author_id == seller_id:
-                    order_id_arg = mstop.group(1)
-                    note = (mstop.group(2) or "").strip()
-
-                    found = _find_waiting_by_chat(chat_id)
-                    buyer_id = found[0] if found else None
-                    st = found[1] if found else None
-
-                    order_id = None
-                    if order_id_arg:
-                        order_id = str(order_id_arg).strip()
-                    elif st:
-                        order_id = str(st.get("order_id")).strip() if st.get("order_id") is not None else None
-
-                    if order_id is not None and st is None:
-                        try:
-                            o = account.get_order(order_id)
-                            if o and int(getattr(o, "chat_id", 0) or 0) == int(chat_id):
-                                buyer_id = getattr(o, "buyer_id", None)
-                        except Exception:
-                            pass
-
-                    _mark_order_manual(order_id, chat_id=chat_id, buyer_id=buyer_id, actor_id=author_id, note=note)
-                    log_warn("manual", f"!stop by seller -> order_id={order_id} chat_id={chat_id} buyer_id={buyer_id} note='{note}'")
-
-                    if st and buyer_id is not None:
-                        waiting.pop(buyer_id, None)
-
-                    try:
-                        account.send_message(chat_id, f"🛑 Заказ #{order_id} переведён в ручной режим. Автовыдача отключена.")
-                    except Exception:
-                        pass
-
-                    _last_reply_by_buyer[author_id] = now
-                    continue
-
-                if author_id in _completed_buyers:
-                    continue
-                if now - _last_reply_by_buyer.get(author_id, 0.0) < COOLDOWN_SECONDS:
-                    continue
-                if author_id == getattr(account, "id", None):
-                    continue
-
-                manual_oid = _manual_order_for_chat(chat_id)
-                if manual_oid is not None:
-                    last = _last_manual_notice_by_chat.get(int(chat_id), 0.0)
-                    if now - last >= MANUAL_NOTICE_COOLDOWN:
-                        _last_manual_notice_by_chat[int(chat_id)] = now
-                        log_info("manual", f"Buyer message ignored (manual mode): chat_id={chat_id} order_id={manual_oid} author_id={author_id}")
-                        try:
-                            account.send_message(chat_id, "ℹ️ Заказ в ручном режиме. Пожалуйста, ожидайте продавца.")
-                        except Exception:
-                            pass
-                    _last_reply_by_buyer[author_id] = now
-                    continue
-
-                if author_id not in waiting:
-                    continue
-
-                st = waiting[author_id]
-                qty = int(st.get("qty", 1))
-                is_choice = bool(st.get("is_choice"))
-                ctx_user = pretty_order_context(None, buyer_id=author_id, gift={"title": st.get("gift_title", "?"), "price": "?", "id": "?"})
-
-                if st.get("state") == "awaiting_anon":
-                    ans = parse_anon_choice(text)
-                    if ans is None:
-                        sm(account, chat_id, "anon_choose_bad")
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-
-                    st["hide_my_name"] = bool(ans)
-                    st["state"] = st.get("next_state") or ("awaiting_choice_nick" if st.get("is_choice") else "awaiting_nicks")
-
-                    sm(account, chat_id, "anon_chosen", mode=("анонимно" if ans else "не анонимно"))
-
-                    if st.get("is_choice"):
-                        account.send_message(chat_id, get_message("order_start_choice", item_title=st.get("gift_title", "товар"), qty=int(st.get("qty", 1))))
-                    else:
-                        shown_price = f"{int(st.get('price', 0) or 0)}⭐" if int(st.get('price', 0) or 0) > 0 else "?"
-                        account.send_message(chat_id, get_message("order_start_normal", item_title=st.get("gift_title", "товар"), qty=int(st.get("qty", 1)), shown_price=shown_price))
-
-                    _last_reply_by_buyer[author_id] = now
-                    continue
-
-                if is_choice:
-                    maybe_nick = parse_single_recipient(text)
-                    if maybe_nick and st["state"] in ("awaiting_choice_pick", "awaiting_choice_confirmation"):
-                        st["choice_recipient"] = maybe_nick
-                        log_info(ctx_user, f"CHOICE: получатель обновлён -> {maybe_nick}")
-                        if st.get("choice_selected_title"):
-                            sm(account, chat_id, "choice_recipient_updated_with_selected", recipient=maybe_nick, gift_title=st["choice_selected_title"], qty=qty)
-                        else:
-                            sm(account, chat_id, "choice_recipient_updated_no_selected", recipient=maybe_nick)
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-
-                    if st["state"] == "awaiting_choice_nick":
-                        recip = parse_single_recipient(text)
-                        if not recip:
-                            sm(account, chat_id, "choice_need_one_nick")
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        st["choice_recipient"] = recip
-                        st["state"] = "awaiting_choice_pick"
-                        log_info(ctx_user, f"CHOICE: получатель -> {recip}")
-                        options_raw = list(st.get("choice_options") or [])
-                        options_norm, menu = _choice_menu(options_raw)
-                        st["choice_options"] = options_norm
-                        if not options_norm:
-                            sm(account, chat_id, "choice_empty_options")
-                            log_error(ctx_user, "CHOICE: пустые варианты")
-                            if AUTO_REFUND:
-                                refund_order(account, st["order_id"], chat_id, ctx="choice-empty-options")
-                            waiting.pop(author_id, None)
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        sm(account, chat_id, "choice_pick_prompt", menu=menu)
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-
-                    if st["state"] == "awaiting_choice_pick":
-                        options_norm = list(st.get("choice_options") or [])
-                        idx = _parse_choice_index(text, max_n=len(options_norm))
-                        if idx is None:
-                            _, menu = _choice_menu(options_norm)
-                            sm(account, chat_id, "choice_bad_number", max_n=len(options_norm), menu=menu)
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        gift_key = options_norm[idx - 1]
-                        g = GIFTS.get(str(gift_key))
-                        if not g:
-                            sm(account, chat_id, "choice_gift_missing")
-                            log_error(ctx_user, f"CHOICE: gift_key={gift_key} отсутствует в gifts.json")
-                            if AUTO_REFUND:
-                                refund_order(account, st["order_id"], chat_id, ctx="choice-gift-missing")
-                            waiting.pop(author_id, None)
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        recipient = st.get("choice_recipient")
-                        if not recipient:
-                            st["state"] = "awaiting_choice_nick"
-                            sm(account, chat_id, "choice_send_nick_first")
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        st["choice_selected_key"] = gift_key
-                        st["choice_selected_title"] = g.get("title", f"Подарок {gift_key}")
-                        st["choice_selected_gift_id"] = int(g["id"])
-                        st["choice_selected_price"] = int(g.get("price", 0) or 0)
-                        log_info(ctx_user, f"CHOICE: выбрано -> {st['choice_selected_title']} (gift_key={gift_key}), qty={qty}")
-                        if REQUIRE_PLUS_CONFIRMATION:
-                            st["state"] = "awaiting_choice_confirmation"
-                            sm(account, chat_id, "choice_selected_confirm", gift_title=st["choice_selected_title"], recipient=recipient, qty=qty)
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        else:
-                            st["state"] = "delivering"
-                            _deliver_choice(account, chat_id, author_id, st, ctx_user)
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-
-                    if st["state"] == "awaiting_choice_confirmation":
-                        if not is_plus_confirm(raw_text):
-                            options_norm = list(st.get("choice_options") or [])
-                            idx = _parse_choice_index(text, max_n=len(options_norm))
-                            if idx is not None:
-                                gift_key = options_norm[idx - 1]
-                                g = GIFTS.get(str(gift_key))
-                                if not g:
-                                    sm(account, chat_id, "choice_selected_missing")
-                                    _last_reply_by_buyer[author_id] = now
-                                    continue
-                                st["choice_selected_key"] = gift_key
-                                st["choice_selected_title"] = g.get("title", f"Подарок {gift_key}")
-                                st["choice_selected_gift_id"] = int(g["id"])
-                                st["choice_selected_price"] = int(g.get("price", 0) or 0)
-                                log_info(ctx_user, f"CHOICE: выбор обновлён -> {st['choice_selected_title']} (gift_key={gift_key})")
-                                recipient = st.get("choice_recipient") or "—"
-                                sm(account, chat_id, "choice_selection_updated", gift_title=st["choice_selected_title"], recipient=recipient, qty=qty)
-                                _last_reply_by_buyer[author_id] = now
-                                continue
-                            sm(account, chat_id, "choice_need_plus_or_number")
-                            _last_reply_by_buyer[author_id] = now
-                            continue
-                        st["state"] = "delivering"
-                        _deliver_choice(account, chat_id, author_id, st, ctx_user)
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-
-                if st["state"] == "awaiting_nicks":
-                    recips = parse_recipients(text)
-                    if not recips:
-                        sm(account, chat_id, "normal_bad_format")
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-                    st["recipients"] = recips
-                    assign = expand_assignment(recips, qty)
-                    plan = _format_plan(assign)
-                    if REQUIRE_PLUS_CONFIRMATION:
-                        st["state"] = "awaiting_confirmation"
-                        sm(account, chat_id, "normal_plan_confirm", item_title=st.get("gift_title", "товар"), plan=plan)
-                        log_info(ctx_user, f"NORMAL: получатели приняты. plan={plan}")
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-                    else:
-                        st["state"] = "delivering"
-                        _deliver_normal(account, chat_id, author_id, st, ctx_user)
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-
-                if st["state"] == "awaiting_confirmation":
-                    if is_plus_confirm(raw_text):
-                        st["state"] = "delivering"
-                        _deliver_normal(account, chat_id, author_id, st, ctx_user)
-                        _last_reply_by_buyer[author_id] = now
-                        continue
-                    recips = parse_recipients(text)
-                    if recips:
-                        st["recipients"] = recips
-                        assign = expand_assignment(recips, qty)
-                        plan = _format_plan(assign)
-                        sm(account, chat_id, "normal_plan_updated", plan=plan)
-                        log_info(ctx_user, f"NORMAL: план обновлён. plan={plan}")
-                    else:
-                        sm(account, chat_id, "normal_need_plus_or_list")
-                    _last_reply_by_buyer[author_id] = now
-                    continue
-
-        except Exception as e:
-            log_error("", f"Ошибка обработки события: {short_text(e)}")
-            logger.debug("Подробности ошибки обработки события:", exc_info=True)
+        key = _event_key(event)
+        if key is None:
+            continue
+        dispatcher.submit(key, handle_event, account, event)
 
 if __name__ == "__main__":
     main()
@@ -5,6 +5,9 @@ import json
 import os
 import re
 import getpass
+import string
+import threading
+import time
 from dataclasses import dataclass, asdict, field
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional, Union, Any
@@ -66,6 +69,39 @@ ENV_DEFAULTS: Dict[str, str] = {
     "TG_AUTO_SELECT_FOR_PRECHECK": "true",
     "TG_BALANCE_CACHE_SECONDS": "10",
     "TG_FAILOVER_NETWORK_PAUSE": "3",  
+    "FUNPAY_POOL_MAXSIZE": "10",
+    "FUNPAY_HTTP_RETRIES": "2",
+    "EVENT_WORKERS": "8",
+    "DELIVERY_WORKERS": "4",
+    "MESSAGES_RELOAD_SECONDS": "2.0",
+    "TG_PARALLEL_SEND": "true",
+    "TG_BALANCE_PROBE_TIMEOUT": "8",
+    "TG_PICK_POLICY": "best_fit",
+    "TG_RESERVATION_TTL": "1800",
+    "TG_LEDGER_RECONCILE_SECONDS": "60",
+    "TG_GLOBAL_SEND_DELAY": "0",
+    "USERNAME_NEGATIVE_TTL": "900",
+    "USERNAME_CACHE_MAX": "50000",
+    "RECIPIENT_PREWARM": "true",
+    "RECIPIENT_PREWARM_WAIT": "1.5",
+    "TG_STARTUP_CONCURRENCY": "4",
+    "TG_STARTUP_TIMEOUT": "20",
+    "TG_HEALTH_INTERVAL": "30",
+    "TG_HEALTH_PING_TIMEOUT": "10",
+    "TG_HEALTH_MAX_FAILS": "2",
+    "TG_HEALTH_RESTART_BACKOFF": "5",
+    "TG_HEALTH_MAX_BACKOFF": "600",
+    "STATE_BACKEND": "sqlite",
+    "WAITING_TTL": "172800",
+    "COMPLETED_BUYERS_TTL": "604800",
+    "DELIVERY_JOURNAL_TTL": "2592000",
+    "DELIVERY_JOURNAL_BATCH": "32",
+    "LOT_UPDATE_CONCURRENCY": "6",
+    "LOT_UPDATE_MAX_429": "8",
+    "FUNPAY_429_BACKOFF": "2",
+    "FUNPAY_429_MAX_BACKOFF": "60",
+    "LOT_INDEX_REFRESH_SECONDS": "600",
+    "LOT_INDEX_MAX_AGE": "86400",
 }
 
 TG_ENV_HELP: Dict[str, str] = {
@@ -135,6 +171,8 @@ DEFAULT_MESSAGES: Dict[str, str] = {
     "send_err_network": "⚠️ Проблема с соединением с Telegram. Попробуйте позже.",
     "send_err_network_choice": "⚠️ Проблема связи с Telegram. Попробуйте позже.",
     "send_err_username_not_found": "❌ Никнейм не найден в Telegram. Проверьте @username.",
+    "recipients_not_found": "❌ Не найдены в Telegram: {usernames}. Проверьте ники и пришлите их заново.",
+    "delivery_resumed": "⚠️ Выдача была прервана перезапуском бота — продолжаю с того места, где остановился.",
     "send_err_generic": "⚠️ Ошибка отправки. Попробуйте позже или свяжитесь с продавцом.",
     "sent_success": "🎉 Успешно отправлено: {sent_units} шт.",
     "sent_failed": "⚠️ Не удалось отправить: {failed_units} шт. Причины: {reasons}",
@@ -222,17 +260,19 @@ class ChoiceGiftSet:
 
 GiftSet = Union[FixedGiftSet, ChoiceGiftSet]
 
-def load_base_gifts() -> Dict[str, Dict]:
-    if GIFTS_JSON.exists():
-        with GIFTS_JSON.open("r", encoding="utf-8") as f:
+def load_base_gifts(path: Optional[Path] = None) -> Dict[str, Dict]:
+    path = path or GIFTS_JSON
+    if path.exists():
+        with path.open("r", encoding="utf-8") as f:
             data = json.load(f)
         return {str(k): v for k, v in data.items()}
     return DEFAULT_GIFTS
 
-def load_sets() -> Dict[str, GiftSet]:
-    if not SETS_JSON.exists():
+def load_sets(path: Optional[Path] = None) -> Dict[str, GiftSet]:
+    path = path or SETS_JSON
+    if not path.exists():
         return {}
-    with SETS_JSON.open("r", encoding="utf-8") as f:
+    with path.open("r", encoding="utf-8") as f:
         raw = json.load(f)
 
     out: Dict[str, GiftSet] = {}
@@ -864,24 +904,120 @@ def _get_env(key: str) -> Optional[str]:
     v = v.strip()
     return v if v else None
 
-_MESSAGES_CACHE: Optional[Dict[str, str]] = None
-_MESSAGES_MTIME: float = 0.0
+@dataclass(frozen=True)
+class CatalogEntry:
+    key: str
+    title: str
+    ids: Tuple[int, ...] = ()
+    price: int = 0
+    is_set: bool = False
+    is_choice: bool = False
+    options: Tuple[str, ...] = ()
+
+@dataclass(frozen=True)
+class CatalogIndex:
+    gifts: Dict[str, Dict]
+    sets: Dict[str, GiftSet]
+    entries: Dict[str, CatalogEntry]
+    choice_max_price: Dict[Tuple[str, ...], int]
+
+def _gift_price(g: Optional[Dict]) -> int:
+    try:
+        return int((g or {}).get("price", 0) or 0)
+    except (TypeError, ValueError):
+        return 0
+
+def build_catalog_index(base: Dict[str, Dict], sets: Dict[str, GiftSet]) -> CatalogIndex:
+    entries: Dict[str, CatalogEntry] = {}
+    choice_max: Dict[Tuple[str, ...], int] = {}
+    for k, g in base.items():
+        try:
+            entries[k] = CatalogEntry(key=k, title=g.get("title", f"Подарок #{k}"), ids=(int(g["id"]),),
+                                      price=int(g.get("price", 0)))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            continue
+    for k, st in sets.items():
+        title = st.title or f"Набор #{k}"
+        if isinstance(st, ChoiceGiftSet):
+            options = tuple(str(x) for x in st.options)
+            prices = [p for p in (_gift_price(base.get(o)) for o in options) if p > 0]
+            choice_max[options] = max(prices) if prices else 0
+            entries[k] = CatalogEntry(key=k, title=title, is_set=True, is_choice=True, options=options)
+            continue
+        try:
+            entries[k] = CatalogEntry(key=k, title=title, ids=tuple(st.expand_to_gift_ids(base)),
+                                      price=int(st.compute_price(base)), is_set=True)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return CatalogIndex(gifts=base, sets=sets, entries=entries, choice_max_price=choice_max)
+
+class GiftCatalog:
+    def __init__(self, gifts_path: Path = GIFTS_JSON, sets_path: Path = SETS_JSON, check_interval: float = 1.0):
+        self.gifts_path = gifts_path
+        self.sets_path = sets_path
+        self.check_interval = float(check_interval)
+        self._lock = threading.Lock()
+        self._stamp: Optional[Tuple] = None
+        self._checked_at = 0.0
+        self._index: Optional[CatalogIndex] = None
+
+    def _file_stamp(self) -> Tuple:
+        out = []
+        for p in (self.gifts_path, self.sets_path):
+            try:
+                st = p.stat()
+                out.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                out.append(None)
+        return tuple(out)
+
+    def _load(self) -> CatalogIndex:
+        return build_catalog_index(load_base_gifts(self.gifts_path), load_sets(self.sets_path))
+
+    def index(self) -> CatalogIndex:
+        now = time.monotonic()
+        idx = self._index
+        if idx is not None and now - self._checked_at < self.check_interval:
+            return idx
+        with self._lock:
+            if self._index is not None and now - self._checked_at < self.check_interval:
+                return self._index
+            stamp = self._file_stamp()
+            if self._index is None or stamp != self._stamp:
+                try:
+                    self._index = self._load()
+                    self._stamp = stamp
+                except Exception:
+                    if self._index is None:
+                        raise
+            self._checked_at = now
+            return self._index
+
+    def reload(self) -> CatalogIndex:
+        with self._lock:
+            self._index = None
+            self._checked_at = 0.0
+        return self.index()
+
+    def get(self, key: str | int) -> Optional[CatalogEntry]:
+        return self.index().entries.get(str(key))
+
+    def gift(self, key: str | int) -> Optional[Dict]:
+        return self.index().gifts.get(str(key))
+
+    def choice_max_price(self, options: List[str]) -> int:
+        idx = self.index()
+        opts = tuple(str(x) for x in options or [])
+        mx = idx.choice_max_price.get(opts)
+        if mx is None:
+            prices = [p for p in (_gift_price(idx.gifts.get(o)) for o in opts) if p > 0]
+            mx = max(prices) if prices else 0
+        return mx
 
 def _ensure_messages_file() -> None:
     if not MESSAGES_JSON.exists():
         save_messages(dict(DEFAULT_MESSAGES))
 
-def _maybe_reload_messages() -> None:
-    global _MESSAGES_CACHE, _MESSAGES_MTIME
-    _ensure_messages_file()
-    try:
-        mt = MESSAGES_JSON.stat().st_mtime
-    except Exception:
-        return
-    if _MESSAGES_CACHE is None or mt != _MESSAGES_MTIME:
-        _MESSAGES_CACHE = load_messages()
-        _MESSAGES_MTIME = mt
-
 def load_messages() -> Dict[str, str]:
     _ensure_messages_file()
     try:
@@ -909,24 +1045,96 @@ class _SafeDict(dict):
     def __missing__(self, key):
         return "{" + str(key) + "}"
 
+_FORMATTER = string.Formatter()
+
+class MessageTemplate:
+    __slots__ = ("text", "static")
+
+    def __init__(self, text: str):
+        self.text = str(text)
+        self.static: Optional[str] = None
+        if "{" not in self.text and "}" not in self.text:
+            self.static = self.text
+        else:
+            try:
+                list(_FORMATTER.parse(self.text))
+            except ValueError:
+                self.static = self.text
+
+    def render(self, kwargs: Dict[str, Any]) -> str:
+        if self.static is not None:
+            return self.static
+        try:
+            return self.text.format_map(_SafeDict(kwargs))
+        except Exception:
+            return self.text
+
+class MessageStore:
+    def __init__(self, poll_interval: float = 2.0):
+        self.poll_interval = float(poll_interval)
+        self._lock = threading.Lock()
+        self._templates: Optional[Dict[str, MessageTemplate]] = None
+        self._stamp: Optional[Tuple[int, int]] = None
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _file_stamp(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = MESSAGES_JSON.stat()
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
+
+    def reload(self, force: bool = True) -> bool:
+        with self._lock:
+            _ensure_messages_file()
+            stamp = self._file_stamp()
+            if not force and self._templates is not None and stamp == self._stamp:
+                return False
+            merged = dict(DEFAULT_MESSAGES)
+            merged.update(load_messages())
+            self._templates = {k: MessageTemplate(v) for k, v in merged.items()}
+            self._stamp = stamp
+            return True
+
+    def render(self, key: str, **kwargs) -> str:
+        templates = self._templates
+        if templates is None:
+            self.reload(force=False)
+            templates = self._templates or {}
+        tpl = templates.get(str(key))
+        return tpl.render(kwargs) if tpl is not None else ""
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.reload(force=False)
+            except Exception:
+                pass
+
+    def start_watcher(self, poll_interval: Optional[float] = None) -> None:
+        if poll_interval is not None:
+            self.poll_interval = max(0.1, float(poll_interval))
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="messages-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+
+MESSAGES = MessageStore()
+
 def get_message(key: str, **kwargs) -> str:
-    global _MESSAGES_CACHE
-    _maybe_reload_messages()
-    tpl = None
-    if _MESSAGES_CACHE:
-        tpl = _MESSAGES_CACHE.get(str(key))
-    if tpl is None:
-        tpl = DEFAULT_MESSAGES.get(str(key), "")
-    try:
-        return str(tpl).format_map(_SafeDict(kwargs))
-    except Exception:
-        return str(tpl)
+    return MESSAGES.render(key, **kwargs)
 
 def reload_messages() -> None:
-    global _MESSAGES_CACHE, _MESSAGES_MTIME
-    _MESSAGES_CACHE = None
-    _MESSAGES_MTIME = 0.0
-    _maybe_reload_messages()
+    MESSAGES.reload()
+
+def watch_messages(poll_interval: Optional[float] = None) -> None:
+    MESSAGES.reload(force=False)
+    MESSAGES.start_watcher(poll_interval)
 
 def list_message_keys() -> List[str]:
     custom = load_messages()
@@ -0,0 +1,40 @@
+"""
+Микро-бенчмарк классификатора системных сообщений: прежняя последовательная проверка выражений
+против объединенного выражения RegularExpressions.get_message_type.
+
+Запуск: python tests/bench_message_types.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from FunPayAPI.common.utils import RegularExpressions  # noqa: E402
+
+from message_samples import CHAT_SAMPLES, SYSTEM_SAMPLES, bot_message_samples, corpus, \
+    legacy_message_type  # noqa: E402
+
+
+def bench(name: str, texts: list[str], repeat: int = 5) -> None:
+    res = RegularExpressions()
+    new = res.get_message_type
+    results = []
+    for func in (legacy_message_type, new):
+        best = min(timeit.repeat(lambda: [func(i) for i in texts], number=1, repeat=repeat))
+        results.append(best / len(texts) * 1e6)
+    print(f"{name:<28} {len(texts):>6} текстов | было {results[0]:6.2f} мкс | стало {results[1]:6.2f} мкс | "
+          f"x{results[0] / results[1]:.1f}")
+
+
+def main() -> None:
+    plain = (CHAT_SAMPLES + bot_message_samples()) * 100
+    system = [text for texts in SYSTEM_SAMPLES.values() for text in texts] * 100
+    bench("смешанный корпус (80/20)", corpus())
+    bench("сообщения пользователей", plain)
+    bench("системные сообщения", system)
+
+
+if __name__ == "__main__":
+    main()
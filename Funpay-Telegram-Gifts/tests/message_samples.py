@@ -0,0 +1,178 @@
+"""
+Образцы текстов сообщений FunPay и прежний (последовательный) классификатор системных сообщений.
+Используются в tests/test_message_types.py и tests/bench_message_types.py.
+"""
+import json
+import os
+import random
+
+from FunPayAPI.common.enums import MessageTypes
+from FunPayAPI.common.utils import RegularExpressions
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SYSTEM_SAMPLES: dict[MessageTypes, list[str]] = {
+    MessageTypes.DISCORD: [
+        "Вы можете перейти в Discord. Внимание: общение за пределами сервера FunPay считается нарушением правил.",
+        "You can switch to Discord. However, note that friending someone is considered a violation rules.",
+    ],
+    MessageTypes.DEAR_VENDORS: [
+        "Уважаемые продавцы, не доверяйте сообщениям в чате! Перед выполнением заказа всегда проверяйте наличие "
+        "оплаты в разделе «Мои продажи».",
+        "Dear vendors, do not rely on chat messages! Before you process an order, you should always check whether "
+        "you've been paid in «My sales» section.",
+    ],
+    MessageTypes.ORDER_PURCHASED: [
+        "Покупатель Buyer1 оплатил заказ #ABCD1234. Telegram, Подарки, 1 шт.\n"
+        "Buyer1, не забудьте потом нажать кнопку «Подтвердить выполнение заказа».",
+        "Покупатель Buyer1 оплатил заказ #ABCD1234. Telegram, Звёзды, 100 шт.\n"
+        "Buyer1, не забудьте потом нажать кнопку «Подтвердить получение валюты».",
+        "The buyer Buyer1 has paid for order #ABCD1234. Telegram, Gifts, 1 pcs.\n"
+        "Buyer1, do not forget to press the «Confirm order fulfilment» button once you finish.",
+        "The buyer Buyer1 has paid for order #ABCD1234. Telegram, Stars, 100 pcs.\n"
+        "Buyer1, do not forget to press the «Confirm currency receipt» button once you finish.",
+    ],
+    MessageTypes.ORDER_CONFIRMED: [
+        "Покупатель Buyer1 подтвердил успешное выполнение заказа #ABCD1234 и отправил деньги продавцу Seller1.",
+        "The buyer Buyer1 has confirmed that order #ABCD1234 has been fulfilled successfully and that the seller "
+        "Seller1 has been paid.",
+    ],
+    MessageTypes.NEW_FEEDBACK: [
+        "Покупатель Buyer1 написал отзыв к заказу #ABCD1234.",
+        "The buyer Buyer1 has given feedback to the order #ABCD1234.",
+    ],
+    MessageTypes.FEEDBACK_CHANGED: [
+        "Покупатель Buyer1 изменил отзыв к заказу #ABCD1234.",
+        "The buyer Buyer1 has edited their feedback to the order #ABCD1234.",
+    ],
+    MessageTypes.FEEDBACK_DELETED: [
+        "Покупатель Buyer1 удалил отзыв к заказу #ABCD1234.",
+        "The buyer Buyer1 has deleted their feedback to the order #ABCD1234.",
+    ],
+    MessageTypes.NEW_FEEDBACK_ANSWER: [
+        "Продавец Seller1 ответил на отзыв к заказу #ABCD1234.",
+        "The seller Seller1 has replied to their feedback to the order #ABCD1234.",
+    ],
+    MessageTypes.FEEDBACK_ANSWER_CHANGED: [
+        "Продавец Seller1 изменил ответ на отзыв к заказу #ABCD1234.",
+        "The seller Seller1 has edited a reply to their feedback to the order #ABCD1234.",
+    ],
+    MessageTypes.FEEDBACK_ANSWER_DELETED: [
+        "Продавец Seller1 удалил ответ на отзыв к заказу #ABCD1234.",
+        "The seller Seller1 has deleted a reply to their feedback to the order #ABCD1234.",
+    ],
+    MessageTypes.ORDER_REOPENED: [
+        "Заказ #ABCD1234 открыт повторно.",
+        "Order #ABCD1234 has been reopened.",
+    ],
+    MessageTypes.REFUND: [
+        "Продавец Seller1 вернул деньги покупателю Buyer1 по заказу #ABCD1234.",
+        "The seller Seller1 has refunded the buyer Buyer1 on order #ABCD1234.",
+    ],
+    MessageTypes.REFUND_BY_ADMIN: [
+        "Администратор Admin1 вернул деньги покупателю Buyer1 по заказу #ABCD1234.",
+        "The administrator Admin1 has refunded the buyer Buyer1 on order #ABCD1234.",
+    ],
+    MessageTypes.PARTIAL_REFUND: [
+        "Часть средств по заказу #ABCD1234 возвращена покупателю.",
+        "A part of the funds pertaining to the order #ABCD1234 has been refunded.",
+    ],
+    MessageTypes.ORDER_CONFIRMED_BY_ADMIN: [
+        "Администратор Admin1 подтвердил успешное выполнение заказа #ABCD1234 и отправил деньги продавцу Seller1.",
+        "The administrator Admin1 has confirmed that order #ABCD1234 has been fulfilled successfully and that the "
+        "seller Seller1 has been paid.",
+    ],
+}
+"""Системные сообщения FunPay по типам."""
+
+CHAT_SAMPLES: list[str] = [
+    "",
+    "Здравствуйте!",
+    "Мой ник: @buyer_one",
+    "Подарок отправлен",
+    "Проверка заказа",
+    "Заказ #ABCD1234 — когда будет?",
+    "#ABCD1234",
+    "Покупатель Buyer1 оплатил заказ #ABCD1234.",
+    "Покупатель Buyer1 оплатил заказ #abcd1234. Buyer1, не забудьте потом нажать кнопку «Подтвердить выполнение заказа».",
+    "Продавец Seller1 вернул деньги",
+    "Администратор, помогите",
+    "discord: user#1234",
+    "Dear vendors",
+    "продавцы, привет",
+    "Buyer1, не забудьте потом нажать кнопку «Подтвердить выполнение заказа».",
+    "Изображение",
+    "Image",
+    "!stop ABCD1234 не тот ник",
+    "1",
+    "Спасибо! ⭐⭐⭐⭐⭐",
+]
+"""Обычные сообщения пользователей (включая похожие на системные)."""
+
+
+def bot_message_samples() -> list[str]:
+    """Тексты сообщений бота из messages.json."""
+    with open(os.path.join(ROOT_DIR, "messages.json"), encoding="utf-8") as f:
+        return [i for i in json.load(f).values() if isinstance(i, str)]
+
+
+def all_samples() -> list[str]:
+    """Все образцы: системные, пользовательские, сообщения бота и их склейки."""
+    system = [text for texts in SYSTEM_SAMPLES.values() for text in texts]
+    plain = CHAT_SAMPLES + bot_message_samples()
+    samples = system + plain
+    # склейки: системное сообщение посреди текста, несколько системных сообщений в одном тексте
+    samples.extend(f"{a} {b}" for a in system for b in system)
+    samples.extend(f"{a}\n{b}" for a in plain[:10] for b in system)
+    rnd = random.Random(0)
+    samples.extend(" ".join(rnd.choice(samples) for _ in range(3)) for _ in range(500))
+    return samples
+
+
+def corpus(size: int = 10000) -> list[str]:
+    """
+    Корпус для бенчмарка: как в реальном раннере, большая часть текстов - обычные сообщения пользователей и бота.
+    """
+    rnd = random.Random(1)
+    system = [text for texts in SYSTEM_SAMPLES.values() for text in texts]
+    plain = CHAT_SAMPLES + bot_message_samples()
+    return [rnd.choice(system) if rnd.random() < 0.2 else rnd.choice(plain) for _ in range(size)]
+
+
+def legacy_message_type(text: str | None) -> MessageTypes:
+    """Прежняя реализация Message.get_message_type(): выражения проверяются по очереди."""
+    if not text:
+        return MessageTypes.NON_SYSTEM
+
+    res = RegularExpressions()
+    if res.DISCORD.search(text):
+        return MessageTypes.DISCORD
+    if res.DEAR_VENDORS.search(text):
+        return MessageTypes.DEAR_VENDORS
+
+    if res.ORDER_PURCHASED.findall(text) and res.ORDER_PURCHASED2.findall(text):
+        return MessageTypes.ORDER_PURCHASED
+
+    if res.ORDER_ID.search(text) is None:
+        return MessageTypes.NON_SYSTEM
+
+    sys_msg_types = {
+        MessageTypes.ORDER_CONFIRMED: res.ORDER_CONFIRMED,
+        MessageTypes.NEW_FEEDBACK: res.NEW_FEEDBACK,
+        MessageTypes.NEW_FEEDBACK_ANSWER: res.NEW_FEEDBACK_ANSWER,
+        MessageTypes.FEEDBACK_CHANGED: res.FEEDBACK_CHANGED,
+        MessageTypes.FEEDBACK_DELETED: res.FEEDBACK_DELETED,
+        MessageTypes.REFUND: res.REFUND,
+        MessageTypes.FEEDBACK_ANSWER_CHANGED: res.FEEDBACK_ANSWER_CHANGED,
+        MessageTypes.FEEDBACK_ANSWER_DELETED: res.FEEDBACK_ANSWER_DELETED,
+        MessageTypes.ORDER_CONFIRMED_BY_ADMIN: res.ORDER_CONFIRMED_BY_ADMIN,
+        MessageTypes.PARTIAL_REFUND: res.PARTIAL_REFUND,
+        MessageTypes.ORDER_REOPENED: res.ORDER_REOPENED,
+        MessageTypes.REFUND_BY_ADMIN: res.REFUND_BY_ADMIN
+    }
+
+    for i in sys_msg_types:
+        if sys_msg_types[i].search(text):
+            return i
+    else:
+        return MessageTypes.NON_SYSTEM
@@ -0,0 +1,195 @@
+"""
+Проверка, что бэкенды html_parser (lxml и BeautifulSoup) дают одинаковый результат на сохраненных страницах FunPay.
+"""
+import enum
+import json
+import os
+
+import pytest
+import requests
+
+from FunPayAPI import Account, Runner, types
+from FunPayAPI.common import html_parser
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+BACKENDS = ("lxml", "bs4")
+PAGES = ("main.html", "sales.html", "order.html", "lot_fields.html", "my_lots.html")
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURES_DIR, name), encoding="utf-8") as f:
+        return f.read()
+
+
+def make_response(content: str) -> requests.Response:
+    response = requests.Response()
+    response._content = content.encode()
+    response.status_code = 200
+    response.url = "https://funpay.com/"
+    return response
+
+
+def dump(obj, seen: frozenset = frozenset()):
+    """Превращает модель FunPayAPI в сравнимую структуру из встроенных типов."""
+    if obj is None or isinstance(obj, (str, int, float, bool)):
+        return obj
+    if isinstance(obj, enum.Enum):
+        return repr(obj)
+    if isinstance(obj, (list, tuple, set)):
+        return [dump(i, seen) for i in obj]
+    if isinstance(obj, dict):
+        return {k if isinstance(k, str) else repr(k): dump(v, seen) for k, v in obj.items()}
+    if isinstance(obj, types.SubCategory):
+        return ["SubCategory", obj.id, obj.name, repr(obj.type), obj.category.id, obj.position]
+    if isinstance(obj, types.Category):
+        return ["Category", obj.id, obj.name, obj.position, [dump(i) for i in obj.get_subcategories()]]
+    if isinstance(obj, (html_parser.Node, Account, requests.Response)) or id(obj) in seen:
+        return type(obj).__name__
+    seen = seen | {id(obj)}
+    fields = dict(getattr(obj, "__dict__", {}))
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            if hasattr(obj, slot):
+                fields[slot] = getattr(obj, slot)
+    if not fields:
+        return repr(obj)
+    return [type(obj).__name__, {k: dump(v, seen) for k, v in sorted(fields.items())}]
+
+
+def make_account() -> Account:
+    account = Account("golden_key", keep_html=True)
+    account._parse_account_page(make_response(read_fixture("main.html")))
+    return account
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+    previous = html_parser.get_backend()
+    html_parser.set_backend(request.param)
+    yield request.param
+    html_parser.set_backend(previous)
+
+
+def run_all_backends(func):
+    """Выполняет func на каждом бэкенде и возвращает результаты {бэкенд: результат}."""
+    previous = html_parser.get_backend()
+    results = {}
+    try:
+        for backend in BACKENDS:
+            html_parser.set_backend(backend)
+            results[backend] = dump(func())
+    finally:
+        html_parser.set_backend(previous)
+    return results
+
+
+def assert_same(func):
+    results = run_all_backends(func)
+    assert results["lxml"] == results["bs4"]
+    return results["lxml"]
+
+
+def test_parse_returns_backend_tree(backend):
+    tree = html_parser.parse(read_fixture("main.html"))
+    if backend == "lxml":
+        assert isinstance(tree, html_parser.Node)
+    else:
+        assert not isinstance(tree, html_parser.Node)
+
+
+@pytest.mark.parametrize("page", PAGES)
+def test_tree_identical(page):
+    # сам корень документа не сравнивается: BeautifulSoup хранит в нем <!DOCTYPE> и пробелы вокруг <html>,
+    # а парсеры FunPayAPI работают только с найденными тегами
+    def walk():
+        root = html_parser.parse(read_fixture(page))
+        return [(i.name, i.attrs, i.text, str(i)) for i in root.find_all()]
+
+    assert_same(walk)
+
+
+def test_boolean_attributes(backend):
+    tree = html_parser.parse('<input name="a" checked><input name="b" checked="checked"><input name="c">')
+    assert [i["name"] for i in tree.find_all("input", checked=True)] == ["a", "b"]
+    assert tree.find("input", {"name": "a"})["checked"] == ""
+
+
+def test_account_page_identical():
+    def parse():
+        account = make_account()
+        return {
+            "username": account.username, "id": account.id, "csrf_token": account.csrf_token,
+            "app_data": account.app_data, "logout_link": account._logout_link,
+            "active_sales": account.active_sales, "active_purchases": account.active_purchases,
+            "total_balance": account.total_balance, "currency": account.currency,
+            "categories": account.categories
+        }
+
+    result = assert_same(parse)
+    assert result["username"] == "TestSeller"
+    assert result["total_balance"] == 12345
+    assert [i[1] for i in result["categories"]] == [2, 10, 11]
+
+
+def test_sales_identical():
+    def parse():
+        account = make_account()
+        return account._parse_sales(make_response(read_fixture("sales.html")))
+
+    next_order_id, sales, locale, subcategories = assert_same(parse)
+    assert next_order_id == "MNOP3456"
+    assert len(sales) == 4
+    assert locale == "ru"
+    assert len(subcategories) == 3
+
+
+def test_order_identical():
+    def parse():
+        account = make_account()
+        return account._parse_order(make_response(read_fixture("order.html")), "ABCD1234")
+
+    order = assert_same(parse)[1]
+    assert order["amount"] == 1000
+    assert order["buyer_id"] == 555
+    assert order["order_secrets"] == ["CODE-1", "CODE-2"]
+    assert order["review"][1]["stars"] == 5
+
+
+def test_lot_fields_identical():
+    def parse():
+        account = make_account()
+        return account._parse_lot_fields(make_response(read_fixture("lot_fields.html")), 424242)
+
+    lot_fields = assert_same(parse)[1]
+    fields = lot_fields["_LotFields__fields"] if "_LotFields__fields" in lot_fields else lot_fields["fields"]
+    assert fields["fields[gift_tg]"] == "bear"
+    assert fields["active"] == "on"
+    assert "fields[hidden_field]" not in fields
+
+
+def test_my_lots_identical():
+    def parse():
+        account = make_account()
+        account.method = lambda *args, **kwargs: make_response(read_fixture("my_lots.html"))
+        return account.get_my_subcategory_lots(1000)
+
+    lots = assert_same(parse)
+    assert len(lots) == 2
+
+
+def test_chats_and_histories_identical():
+    runner_response = json.loads(read_fixture("runner.json"))
+
+    def parse():
+        account = make_account()
+        runner = Runner(account, disable_message_requests=True)
+        events = runner.parse_chat_updates(runner_response["objects"][0])
+        chats_data = {91001: None, "flood": None, 91005: None}
+        histories = account._parse_chats_histories(make_response(json.dumps(runner_response)), chats_data)
+        return events, histories, runner.buyers_viewing
+
+    events, histories, buyers_viewing = assert_same(parse)
+    assert len(events) == 3
+    assert len(histories["91001"]) == 7
+    assert histories["91005"] == []
+    assert set(buyers_viewing) == {"555", "777"}
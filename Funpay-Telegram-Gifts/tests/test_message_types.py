@@ -0,0 +1,42 @@
+"""
+Проверка, что объединенное выражение (RegularExpressions.get_message_type) классифицирует сообщения так же,
+как прежняя последовательная проверка выражений.
+"""
+import pytest
+
+from FunPayAPI import types
+from FunPayAPI.common.enums import MessageTypes
+from FunPayAPI.common.utils import RegularExpressions
+
+from message_samples import SYSTEM_SAMPLES, all_samples, legacy_message_type
+
+
+@pytest.mark.parametrize("msg_type", list(SYSTEM_SAMPLES))
+def test_system_samples(msg_type):
+    for text in SYSTEM_SAMPLES[msg_type]:
+        assert RegularExpressions().get_message_type(text) is msg_type
+        assert legacy_message_type(text) is msg_type
+
+
+def test_every_system_type_has_samples():
+    assert set(SYSTEM_SAMPLES) == set(RegularExpressions().SYSTEM_MESSAGE_TYPES)
+
+
+def test_same_as_legacy():
+    res = RegularExpressions()
+    mismatches = [(text, res.get_message_type(text), legacy_message_type(text)) for text in all_samples()
+                  if res.get_message_type(text) is not legacy_message_type(text)]
+    assert not mismatches
+
+
+def test_none_text():
+    assert RegularExpressions().get_message_type(None) is MessageTypes.NON_SYSTEM
+    assert legacy_message_type(None) is MessageTypes.NON_SYSTEM
+
+
+def test_models_delegate():
+    for text in all_samples()[:200]:
+        message = types.Message(1, text, 1, None, None, None, 0, None, determine_msg_type=False)
+        chat = types.ChatShortcut(1, "name", text, 1, 1, False, None)
+        assert message.get_message_type() is legacy_message_type(text)
+        assert chat.get_last_message_type() is legacy_message_type(text)